@@ -0,0 +1,49 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.backup_manager import BackupManager  # noqa: E402
+from src.blockchain import PersonalBlockchain  # noqa: E402
+from src.compression import CODEC_IDS  # noqa: E402
+
+
+def build_chain(key_scheme, posts):
+    # A mix of individually signed posts and Merkle batch-signed ones, like a real feed
+    blockchain = PersonalBlockchain("BenchUser", key_scheme=key_scheme)
+    for i in range(posts // 2):
+        blockchain.add_block({"message": f"Post number {i}: " + "what a day " * (i % 5 + 1),
+                              "tags": ["news", "friends"], "likes": i})
+    blockchain.add_blocks([{"message": f"Batched post {i}", "tags": ["batch"], "likes": i}
+                           for i in range(posts - posts // 2)])
+    return blockchain
+
+
+def measure(blockchain, scheme, codec, n=5, k=3):
+    backup_manager = BackupManager(blockchain, scheme=scheme, codec=codec)
+    start = time.perf_counter()
+    serialized_shares = backup_manager.create_backup(n, k)
+    split_time = time.perf_counter() - start
+    restorer = BackupManager(PersonalBlockchain("BenchUser", key_scheme=blockchain.key_scheme,
+                                                private_key=blockchain.private_key), scheme=scheme)
+    start = time.perf_counter()
+    assert restorer.restore_from_backup(serialized_shares, k)
+    restore_time = time.perf_counter() - start
+    return split_time, restore_time, len(serialized_shares) // n
+
+
+def main(posts=500):
+    for key_scheme in ("rsa", "ed25519"):
+        blockchain = build_chain(key_scheme, posts)
+        print(f"{key_scheme} chain, {len(blockchain.chain)} blocks")
+        print(f"{'scheme':<8} {'codec':<10} {'split s':>9} {'restore s':>10} {'bytes/holder':>13}")
+        for scheme in ("prime", "gf256"):
+            for codec in CODEC_IDS:
+                split_time, restore_time, size = measure(blockchain, scheme, codec)
+                print(f"{scheme:<8} {codec:<10} {split_time:>9.3f} {restore_time:>10.3f} {size:>13,}")
+        print()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
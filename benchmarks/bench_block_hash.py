@@ -0,0 +1,57 @@
+import base64
+import hashlib
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.block import Block  # noqa: E402
+
+
+def legacy_serialize_data(data):
+    if isinstance(data, bytes):
+        return base64.b64encode(data).decode('utf-8')
+    elif isinstance(data, dict):
+        return json.dumps({k: legacy_serialize_data(v) for k, v in data.items()}, sort_keys=True)
+    else:
+        return str(data)
+
+
+def legacy_hash(index, timestamp, data, previous_hash):
+    # The f-string hashing Block used before the canonical encoding
+    data = Block.preprocess_data(data)
+    block_string = f"{index}{timestamp}{legacy_serialize_data(data)}{previous_hash}"
+    return hashlib.sha256(block_string.encode()).hexdigest()
+
+
+def sample_data(i):
+    return {
+        "data": {"message": f"Post number {i} " * 4, "tags": ["news", "friends"], "likes": i},
+        "signature": base64.b64encode(os.urandom(256)).decode('utf-8')
+    }
+
+
+def measure(label, fn, payloads):
+    start = time.perf_counter()
+    for i, data in enumerate(payloads):
+        fn(i, 1700000000.0 + i, data, "0" * 64)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {len(payloads) / elapsed:>12,.0f} blocks/s")
+
+
+def main(count=20000):
+    payloads = [sample_data(i) for i in range(count)]
+    measure("legacy f-string + json", legacy_hash, payloads)
+    measure("canonical Block()", Block, payloads)
+    blocks = [Block(i, 1700000000.0 + i, data, "0" * 64) for i, data in enumerate(payloads)]
+    start = time.perf_counter()
+    for block in blocks:
+        block.calculate_hash()
+    elapsed = time.perf_counter() - start
+    print(f"{'canonical calculate_hash':<28} {count / elapsed:>12,.0f} blocks/s")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20000)
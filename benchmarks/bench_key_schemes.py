@@ -0,0 +1,38 @@
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.did_manager import DIDManager  # noqa: E402
+from src.key_schemes import KEY_SCHEMES  # noqa: E402
+
+
+def rate(fn, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        fn()
+    return count / (time.perf_counter() - start)
+
+
+def main(count=2000):
+    message = json.dumps({"message": "Hello, this is a benchmark post!"}).encode()
+    did_manager = DIDManager()
+    print(f"{'scheme':<10} {'keygen/s':>10} {'sign/s':>10} {'verify/s':>10} {'sig bytes':>10} {'DID doc bytes':>14}")
+    for name, scheme in KEY_SCHEMES.items():
+        private_key = scheme.generate_private_key()
+        public_key = private_key.public_key()
+        signature = scheme.sign(private_key, message)
+        did = did_manager.create_did(public_key)
+        document = did_manager.create_did_document(did, public_key)
+
+        keygen = rate(scheme.generate_private_key, max(1, count // 100) if name == "rsa" else count)
+        sign = rate(lambda: scheme.sign(private_key, message), count)
+        verify = rate(lambda: scheme.verify(public_key, signature, message), count)
+        print(f"{name:<10} {keygen:>10,.0f} {sign:>10,.0f} {verify:>10,.0f} {len(signature):>10} "
+              f"{len(json.dumps(document)):>14}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
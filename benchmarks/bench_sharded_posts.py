@@ -0,0 +1,46 @@
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.sharded_runtime import ShardedSocialNetwork  # noqa: E402
+
+
+async def measure(workers, users, posts_per_user, key_scheme):
+    network = ShardedSocialNetwork(workers, start_port=0, key_scheme=key_scheme)
+    await network.start()
+    try:
+        usernames = [f"User{i}" for i in range(users)]
+        await network.add_users(usernames)
+
+        async def post_all(username):
+            # Each user posts in order; users post concurrently, so every shard stays busy
+            for i in range(posts_per_user):
+                await network.post_data(username, {"message": f"Post number {i} by {username}", "likes": i})
+
+        start = time.perf_counter()
+        await asyncio.gather(*(post_all(username) for username in usernames))
+        elapsed = time.perf_counter() - start
+    finally:
+        await network.stop()
+    return users * posts_per_user / elapsed
+
+
+def main(users=64, posts_per_user=50):
+    max_workers = os.cpu_count() or 1
+    worker_counts = sorted({1, 2, 4, 8, max_workers} & set(range(1, max_workers + 1)))
+    for key_scheme in ("rsa", "ed25519"):
+        print(f"{key_scheme}: {users} users x {posts_per_user} posts ({max_workers} CPUs)")
+        print(f"{'workers':>8} {'posts/s':>10} {'speedup':>8}")
+        baseline = None
+        for workers in worker_counts:
+            rate = asyncio.run(measure(workers, users, posts_per_user, key_scheme))
+            baseline = baseline or rate
+            print(f"{workers:>8} {rate:>10,.0f} {rate / baseline:>7.2f}x")
+        print()
+
+
+if __name__ == "__main__":
+    main(*(int(arg) for arg in sys.argv[1:3]))
@@ -1,17 +1,59 @@
+import asyncio
+import base64
+import itertools
 import logging
+import os
 from src.block import Block
-from src.shamir_secret_sharing import ShamirSecretSharing, PRIME
+from src.compression import iter_backup_chunks, iter_backup_events, validate_codec
+from src.shamir_secret_sharing import ShamirSecretSharing, PRIME, validate_share_parameters
+from src.gf256_secret_sharing import GF256SecretSharing
+from src.share_format import ShareChecksumError, drop_corrupted_containers, read_header, read_stream_headers
+
+SECRET_SHARING_SCHEMES = {
+    "prime": lambda: ShamirSecretSharing(PRIME),
+    "gf256": GF256SecretSharing
+}
+
+MANIFEST_BACKUP_ID = "manifest"
+
+
+def _is_legacy(header):
+    # Containers before version 2 predate the signed seal
+    return header.version < 2
+
+
+def _chunk_ranges(count, partitions):
+    size = max(1, -(-count // partitions))
+    return [(start, min(start + size, count)) for start in range(0, count, size)]
+
+
+def _picklable_rows(shares_list):
+    # Zero-copy y-values are memoryviews, which cannot be sent to worker processes
+    return [[(x, bytes(y) if isinstance(y, memoryview) else y) for x, y in shares] for shares in shares_list]
+
+
+def _select_holders(shares_list, columns):
+    return [[shares[column] for column in columns] for shares in shares_list]
 
 
 class BackupManager:
-    def __init__(self, personal_blockchain):
+    def __init__(self, personal_blockchain, scheme="prime", max_deltas=8, codec="none"):
+        if scheme not in SECRET_SHARING_SCHEMES:
+            raise ValueError(f"Unknown secret sharing scheme: {scheme}")
+        validate_codec(codec)
         self.personal_blockchain = personal_blockchain
-        self.sss = ShamirSecretSharing(PRIME)
+        self.scheme = scheme
+        self.sss = SECRET_SHARING_SCHEMES[scheme]()
+        self.max_deltas = max_deltas  # Deltas stacked on a base before the next backup compacts them
+        self.manifest = None  # Signed manifest of the last incremental backup
+        self.codec = codec  # Compression applied to the chain document before splitting
+        self.bad_holders = []  # x-coordinates whose shares failed checks during the last restore
+        self.range_bytes = 1024 * 1024  # Chain document bytes per chunk range sent to a worker process
 
     def create_backup(self, n, k):
         try:
-            shares = self.sss.split_secret(self.personal_blockchain, n, k)
-            serialized_shares = self.sss.serialize_shares(shares)
+            shares = self.sss.split_secret(self.personal_blockchain, n, k, codec=self.codec, seal=True)
+            serialized_shares = self.sss.serialize_shares(shares, k, codec=self.codec)
             logging.info(f"Created backup with {n} shares")
             logging.debug(f"Serialized shares length: {len(serialized_shares)}")
             return serialized_shares
@@ -19,30 +61,385 @@ class BackupManager:
             logging.error(f"Failed to create backup: {str(e)}")
             raise
 
-    def restore_from_backup(self, serialized_shares, k):
+    def create_backup_slices(self, n, k):
+        # One payload per holder carrying only that holder's x-coordinate shares
         try:
-            logging.debug(f"Restoring from serialized shares of length: {len(serialized_shares)}")
-            shares = self.sss.deserialize_shares(serialized_shares)
-            if len(shares[0]) < k:
-                logging.error(f"Insufficient shares for restoration: {len(shares[0])} < {k}")
+            shares = self.sss.split_secret(self.personal_blockchain, n, k, codec=self.codec, seal=True)
+            slices = self.sss.serialize_share_slices(shares, k, codec=self.codec)
+            logging.info(f"Created backup slices for {n} holders")
+            logging.debug(f"Backup slice length: {len(slices[0])}")
+            return slices
+        except Exception as e:
+            logging.error(f"Failed to create backup slices: {str(e)}")
+            raise
+
+    async def create_backup_slices_async(self, n, k, executor=None, partitions=None):
+        # Splits consecutive chunk ranges in parallel on executor (normally a ProcessPoolExecutor) so the
+        # event loop stays responsive; without one the whole backup runs on the default thread pool. The
+        # chain document is read on a thread one range at a time and each range goes to the pool as soon
+        # as it is read, with at most partitions ranges in flight, so it is never held in memory whole
+        loop = asyncio.get_running_loop()
+        if executor is None:
+            return await loop.run_in_executor(None, self.create_backup_slices, n, k)
+        try:
+            validate_share_parameters(n, k)
+            chunks = iter_backup_chunks(self.personal_blockchain.owner, self.personal_blockchain.chain,
+                                        self.sss.chunk_size, self.codec, self.personal_blockchain.sign_data)
+            range_size = max(1, self.range_bytes // self.sss.chunk_size)
+            max_in_flight = partitions or os.cpu_count() or 1
+            splits, in_flight = [], set()
+            while True:
+                chunk_range = await loop.run_in_executor(None, list, itertools.islice(chunks, range_size))
+                if not chunk_range:
+                    break
+                split = loop.run_in_executor(executor, self.sss.split_chunk_range, chunk_range, n, k)
+                splits.append(split)
+                in_flight.add(split)
+                if len(in_flight) >= max_in_flight:
+                    _, in_flight = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+            ranges = await asyncio.gather(*splits)
+            slices = self.sss.join_share_slices(ranges, k, codec=self.codec)
+            logging.info(f"Created backup slices for {n} holders from {len(ranges)} chunk ranges")
+            return slices
+        except Exception as e:
+            logging.error(f"Failed to create backup slices: {str(e)}")
+            raise
+
+    def create_backup_stream(self, n, k, sinks):
+        # Writes each holder's shares to its sink chunk by chunk instead of building the backup in memory
+        try:
+            chunk_count = 0
+            for _ in self.sss.split_stream(self.personal_blockchain, n, k, sinks, codec=self.codec, seal=True):
+                chunk_count += 1
+            logging.info(f"Streamed backup with {n} shares over {chunk_count} chunks")
+            return chunk_count
+        except Exception as e:
+            logging.error(f"Failed to create streamed backup: {str(e)}")
+            raise
+
+    def create_incremental_backup(self, n, k, compact=False):
+        # Splits only the blocks added since the last backup. Returns (segment_id, slices, manifest);
+        # segment_id is None and slices empty when nothing was added
+        try:
+            chain = self.personal_blockchain.chain
+            end = len(chain)
+            if compact or self._needs_base(n, k):
+                segments, start, kind = [], 0, "base"
+            else:
+                segments = list(self.manifest["segments"])
+                start, kind = segments[-1]["end"], "delta"
+                if start == end:
+                    logging.debug("No new blocks since the last backup")
+                    return None, [], self.manifest
+            segment_id = f"{kind}-{start}-{end}"
+            shares = self.sss.split_secret(self.personal_blockchain, n, k, start=start, codec=self.codec, seal=True,
+                                           stop=end)
+            slices = self.sss.serialize_share_slices(shares, k, codec=self.codec)
+            tip_hash = chain[end - 1].hash
+            segments.append({"id": segment_id, "kind": kind, "start": start, "end": end, "end_hash": tip_hash})
+            self.manifest = self._sign_manifest({
+                "owner": self.personal_blockchain.owner,
+                "scheme": self.scheme,
+                "n": n,
+                "k": k,
+                "segments": segments,
+                "tip_hash": tip_hash
+            })
+            logging.info(f"Created {kind} backup segment {segment_id} with {n} shares")
+            return segment_id, slices, self.manifest
+        except Exception as e:
+            logging.error(f"Failed to create incremental backup: {str(e)}")
+            raise
+
+    def _needs_base(self, n, k):
+        manifest = self.manifest
+        if manifest is None or (manifest["scheme"], manifest["n"], manifest["k"]) != (self.scheme, n, k):
+            return True
+        if len(manifest["segments"]) > self.max_deltas:
+            return True
+        # A rewritten or restored chain no longer extends the backed-up tip
+        end = manifest["segments"][-1]["end"]
+        chain = self.personal_blockchain.chain
+        return len(chain) < end or chain[end - 1].hash != manifest["tip_hash"]
+
+    def _sign_manifest(self, manifest):
+        manifest["signature"] = self.personal_blockchain.sign_data(manifest)
+        return manifest
+
+    def verify_manifest(self, manifest):
+        return isinstance(manifest, dict) and self._verify_signed(manifest)
+
+    def _verify_signed(self, document):
+        if "signature" not in document:
+            return False
+        body = {key: value for key, value in document.items() if key != "signature"}
+        try:
+            signature = base64.b64decode(document["signature"])
+        except (TypeError, ValueError):
+            return False
+        return self.personal_blockchain.verify_signature(body, signature)
+
+    def restore_from_incremental(self, manifest, segments, k, rehash=False):
+        # segments maps every segment id in the manifest to its serialized shares; the base is
+        # replayed first and each delta must continue exactly where the previous segment ended
+        self.bad_holders = []
+        try:
+            staged = self._stage_incremental(manifest, segments, k, rehash)
+            if staged is None:
                 return False
-            reconstructed_data = self.sss.reconstruct_secret(shares, k)
-            self.personal_blockchain.owner = reconstructed_data['owner']
-            self.personal_blockchain.chain = [
-                Block(
-                    block['index'],
-                    block['timestamp'],
-                    block['data'],
-                    block['previous_hash']
-                )
-                for block in reconstructed_data['chain']
-            ]
-            for block in self.personal_blockchain.chain:
-                block.hash = block.calculate_hash()
-            logging.info(f"Restored data for user {reconstructed_data['owner']}")
-            logging.info(f"Chain length: {len(self.personal_blockchain.chain)}")
+            self._install_incremental(manifest, staged)
+            return True
+        except Exception as e:
+            logging.error(f"Failed to restore from incremental backup: {str(e)}")
+            return False
+
+    async def restore_from_incremental_async(self, manifest, segments, k, rehash=False):
+        # Segments are replayed on the default thread pool; the swap runs back on the event loop, the
+        # only thread that changes the chain
+        self.bad_holders = []
+        try:
+            staged = await asyncio.get_running_loop().run_in_executor(
+                None, self._stage_incremental, manifest, segments, k, rehash)
+            if staged is None:
+                return False
+            self._install_incremental(manifest, staged)
+            return True
+        except Exception as e:
+            logging.error(f"Failed to restore from incremental backup: {str(e)}")
+            return False
+
+    def _stage_incremental(self, manifest, segments, k, rehash=False):
+        if not self.verify_manifest(manifest):
+            logging.error("Backup manifest signature is invalid")
+            return None
+        if not manifest["segments"] or manifest["segments"][0]["kind"] != "base":
+            logging.error("Backup manifest does not start with a base segment")
+            return None
+        missing = [segment["id"] for segment in manifest["segments"] if segment["id"] not in segments]
+        if missing:
+            logging.error(f"Missing backup segments: {missing}")
+            return None
+        # Every segment is replayed and checked into a staged copy before the live chain is swapped
+        return self.personal_blockchain.chain.stage(self._replay_segments(manifest, segments, k, rehash))
+
+    def _install_incremental(self, manifest, staged):
+        self.personal_blockchain.adopt_chain(staged)
+        self.personal_blockchain.owner = manifest["owner"]
+        self.manifest = manifest
+        logging.info(f"Restored data for user {manifest['owner']} from {len(manifest['segments'])} segments")
+        logging.info(f"Chain length: {len(self.personal_blockchain.chain)}")
+
+    def _replay_segments(self, manifest, segments, k, rehash=False):
+        previous_hash = None
+        for segment in manifest["segments"]:
+            header, sss, shares = self._intact_shares(segments[segment["id"]], k)
+            events = sss.reconstruct_stream(shares, k, header.codec)
+            kind, owner = next(events)
+            if kind != 'owner' or owner != manifest["owner"]:
+                raise ValueError(f"Backup segment {segment['id']} belongs to a different owner")
+            block = None
+            for block in self._verified_blocks(events, segment["start"], rehash, _is_legacy(header)):
+                if block.index == segment["start"] and previous_hash is not None and block.previous_hash != previous_hash:
+                    raise ValueError(f"Backup segment {segment['id']} does not extend the previous segment")
+                yield block
+            if block is None or block.index != segment["end"] - 1 or block.hash != segment["end_hash"]:
+                raise ValueError(f"Backup segment {segment['id']} does not match the manifest")
+            previous_hash = block.hash
+
+    def restore_from_backup(self, serialized_shares, k, rehash=False):
+        # Shares failing their checksums are dropped before decoding. The restored blocks keep their
+        # stored hashes and the backup's signed seal vouches for them; rehash=True recomputes every
+        # hash as well. Holders caught sending bad shares are listed in bad_holders
+        self.bad_holders = []
+        try:
+            logging.debug(f"Restoring from serialized shares of length: {len(serialized_shares)}")
+            self._install(*self._stage_backup(serialized_shares, k, rehash))
             return True
         except Exception as e:
             logging.error(f"Failed to restore from backup: {str(e)}")
             logging.error(f"Serialized shares (first 100 chars): {serialized_shares[:100]}...")
-            return False
\ No newline at end of file
+            return False
+
+    def _stage_backup(self, serialized_shares, k, rehash=False):
+        # The container header names the scheme and codec, so backups restore regardless of our defaults
+        header, sss, shares = self._intact_shares(serialized_shares, k)
+        return self._stage_rows(sss, shares, k, header, rehash)
+
+    def _intact_shares(self, serialized_shares, k):
+        serialized_shares, corrupted = drop_corrupted_containers(serialized_shares)
+        if corrupted:
+            logging.warning(f"Dropped shares with bad checksums from holders {corrupted}")
+            self.bad_holders.extend(corrupted)
+        if not serialized_shares:
+            raise ValueError("No intact shares left")
+        header = read_header(serialized_shares)
+        sss = self._engine_for(header)
+        shares = sss.deserialize_shares(serialized_shares, verify=False)
+        if len(shares[0]) < k:
+            raise ValueError(f"Insufficient shares for restoration: {len(shares[0])} < {k}")
+        return header, sss, shares
+
+    def _stage_rows(self, sss, shares, k, header, rehash=False):
+        try:
+            return self._stage_events(sss.reconstruct_stream(shares, k, header.codec), rehash, _is_legacy(header))
+        except ValueError as e:
+            if len(shares[0]) <= k:
+                raise
+            logging.warning(f"Backup from the first {k} holders failed verification ({str(e)}), trying the others")
+            return self._stage_from_consistent_quorum(sss, shares, k, header, rehash)
+
+    def _stage_from_consistent_quorum(self, sss, shares, k, header, rehash=False):
+        # Tries k-subsets of holders until one reconstructs a verified chain, then checks every other
+        # holder against k - 1 of those to find out which ones sent corrupted or tampered shares
+        xs = [x for x, _ in shares[0]]
+        for quorum in itertools.combinations(range(len(xs)), k):
+            if self._verifies(sss, _select_holders(shares, quorum), k, header):
+                break
+        else:
+            raise ValueError("No set of k holders reconstructs a verified backup")
+        tampered = [xs[column] for column in range(len(xs)) if column not in quorum and
+                    not self._verifies(sss, _select_holders(shares, quorum[:k - 1] + (column,)), k, header)]
+        if tampered:
+            logging.warning(f"Holders {tampered} sent shares that fail verification")
+            self.bad_holders.extend(tampered)
+        return self._stage_events(sss.reconstruct_stream(_select_holders(shares, quorum), k, header.codec), rehash,
+                                  _is_legacy(header))
+
+    def _verifies(self, sss, shares, k, header):
+        try:
+            events = sss.reconstruct_stream(shares, k, header.codec)
+            kind, _ = next(events)
+            if kind != 'owner':
+                return False
+            for _ in self._verified_blocks(events, legacy=_is_legacy(header)):
+                pass
+            return True
+        except ValueError:
+            return False
+
+    def restore_from_slices(self, slices, k, rehash=False):
+        # Per-holder containers concatenate into a regular multi-holder backup
+        if len(slices) < k:
+            logging.error(f"Insufficient backup slices for restoration: {len(slices)} < {k}")
+            return False
+        return self.restore_from_backup(b''.join(slices), k, rehash)
+
+    async def restore_from_slices_async(self, slices, k, executor=None, partitions=None, rehash=False):
+        # Decoding and staging run off the loop (chunk ranges on executor if given, the rest on the default
+        # thread pool); the staged chain is swapped in on the loop, the only thread that changes the chain
+        loop = asyncio.get_running_loop()
+        if len(slices) < k:
+            logging.error(f"Insufficient backup slices for restoration: {len(slices)} < {k}")
+            return False
+        self.bad_holders = []
+        if executor is None:
+            try:
+                self._install(*await loop.run_in_executor(None, self._stage_backup, b''.join(slices), k, rehash))
+                return True
+            except Exception as e:
+                logging.error(f"Failed to restore from backup slices: {str(e)}")
+                return False
+        try:
+            header, sss, shares = await loop.run_in_executor(None, self._intact_shares, b''.join(slices), k)
+            shares = await loop.run_in_executor(None, _picklable_rows, shares)
+            try:
+                pieces = await asyncio.gather(*(
+                    loop.run_in_executor(executor, sss.reconstruct_chunk_range, shares[start:stop], k)
+                    for start, stop in _chunk_ranges(len(shares), partitions or os.cpu_count() or 1)
+                ))
+                # Decoding and verifying the blocks still takes a while, so keep it off the loop too
+                owner, staged = await loop.run_in_executor(None, self._stage_events,
+                                                           iter_backup_events(pieces, header.codec), rehash,
+                                                           _is_legacy(header))
+            except ValueError as e:
+                if len(shares[0]) <= k:
+                    raise
+                logging.warning(f"Backup from the first {k} holders failed verification ({str(e)}), trying the others")
+                owner, staged = await loop.run_in_executor(None, self._stage_from_consistent_quorum,
+                                                           sss, shares, k, header, rehash)
+            self._install(owner, staged)
+            return True
+        except Exception as e:
+            logging.error(f"Failed to restore from backup slices: {str(e)}")
+            return False
+
+    def restore_from_stream(self, sources, k, rehash=False):
+        # sources maps each holder's x-coordinate to a readable binary stream of its shares
+        self.bad_holders = []
+        try:
+            if len(sources) < k:
+                logging.error(f"Insufficient share streams for restoration: {len(sources)} < {k}")
+                return False
+            headers = read_stream_headers(sources)
+            header = next(iter(headers.values()))
+            sss = self._engine_for(header)
+            rows = sss.read_share_rows(sources, headers=headers)
+            self._install(*self._stage_events(sss.reconstruct_stream(rows, k, header.codec), rehash,
+                                              _is_legacy(header)))
+            return True
+        except ShareChecksumError as e:
+            # A stream is read only once, so a corrupted holder fails the restore but is still reported
+            self.bad_holders.append(e.x)
+            logging.error(f"Failed to restore from share streams: {str(e)}")
+            return False
+        except Exception as e:
+            logging.error(f"Failed to restore from share streams: {str(e)}")
+            return False
+
+    def _engine_for(self, header):
+        scheme = header.scheme
+        if scheme == "prime" and header.version < 2:
+            # Version 1 prime backups stored their chunks without the sentinel byte
+            return ShamirSecretSharing(PRIME, sentinel=False)
+        if scheme == self.scheme:
+            return self.sss
+        if scheme not in SECRET_SHARING_SCHEMES:
+            raise ValueError(f"Unknown secret sharing scheme: {scheme}")
+        return SECRET_SHARING_SCHEMES[scheme]()
+
+    def _stage_events(self, events, rehash=False, legacy=False):
+        # Blocks are verified and written to a staged copy one at a time as the stream is decoded. The
+        # live chain is untouched until _install, so a check failing part way leaves it as it was
+        kind, owner = next(events)
+        if kind != 'owner':
+            raise ValueError("Backup does not start with the chain owner")
+        return owner, self.personal_blockchain.chain.stage(self._verified_blocks(events, rehash=rehash, legacy=legacy))
+
+    def _install(self, owner, staged):
+        self.personal_blockchain.adopt_chain(staged)
+        self.personal_blockchain.owner = owner
+        logging.info(f"Restored data for user {owner}")
+        logging.info(f"Chain length: {len(self.personal_blockchain.chain)}")
+
+    def _verified_blocks(self, events, start=0, rehash=False, legacy=False):
+        # Blocks keep their stored hashes and only the links between them are checked here; the seal
+        # covers every byte of the chain, so one signature check replaces rehashing each block. The seal
+        # comes last in the stream, so callers write the blocks only to a staged copy (chain.stage, or a
+        # dry run in _verifies) and the live chain sees none of them before the seal has passed. Only
+        # legacy (version 1) backups may lack a seal, and each of their blocks is rehashed instead
+        rehash = rehash or legacy
+        previous_hash = None
+        length = 0
+        seal = None
+        for kind, value in events:
+            if kind == 'seal':
+                seal = value
+                continue
+            block = Block.from_dict(value)
+            if rehash and Block(block.index, block.timestamp, block.data, block.previous_hash).hash != block.hash:
+                raise ValueError(f"Block {block.index} does not match its stored hash")
+            if block.index != start + length or (previous_hash is not None and block.previous_hash != previous_hash):
+                raise ValueError(f"Block {block.index} does not link to the block before it")
+            previous_hash = block.hash
+            length += 1
+            yield block
+        if seal is None:
+            if not legacy:
+                raise ValueError("Backup is not sealed")
+            logging.warning("Legacy backup is not sealed; its blocks were rehashed instead")
+            return
+        if not self._verify_signed(seal):
+            raise ValueError("Backup seal signature is invalid")
+        if (seal.get("start"), seal.get("length"), seal.get("tip_hash")) != (start if length else None, length,
+                                                                              previous_hash):
+            raise ValueError("Backup seal does not match the restored blocks")
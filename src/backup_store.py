@@ -0,0 +1,275 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+
+class BackupQuotaExceeded(ValueError):
+    def __init__(self, owner, usage, quota):
+        super().__init__(f"Backup quota exceeded for {owner}: {usage} > {quota} bytes")
+        self.owner = owner
+        self.usage = usage
+        self.quota = quota
+
+
+class BackupStore:
+    # Content-addressed backup blobs. Each key (node_id, backup_id) points at the SHA-256 of its encoded
+    # value; identical payloads share one blob file, written atomically and removed with its last key.
+    # Keys live in an append-only journal replayed on open. Recently used blobs are kept in an LRU bounded
+    # by cache_bytes, so RAM stays fixed however many backups are held. Without a root everything stays
+    # in memory, as the plain dict this replaces did. With sync (the default) every blob, journal record
+    # and rename is fsynced before put or delete returns; sync=False trades that for speed, and a crash
+    # may then lose recent writes, though never leave a torn blob.
+    JOURNAL = 'index.log'
+    BLOB_DIR = 'blobs'
+
+    def __init__(self, root=None, cache_bytes=64 * 1024 * 1024, owner_quota=None, sync=True):
+        self.root = root
+        self.cache_bytes = cache_bytes
+        self.owner_quota = owner_quota  # Bytes each owner may keep stored, None for no limit
+        self.sync = sync
+        self.entries = {}  # key: (digest, kind, size, owner)
+        self.refcounts = {}  # digest: number of keys pointing at the blob
+        self.usage = {}  # owner: bytes referenced
+        self.blobs = {}  # digest: encoded value, only without a root
+        self.cache = OrderedDict()  # digest: encoded value, bounded LRU
+        self.cached_bytes = 0
+        self.journal = None
+        self.journal_records = 0
+        self.lock = threading.Lock()
+        if root is not None:
+            os.makedirs(os.path.join(root, self.BLOB_DIR), exist_ok=True)
+            self._load_journal()
+
+    @staticmethod
+    def _encode(value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            return "bytes", bytes(value)
+        return "json", json.dumps(value, sort_keys=True).encode('utf-8')
+
+    @staticmethod
+    def _decode(kind, data):
+        return data if kind == "bytes" else json.loads(data.decode('utf-8'))
+
+    def _blob_path(self, digest):
+        return os.path.join(self.root, self.BLOB_DIR, digest[:2], digest)
+
+    def _write_atomically(self, path, data):
+        temporary = f"{path}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(temporary, 'wb') as f:
+            f.write(data)
+            f.flush()
+            if self.sync:
+                os.fsync(f.fileno())
+        os.replace(temporary, path)
+        self._sync_directory(os.path.dirname(path))
+
+    def _sync_directory(self, path):
+        # A rename or new file is only durable once the directory holding it is fsynced as well
+        if self.sync:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _load_journal(self):
+        path = os.path.join(self.root, self.JOURNAL)
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn last line from a crash mid-append; everything before it is intact
+                        logging.warning(f"Ignoring a damaged record in {path}")
+                        continue
+                    key = tuple(record["key"])
+                    if key in self.entries:
+                        self._unlink(key)
+                    if record["op"] == "put":
+                        self._link(key, record["digest"], record["kind"], record["size"], record["owner"])
+                    self.journal_records += 1
+        self._compact_journal()
+        # Blobs written just before a crash, or whose last key was dropped, are not in the journal
+        for directory, _, filenames in os.walk(os.path.join(self.root, self.BLOB_DIR)):
+            for filename in filenames:
+                if filename not in self.refcounts:
+                    os.remove(os.path.join(directory, filename))
+
+    def _append_journal(self, record):
+        if self.root is None:
+            return
+        if self.journal is None:
+            self.journal = open(os.path.join(self.root, self.JOURNAL), 'ab')
+        self.journal.write(json.dumps(record).encode('utf-8') + b'\n')
+        self.journal.flush()
+        if self.sync:
+            os.fsync(self.journal.fileno())
+        self.journal_records += 1
+        # Overwritten and deleted keys pile up; rewrite once most records are dead
+        if self.journal_records > 2 * len(self.entries) + 64:
+            self._compact_journal()
+
+    def _compact_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        records = [json.dumps({"op": "put", "key": list(key), "digest": digest, "kind": kind, "size": size,
+                               "owner": owner}).encode('utf-8') + b'\n'
+                   for key, (digest, kind, size, owner) in self.entries.items()]
+        self._write_atomically(os.path.join(self.root, self.JOURNAL), b''.join(records))
+        self.journal_records = len(records)
+
+    def _link(self, key, digest, kind, size, owner):
+        self.entries[key] = (digest, kind, size, owner)
+        self.refcounts[digest] = self.refcounts.get(digest, 0) + 1
+        self.usage[owner] = self.usage.get(owner, 0) + size
+
+    def _unlink(self, key):
+        digest, _, size, owner = self.entries.pop(key)
+        self.usage[owner] -= size
+        if not self.usage[owner]:
+            del self.usage[owner]
+        self.refcounts[digest] -= 1
+        if self.refcounts[digest]:
+            return
+        del self.refcounts[digest]
+        self.blobs.pop(digest, None)
+        cached = self.cache.pop(digest, None)
+        if cached is not None:
+            self.cached_bytes -= len(cached)
+        if self.root is not None:
+            try:
+                os.remove(self._blob_path(digest))
+            except FileNotFoundError:
+                pass
+
+    def _remember(self, digest, data):
+        if self.root is None or len(data) > self.cache_bytes:
+            return
+        if digest not in self.cache:
+            self.cache[digest] = data
+            self.cached_bytes += len(data)
+        self.cache.move_to_end(digest)
+        while self.cached_bytes > self.cache_bytes:
+            _, evicted = self.cache.popitem(last=False)
+            self.cached_bytes -= len(evicted)
+
+    def put(self, key, value, owner=None):
+        # Returns the blob digest; raises BackupQuotaExceeded, leaving the store unchanged, when the
+        # owner would go over its quota
+        kind, data = self._encode(value)
+        digest = hashlib.sha256(data).hexdigest()
+        with self.lock:
+            previous = self.entries.get(key)
+            if self.owner_quota is not None:
+                usage = self.usage.get(owner, 0) + len(data)
+                if previous is not None and previous[3] == owner:
+                    usage -= previous[2]
+                if usage > self.owner_quota:
+                    raise BackupQuotaExceeded(owner, usage, self.owner_quota)
+            if digest not in self.refcounts:
+                if self.root is None:
+                    self.blobs[digest] = data
+                else:
+                    path = self._blob_path(digest)
+                    if not os.path.isdir(os.path.dirname(path)):
+                        os.makedirs(os.path.dirname(path))
+                        self._sync_directory(os.path.join(self.root, self.BLOB_DIR))
+                    self._write_atomically(path, data)
+            # Pin the blob while the old entry goes, so rewriting a key with the same content keeps the file
+            self.refcounts[digest] = self.refcounts.get(digest, 0) + 1
+            if previous is not None:
+                self._unlink(key)
+            self.refcounts[digest] -= 1
+            self._link(key, digest, kind, len(data), owner)
+            self._remember(digest, data)
+            self._append_journal({"op": "put", "key": list(key), "digest": digest, "kind": kind,
+                                  "size": len(data), "owner": owner})
+        return digest
+
+    def get(self, key, default=None):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return default
+            digest, kind, _, _ = entry
+            data = self.blobs.get(digest) if self.root is None else self.cache.get(digest)
+            if data is None:
+                try:
+                    with open(self._blob_path(digest), 'rb') as f:
+                        data = f.read()
+                except FileNotFoundError:
+                    logging.error(f"Backup blob {digest} for {key} is missing")
+                    return default
+                if hashlib.sha256(data).hexdigest() != digest:
+                    logging.error(f"Backup blob {digest} for {key} is corrupted")
+                    return default
+            self._remember(digest, data)
+            return self._decode(kind, data)
+
+    def blob(self, key):
+        # (digest, kind, size, source) for serving a value without decoding it, or None. source is the
+        # encoded bytes when they are in memory, else the blob file path; the file may be gone by the
+        # time it is opened if the key is deleted meanwhile
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            digest, kind, size, _ = entry
+            data = self.blobs.get(digest) if self.root is None else self.cache.get(digest)
+            if data is not None:
+                if self.root is not None:
+                    self.cache.move_to_end(digest)
+                return digest, kind, size, data
+            return digest, kind, size, self._blob_path(digest)
+
+    def digest(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry[0] if entry is not None else None
+
+    def delete(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return False
+            self._unlink(key)
+            self._append_journal({"op": "delete", "key": list(key)})
+            return True
+
+    def owner_usage(self, owner):
+        with self.lock:
+            return self.usage.get(owner, 0)
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries)
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self):
+        with self.lock:
+            return len(self.entries)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __getitem__(self, key):
+        value = self.get(key, KeyError)
+        if value is KeyError:
+            raise KeyError(key)
+        return value
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def close(self):
+        with self.lock:
+            if self.journal is not None:
+                self.journal.close()
+                self.journal = None
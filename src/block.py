@@ -1,8 +1,45 @@
 import hashlib
 import base64
-import json
+import struct
 
 
+_pack_length = struct.Struct('>I').pack
+_pack_float = struct.Struct('>d').pack
+
+
+def encode_canonical(value, out):
+    # Type-tagged, length-prefixed encoding appended to the list `out`;
+    # dict keys are sorted so equal data always encodes to the same bytes
+    value_type = type(value)
+    if value_type is str:
+        raw = value.encode('utf-8')
+        out.append(b'S' + _pack_length(len(raw)) + raw)
+    elif value_type is dict:
+        out.append(b'M' + _pack_length(len(value)))
+        for key in sorted(value):
+            raw = str(key).encode('utf-8')
+            out.append(b'S' + _pack_length(len(raw)) + raw)
+            encode_canonical(value[key], out)
+    elif value is None:
+        out.append(b'N')
+    elif value is True:
+        out.append(b'T')
+    elif value is False:
+        out.append(b'F')
+    elif isinstance(value, int):
+        raw = value.to_bytes((value.bit_length() + 8) // 8, 'big', signed=True)
+        out.append(b'I' + _pack_length(len(raw)) + raw)
+    elif isinstance(value, float):
+        out.append(b'D' + _pack_float(value))
+    elif isinstance(value, (list, tuple)):
+        out.append(b'L' + _pack_length(len(value)))
+        for item in value:
+            encode_canonical(item, out)
+    elif isinstance(value, (bytes, bytearray)):
+        out.append(b'B' + _pack_length(len(value)) + bytes(value))
+    else:
+        encode_canonical(str(value), out)
+
 
 class Block:
     def __init__(self, index, timestamp, data, previous_hash):
@@ -10,20 +47,26 @@ class Block:
         self.timestamp = timestamp
         self.data = self.preprocess_data(data)
         self.previous_hash = previous_hash
-        self.hash = self.calculate_hash()
+        self._encoded = self._encode_fields()
+        self.hash = hashlib.sha256(self._encoded).hexdigest()
 
-    def calculate_hash(self):
-        block_string = f"{self.index}{self.timestamp}{self.serialize_data(self.data)}{self.previous_hash}"
-        return hashlib.sha256(block_string.encode()).hexdigest()
+    def _encode_fields(self):
+        parts = []
+        encode_canonical(self.index, parts)
+        encode_canonical(self.timestamp, parts)
+        encode_canonical(self.data, parts)
+        encode_canonical(self.previous_hash, parts)
+        return b''.join(parts)
 
-    @staticmethod
-    def serialize_data(data):
-        if isinstance(data, bytes):
-            return base64.b64encode(data).decode('utf-8')
-        elif isinstance(data, dict):
-            return json.dumps({k: Block.serialize_data(v) for k, v in data.items()}, sort_keys=True)
-        else:
-            return str(data)
+    def encode(self):
+        # Canonical encoding, computed once and cached
+        if self._encoded is None:
+            self._encoded = self._encode_fields()
+        return self._encoded
+
+    def calculate_hash(self):
+        # Re-encodes the current fields so in-place tampering is visible to verification
+        return hashlib.sha256(self._encode_fields()).hexdigest()
 
     @staticmethod
     def preprocess_data(data):
@@ -32,4 +75,25 @@ class Block:
         elif isinstance(data, bytes):
             return base64.b64encode(data).decode('utf-8')
         else:
-            return data
\ No newline at end of file
+            return data
+
+    def to_dict(self):
+        return {
+            "index": self.index,
+            "timestamp": self.timestamp,
+            "data": self.data,
+            "previous_hash": self.previous_hash,
+            "hash": self.hash
+        }
+
+    @classmethod
+    def from_dict(cls, block_dict):
+        # Rebuild a stored block without recomputing its hash
+        block = cls.__new__(cls)
+        block.index = block_dict['index']
+        block.timestamp = block_dict['timestamp']
+        block.data = block_dict['data']
+        block.previous_hash = block_dict['previous_hash']
+        block.hash = block_dict['hash']
+        block._encoded = None
+        return block
@@ -0,0 +1,255 @@
+import itertools
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import threading
+from collections import OrderedDict
+from src.block import Block
+
+
+class MemoryBlockStore:
+    def __init__(self, blocks=None):
+        self.blocks = list(blocks) if blocks is not None else []
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getitem__(self, item):
+        return self.blocks[item]
+
+    def __iter__(self):
+        # Stops at the length seen when iteration began, like SegmentBlockStore
+        return itertools.islice(self.blocks, len(self.blocks))
+
+    def append(self, block):
+        self.blocks.append(block)
+
+    def get_by_hash(self, block_hash):
+        return next((block for block in self.blocks if block.hash == block_hash), None)
+
+    def stage(self, blocks):
+        return MemoryBlockStore(blocks)
+
+    def adopt(self, staged):
+        return staged
+
+    def replace(self, blocks):
+        return MemoryBlockStore(blocks)
+
+    def close(self):
+        pass
+
+
+class SegmentBlockStore:
+    # Record layout: 4-byte big-endian payload length, 32-byte raw block hash, JSON payload. Backups read
+    # the store on worker threads while the event loop appends, so every access holds the lock
+    HEADER = struct.Struct('>I32s')
+    SEGMENT_PREFIX = 'segment-'
+    SEGMENT_SUFFIX = '.log'
+    STAGING_SUFFIX = '.staging'  # Sibling directory a replacement chain is written to
+    RETIRED_SUFFIX = '.retired'  # The replaced chain, between the two renames of a swap
+
+    def __init__(self, directory, segment_size=16 * 1024 * 1024, cache_size=256, sync=False):
+        self.directory = directory
+        self.segment_size = segment_size
+        self.cache_size = cache_size
+        self.sync = sync
+        self.offsets = []  # block index: (segment number, record offset, payload length)
+        self.hash_index = {}  # block hash: block index
+        self.cache = OrderedDict()  # block index: Block, bounded LRU of recently read blocks
+        self.mmaps = {}  # segment number: mmap of the segment file
+        self.active_segment = 0
+        self.active_file = None
+        self.lock = threading.RLock()
+        self._recover_swap()
+        os.makedirs(directory, exist_ok=True)
+        self._load_index()
+
+    def _recover_swap(self):
+        # A swap renames the live directory aside and only then the staged one into place, and the staged
+        # chain is complete before the first rename; so a missing live directory means finishing the swap
+        staging = self.directory + self.STAGING_SUFFIX
+        retired = self.directory + self.RETIRED_SUFFIX
+        if not os.path.isdir(self.directory) and os.path.isdir(retired) and os.path.isdir(staging):
+            logging.warning(f"Finishing an interrupted chain replacement in {self.directory}")
+            os.rename(staging, self.directory)
+        for leftover in (staging, retired):
+            if os.path.isdir(leftover):
+                shutil.rmtree(leftover)
+
+    def _sync_directory(self, path):
+        if self.sync:
+            fd = os.open(path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f"{self.SEGMENT_PREFIX}{segment:06d}{self.SEGMENT_SUFFIX}")
+
+    def _list_segments(self):
+        segments = []
+        for name in os.listdir(self.directory):
+            if name.startswith(self.SEGMENT_PREFIX) and name.endswith(self.SEGMENT_SUFFIX):
+                segments.append(int(name[len(self.SEGMENT_PREFIX):-len(self.SEGMENT_SUFFIX)]))
+        return sorted(segments)
+
+    def _load_index(self):
+        for segment in self._list_segments():
+            path = self._segment_path(segment)
+            size = os.path.getsize(path)
+            valid_size = 0
+            if size:
+                with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                    offset = 0
+                    while offset + self.HEADER.size <= size:
+                        length, raw_hash = self.HEADER.unpack_from(view, offset)
+                        if offset + self.HEADER.size + length > size:
+                            break
+                        self.hash_index[raw_hash.hex()] = len(self.offsets)
+                        self.offsets.append((segment, offset, length))
+                        offset += self.HEADER.size + length
+                    valid_size = offset
+            if valid_size < size:
+                # Drop a torn record left behind by an interrupted append
+                logging.warning(f"Truncating incomplete record in {path} at offset {valid_size}")
+                with open(path, 'r+b') as f:
+                    f.truncate(valid_size)
+            self.active_segment = segment
+        logging.debug(f"Loaded {len(self.offsets)} blocks from {self.directory}")
+
+    def _open_active(self):
+        if self.active_file is None:
+            self.active_file = open(self._segment_path(self.active_segment), 'ab')
+        return self.active_file
+
+    def _get_mmap(self, segment):
+        view = self.mmaps.get(segment)
+        if view is None:
+            with open(self._segment_path(segment), 'rb') as f:
+                view = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.mmaps[segment] = view
+        return view
+
+    def _drop_mmap(self, segment):
+        view = self.mmaps.pop(segment, None)
+        if view is not None:
+            view.close()
+
+    def __len__(self):
+        with self.lock:
+            return len(self.offsets)
+
+    def __getitem__(self, item):
+        with self.lock:
+            if isinstance(item, slice):
+                return [self[i] for i in range(*item.indices(len(self)))]
+            if item < 0:
+                item += len(self.offsets)
+            if not 0 <= item < len(self.offsets):
+                raise IndexError("block index out of range")
+            block = self.cache.get(item)
+            if block is not None:
+                self.cache.move_to_end(item)
+                return block
+            segment, offset, length = self.offsets[item]
+            view = self._get_mmap(segment)
+            start = offset + self.HEADER.size
+            block = Block.from_dict(json.loads(view[start:start + length]))
+            self._remember(item, block)
+            return block
+
+    def __iter__(self):
+        # Takes the lock per block rather than for the whole pass, so appends are not held up; blocks
+        # appended after iteration began are not included
+        for i in range(len(self)):
+            yield self[i]
+
+    def _remember(self, index, block):
+        self.cache[index] = block
+        self.cache.move_to_end(index)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def append(self, block):
+        payload = json.dumps(block.to_dict()).encode('utf-8')
+        with self.lock:
+            self._append_record(block, payload)
+
+    def _append_record(self, block, payload):
+        f = self._open_active()
+        offset = f.tell()
+        if offset and offset + self.HEADER.size + len(payload) > self.segment_size:
+            self._roll_segment()
+            f = self._open_active()
+            offset = 0
+        f.write(self.HEADER.pack(len(payload), bytes.fromhex(block.hash)))
+        f.write(payload)
+        f.flush()
+        if self.sync:
+            os.fsync(f.fileno())
+        # The active segment grew, so any existing mapping of it is too short
+        self._drop_mmap(self.active_segment)
+        self.hash_index[block.hash] = len(self.offsets)
+        self.offsets.append((self.active_segment, offset, len(payload)))
+        self._remember(len(self.offsets) - 1, block)
+
+    def _roll_segment(self):
+        if self.active_file is not None:
+            self.active_file.close()
+            self.active_file = None
+        self.active_segment += 1
+        logging.debug(f"Rolled to segment {self.active_segment} in {self.directory}")
+
+    def get_by_hash(self, block_hash):
+        with self.lock:
+            index = self.hash_index.get(block_hash)
+            return self[index] if index is not None else None
+
+    def stage(self, blocks):
+        # Writes blocks to a new store beside this one, leaving the live segments untouched. If blocks
+        # raises part way through, as a restore does when a check fails, the partial copy is removed
+        path = self.directory + self.STAGING_SUFFIX
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        staged = SegmentBlockStore(path, self.segment_size, self.cache_size, self.sync)
+        try:
+            for block in blocks:
+                staged.append(block)
+            staged.close()
+        except BaseException:
+            staged.close()
+            shutil.rmtree(path, ignore_errors=True)
+            raise
+        return staged
+
+    def adopt(self, staged):
+        # Swaps a store from stage() into this one's directory; _recover_swap finishes it after a crash
+        with self.lock:
+            self.close()
+            parent = os.path.dirname(os.path.abspath(self.directory))
+            retired = self.directory + self.RETIRED_SUFFIX
+            os.rename(self.directory, retired)
+            os.rename(staged.directory, self.directory)
+            self._sync_directory(parent)
+            shutil.rmtree(retired)
+            self.offsets = staged.offsets
+            self.hash_index = staged.hash_index
+            self.cache = staged.cache
+            self.active_segment = staged.active_segment
+        return self
+
+    def replace(self, blocks):
+        return self.adopt(self.stage(blocks))
+
+    def close(self):
+        with self.lock:
+            if self.active_file is not None:
+                self.active_file.close()
+                self.active_file = None
+            for segment in list(self.mmaps):
+                self._drop_mmap(segment)
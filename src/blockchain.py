@@ -1,30 +1,71 @@
 import time
 import json
 import base64
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import rsa, padding
+from concurrent.futures import ThreadPoolExecutor
+from cryptography.hazmat.primitives import serialization
 from src.block import Block
+from src.block_store import MemoryBlockStore
+from src.merkle import leaf_hash, build_merkle_tree, verify_merkle_proof
 from src.backup_manager import BackupManager
 from src.trusted_node import TrustedNode
 from src.did_manager import DIDManager
+from src.key_schemes import get_key_scheme, key_scheme_for_key
 import logging
 
 
+def _verify_signature_batch(scheme_name, public_key_pem, items):
+    # Module-level so it can run in either a thread or a process pool
+    key_scheme = get_key_scheme(scheme_name)
+    public_key = serialization.load_pem_public_key(public_key_pem)
+    return [index for index, payload, signature in items
+            if not key_scheme.verify(public_key, signature, payload)]
+
+
 class PersonalBlockchain:
-    def __init__(self, owner):
+    def __init__(self, owner, block_store=None, key_scheme="rsa", private_key=None):
         self.did_manager = DIDManager()
-        self.private_key = rsa.generate_private_key(
-            public_exponent=65537,
-            key_size=2048
-        )
+        if private_key is not None:
+            # Pre-generated keys (e.g. from a KeyPool) carry their own scheme
+            self.key_scheme = key_scheme_for_key(private_key)
+            self.private_key = private_key
+        else:
+            self.key_scheme = get_key_scheme(key_scheme)
+            self.private_key = self.key_scheme.generate_private_key()
         self.public_key = self.private_key.public_key()
         self.did = self.did_manager.create_did(self.public_key)
         self.did_document = self.did_manager.create_did_document(self.did, self.public_key)
         self.owner = owner
-        self.chain = [self.create_genesis_block()]
+        self.verified_index = -1  # Highest block index already checked by verify_chain
+        self.block_store = block_store if block_store is not None else MemoryBlockStore()
+        if len(self.block_store) == 0:
+            self.block_store.append(self.create_genesis_block())
+        else:
+            self._check_genesis()
         self.backup_manager = BackupManager(self)
         self.trusted_nodes = []
 
+    @property
+    def chain(self):
+        return self.block_store
+
+    @chain.setter
+    def chain(self, blocks):
+        self.block_store = self.block_store.replace(blocks)
+        self.verified_index = -1
+
+    def adopt_chain(self, staged):
+        # Installs blocks written with chain.stage(); only a swap, so cheap enough for the event loop
+        self.block_store = self.block_store.adopt(staged)
+        self.verified_index = -1
+
+    def _check_genesis(self):
+        # A reopened store must hold this owner's chain under this key, or none of its blocks would verify
+        # and new blocks would be signed with a different key than the history
+        genesis = self.block_store[0].data.get("data", {})
+        if (genesis.get("owner"), genesis.get("did")) != (self.owner, self.did):
+            raise ValueError(f"Block store holds the chain of {genesis.get('owner')} ({genesis.get('did')}), "
+                             f"not of {self.owner} ({self.did})")
+
     def create_genesis_block(self):
         genesis_data = {
             "owner": self.owner,
@@ -43,38 +84,122 @@ class PersonalBlockchain:
         new_block = Block(len(self.chain), time.time(), {"data": data, "signature": signed_data}, previous_block.hash)
         self.chain.append(new_block)
 
+    def add_blocks(self, batch):
+        # One signature over the Merkle root of the batch; each block keeps its own inclusion proof
+        if not batch:
+            return
+        payloads = [json.dumps(data).encode() for data in batch]
+        merkle_root, proofs = build_merkle_tree([leaf_hash(payload) for payload in payloads])
+        signed_root = self.sign_data(merkle_root)
+        for data, proof in zip(batch, proofs):
+            previous_block = self.chain[-1]
+            new_block = Block(len(self.chain), time.time(), {
+                "data": data,
+                "signature": signed_root,
+                "merkle_root": merkle_root,
+                "merkle_proof": proof
+            }, previous_block.hash)
+            self.chain.append(new_block)
+        logging.debug(f"Added batch of {len(batch)} blocks under Merkle root {merkle_root}")
+
     def sign_data(self, data):
         if isinstance(data, dict):
             data = json.dumps(data, sort_keys=True)
         elif isinstance(data, bytes):
             data = data.decode('utf-8')
-        signature = self.private_key.sign(
-            data.encode(),
-            padding.PSS(
-                mgf=padding.MGF1(hashes.SHA256()),
-                salt_length=padding.PSS.MAX_LENGTH
-            ),
-            hashes.SHA256()
-        )
+        signature = self.key_scheme.sign(self.private_key, data.encode())
         return base64.b64encode(signature).decode('utf-8')
 
     def verify_signature(self, data, signature):
         if isinstance(data, dict):
             data = json.dumps(data, sort_keys=True)
         try:
-            self.public_key.verify(
-                signature,
-                data.encode(),
-                padding.PSS(
-                    mgf=padding.MGF1(hashes.SHA256()),
-                    salt_length=padding.PSS.MAX_LENGTH
-                ),
-                hashes.SHA256()
-            )
-            return True
+            return self.key_scheme.verify(self.public_key, signature, data.encode())
         except:
             return False
 
+    def verify_chain(self, executor=None, batch_size=256):
+        chain = self.chain
+        start = self.verified_index + 1
+        end = len(chain)
+        if start >= end:
+            return True
+
+        # Hash links are cheap and sequential; collect signature work for the pool
+        first_invalid = None
+        previous_hash = chain[start - 1].hash if start > 0 else "0"
+        items = []
+        signed_roots = set()
+        for i in range(start, end):
+            block = chain[i]
+            if block.index != i or block.previous_hash != previous_hash or block.calculate_hash() != block.hash:
+                logging.error(f"Block {i} has a broken hash link")
+                first_invalid = i
+                break
+            try:
+                payload, signature = self._signed_payload(block)
+            except (KeyError, TypeError, ValueError) as e:
+                logging.error(f"Block {i} has no valid signature: {e}")
+                first_invalid = i
+                break
+            # Blocks of one batch share a signed root, so it only needs checking once
+            merkle_root = block.data.get("merkle_root")
+            if merkle_root is None or merkle_root not in signed_roots:
+                items.append((i, payload, signature))
+                if merkle_root is not None:
+                    signed_roots.add(merkle_root)
+            previous_hash = block.hash
+
+        failed = self._verify_signatures(items, executor, batch_size)
+        if failed:
+            logging.error(f"Invalid signatures on blocks: {failed}")
+            first_invalid = min(failed + ([first_invalid] if first_invalid is not None else []))
+
+        if first_invalid is not None:
+            self.verified_index = first_invalid - 1
+            return False
+        self.verified_index = end - 1
+        logging.debug(f"Verified blocks {start} to {end - 1}")
+        return True
+
+    def verify_block(self, block):
+        # Checks a single block's signature on its own, including batch-signed blocks
+        try:
+            payload, signature = self._signed_payload(block)
+        except (KeyError, TypeError, ValueError):
+            return False
+        return self.verify_signature(payload.decode(), signature)
+
+    @staticmethod
+    def _signed_payload(block):
+        payload = json.dumps(block.data["data"]).encode()
+        signature = base64.b64decode(block.data["signature"])
+        if "merkle_root" in block.data:
+            merkle_root = block.data["merkle_root"]
+            if not verify_merkle_proof(leaf_hash(payload), block.data["merkle_proof"], merkle_root):
+                raise ValueError("Merkle proof does not match root")
+            payload = merkle_root.encode()
+        return payload, signature
+
+    def _verify_signatures(self, items, executor, batch_size):
+        public_key_pem = self.public_key.public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo
+        )
+        batches = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+        if len(batches) <= 1 and executor is None:
+            return _verify_signature_batch(self.key_scheme.name, public_key_pem, items)
+
+        def run(pool):
+            futures = [pool.submit(_verify_signature_batch, self.key_scheme.name, public_key_pem, batch)
+                       for batch in batches]
+            return sorted(index for future in futures for index in future.result())
+
+        if executor is not None:
+            return run(executor)
+        with ThreadPoolExecutor() as pool:
+            return run(pool)
+
     def add_trusted_node(self, node_id, node_type, ip_address):
         new_node = TrustedNode(node_id, node_type, ip_address)
         if not any(node.node_id == new_node.node_id for node in self.trusted_nodes):
@@ -0,0 +1,186 @@
+import codecs
+import hashlib
+import json
+from typing import Iterable, Iterator, Tuple
+
+
+def iter_blockchain_pieces(owner, blocks: Iterable, signer=None) -> Iterator[bytes]:
+    # The document {"owner": ..., "chain": [...]} one block at a time, byte-for-byte identical
+    # to json.dumps of the whole chain. With a signer the document ends in a "seal" field instead:
+    # the SHA-256 of everything through the closing bracket of the chain, the first block index,
+    # the block count and the tip hash, signed with signer(seal)
+    digest = hashlib.sha256()
+    seal = {"start": None, "length": 0, "tip_hash": None}
+    piece = ('{"owner": ' + json.dumps(owner) + ', "chain": [').encode('utf-8')
+    for i, block in enumerate(blocks):
+        if i == 0:
+            seal["start"] = block.index
+        seal["length"] += 1
+        seal["tip_hash"] = block.hash
+        digest.update(piece)
+        yield piece
+        piece = ((', ' if i else '') + json.dumps(block.to_dict())).encode('utf-8')
+    piece += b']'
+    digest.update(piece)
+    yield piece
+    if signer is None:
+        yield b'}'
+        return
+    seal["digest"] = digest.hexdigest()
+    seal["signature"] = signer(seal)
+    yield (', "seal": ' + json.dumps(seal) + '}').encode('utf-8')
+
+
+def rechunk(pieces: Iterable[bytes], chunk_size: int) -> Iterator[bytes]:
+    # Regroups arbitrary pieces into chunk_size chunks; only the last one may be shorter
+    buffer = bytearray()
+    for piece in pieces:
+        buffer += piece
+        if len(buffer) >= chunk_size:
+            whole = len(buffer) - len(buffer) % chunk_size
+            for start in range(0, whole, chunk_size):
+                yield bytes(buffer[start:start + chunk_size])
+            del buffer[:whole]
+    if buffer:
+        yield bytes(buffer)
+
+
+def iter_blockchain_json(owner, blocks: Iterable, chunk_size: int, signer=None) -> Iterator[bytes]:
+    return rechunk(iter_blockchain_pieces(owner, blocks, signer), chunk_size)
+
+
+def iter_chain_events(pieces: Iterable[bytes]) -> Iterator[Tuple[str, object]]:
+    decoder = ChainStreamDecoder()
+    for piece in pieces:
+        yield from decoder.feed(piece)
+    yield from decoder.finish()
+
+
+class ChainStreamDecoder:
+    # Incrementally parses the document produced by iter_blockchain_json and emits
+    # ("owner", owner) followed by ("block", block_dict) events as soon as each one is complete,
+    # then ("seal", seal) if the document is sealed and its digest matches
+    OWNER_PREFIX = '{"owner": '
+    CHAIN_PREFIX = ', "chain": ['
+    SEAL_PREFIX = ', "seal": '
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.position = 0
+        self.state = 'owner'
+        self.retry_at = 0  # Skip re-parsing a partial value until the buffer has grown enough
+        self.digest = hashlib.sha256()
+        self.hashed = 0  # Buffer offset up to which text has gone into the digest
+
+    def feed(self, data: bytes) -> Iterator[Tuple[str, object]]:
+        self.buffer += self.text_decoder.decode(data)
+        yield from self._drain(final=False)
+
+    def finish(self) -> Iterator[Tuple[str, object]]:
+        self.buffer += self.text_decoder.decode(b'', final=True)
+        yield from self._drain(final=True)
+        if self.state != 'done':
+            raise ValueError("Chain stream ended before the document was complete")
+        if self.buffer.strip():
+            raise ValueError("Unexpected data after the end of the chain stream")
+
+    def _drain(self, final):
+        try:
+            while self.state != 'done':
+                if not final and len(self.buffer) < self.retry_at:
+                    return
+                if self.state == 'owner':
+                    if not final and len(self.buffer) < len(self.OWNER_PREFIX):
+                        return
+                    if not self.buffer.startswith(self.OWNER_PREFIX):
+                        raise ValueError("Chain stream does not start with an owner field")
+                    value = self._decode_value(len(self.OWNER_PREFIX), final)
+                    if value is None:
+                        return
+                    owner, end = value
+                    if not final and len(self.buffer) - end < len(self.CHAIN_PREFIX):
+                        return
+                    if not self.buffer.startswith(self.CHAIN_PREFIX, end):
+                        raise ValueError("Chain stream is missing the chain field")
+                    self.position = end + len(self.CHAIN_PREFIX)
+                    self.state = 'blocks'
+                    yield 'owner', owner
+                elif self.state == 'trailer':
+                    seal = self._decode_trailer(final)
+                    if seal is None:
+                        return
+                    if seal is not True:
+                        yield 'seal', seal
+                else:
+                    while self.position < len(self.buffer) and self.buffer[self.position] in ' ,':
+                        self.position += 1
+                    if self.position >= len(self.buffer):
+                        if final:
+                            raise ValueError("Chain stream ended inside the chain")
+                        return
+                    if self.buffer[self.position] == ']':
+                        self.position += 1
+                        self._hash_through(self.position)
+                        self.state = 'trailer'
+                        continue
+                    value = self._decode_value(self.position, final)
+                    if value is None:
+                        return
+                    block, self.position = value
+                    yield 'block', block
+        finally:
+            # Drop everything already parsed, once per feed instead of once per block
+            if self.position:
+                if self.state in ('owner', 'blocks'):
+                    self._hash_through(self.position)
+                self.buffer = self.buffer[self.position:]
+                self.retry_at = max(0, self.retry_at - self.position)
+                self.hashed = max(0, self.hashed - self.position)
+                self.position = 0
+
+    def _hash_through(self, end):
+        # json.dumps output is ASCII, so re-encoding the decoded text reproduces the signed bytes
+        self.digest.update(self.buffer[self.hashed:end].encode('utf-8'))
+        self.hashed = end
+
+    def _decode_trailer(self, final):
+        # Returns True for an unsealed document, the seal once its digest checks out, or None to wait
+        if self.position >= len(self.buffer):
+            if final:
+                raise ValueError("Chain stream ended before the document was complete")
+            return None
+        if self.buffer.startswith('}', self.position):
+            self.position += 1
+            self.state = 'done'
+            return True
+        if not final and len(self.buffer) - self.position < len(self.SEAL_PREFIX):
+            return None
+        if not self.buffer.startswith(self.SEAL_PREFIX, self.position):
+            raise ValueError("Unexpected data after the chain")
+        value = self._decode_value(self.position + len(self.SEAL_PREFIX), final)
+        if value is None:
+            return None
+        seal, end = value
+        if not final and end >= len(self.buffer):
+            return None
+        if not self.buffer.startswith('}', end):
+            raise ValueError("Chain stream seal is not the last field")
+        if not isinstance(seal, dict) or seal.get("digest") != self.digest.hexdigest():
+            raise ValueError("Chain stream does not match its seal digest")
+        self.position = end + 1
+        self.state = 'done'
+        return seal
+
+    def _decode_value(self, start, final):
+        try:
+            value, end = self.decoder.raw_decode(self.buffer, start)
+        except json.JSONDecodeError:
+            if final:
+                raise
+            # Probably incomplete; wait until the buffer doubles so parsing stays linear overall
+            self.retry_at = len(self.buffer) * 2
+            return None
+        self.retry_at = 0
+        return value, end
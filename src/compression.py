@@ -0,0 +1,92 @@
+import lzma
+import zlib
+from typing import Iterable, Iterator
+from src.chain_stream import iter_blockchain_pieces, iter_chain_events, rechunk
+
+# Codec ids are written into share container headers, so an id must never change meaning
+CODEC_IDS = {"none": 0, "zlib": 1, "lzma": 2, "zlib-dict": 3}
+CODEC_NAMES = {codec_id: name for name, codec_id in CODEC_IDS.items()}
+
+# Preset dictionary for "zlib-dict": strings that recur in every chain document. zlib prefers
+# matches near the end of the dictionary, so the most frequent strings come last. Backups depend
+# on these exact bytes; a revised dictionary needs a new codec id.
+BLOCK_JSON_DICTIONARY = ''.join([
+    '{"owner": ", "chain": [{"index": 0, "timestamp": 1, "data": {"data": {"owner": ", "did": "did:glitter:',
+    '", "did_document": {"@context": "https://www.w3.org/ns/did/v1", "id": "did:glitter:',
+    '", "verificationMethod": [{"id": "did:glitter:#keys-1", "type": "RsaVerificationKey2018", ',
+    '"controller": "did:glitter:", "publicKeyJwk": {"kty": "RSA", "n": "", "e": "AQAB"}}], ',
+    '"type": "Ed25519VerificationKey2018", "publicKeyJwk": {"kty": "OKP", "crv": "Ed25519", "x": "',
+    '"authentication": ["did:glitter:#keys-1"], "assertionMethod": ["did:glitter:#keys-1"]}, ',
+    '"creation_time": 1, "blockchain_version": "1.0", "user_message": "Genesis block"}, ',
+    '"previous_hash": "0", "hash": "',
+    '"merkle_root": "", "merkle_proof": [["L", ""], ["R", ""]]}, ',
+    '{"message": "',
+    '"}, "signature": "==", "previous_hash": "", "hash": "',
+    '"}, {"index": 1, "timestamp": 1, "data": {"data": {"message": "',
+]).encode('utf-8')
+
+
+def validate_codec(codec):
+    if codec not in CODEC_IDS:
+        raise ValueError(f"Unknown compression codec: {codec}")
+
+
+def _compressor(codec):
+    if codec == "zlib":
+        return zlib.compressobj(9)
+    if codec == "lzma":
+        return lzma.LZMACompressor()
+    return zlib.compressobj(9, zdict=BLOCK_JSON_DICTIONARY)
+
+
+def _decompressor(codec):
+    if codec == "zlib":
+        return zlib.decompressobj()
+    if codec == "lzma":
+        return lzma.LZMADecompressor()
+    return zlib.decompressobj(zdict=BLOCK_JSON_DICTIONARY)
+
+
+def compress_pieces(pieces: Iterable[bytes], codec) -> Iterator[bytes]:
+    validate_codec(codec)
+    if codec == "none":
+        yield from pieces
+        return
+    compressor = _compressor(codec)
+    for piece in pieces:
+        compressed = compressor.compress(piece)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+
+def decompress_pieces(pieces: Iterable[bytes], codec) -> Iterator[bytes]:
+    validate_codec(codec)
+    if codec == "none":
+        yield from pieces
+        return
+    decompressor = _decompressor(codec)
+    for piece in pieces:
+        if decompressor.eof and piece:
+            raise ValueError("Unexpected data after the end of the compressed backup")
+        try:
+            data = decompressor.decompress(piece)
+        except (zlib.error, lzma.LZMAError) as e:
+            # Reconstructing from a bad share yields garbage; report it like any other corrupt backup
+            raise ValueError(f"Compressed backup is corrupt: {e}")
+        if data:
+            yield data
+        if decompressor.unused_data:
+            raise ValueError("Unexpected data after the end of the compressed backup")
+    if not decompressor.eof:
+        raise ValueError("Compressed backup ended early")
+
+
+def iter_backup_chunks(owner, blocks: Iterable, chunk_size: int, codec="none", signer=None) -> Iterator[bytes]:
+    # The chain document, compressed as a single stream and cut into chunk_size chunks for splitting
+    return rechunk(compress_pieces(iter_blockchain_pieces(owner, blocks, signer), codec), chunk_size)
+
+
+def iter_backup_events(chunks: Iterable[bytes], codec="none"):
+    # Reverses iter_backup_chunks, yielding ("owner", ...), ("block", ...) and, if sealed, ("seal", ...) events
+    return iter_chain_events(decompress_pieces(chunks, codec))
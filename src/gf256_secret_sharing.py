@@ -0,0 +1,180 @@
+import itertools
+import os
+import json
+import logging
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from src.compression import iter_backup_chunks, iter_backup_events, decompress_pieces
+from src.shamir_secret_sharing import validate_share_parameters
+from src.share_format import (serialize_share_rows, serialize_share_columns, deserialize_share_rows,
+                              join_share_columns, write_stream_header, read_stream_rows, encode_value)
+
+
+def _build_tables():
+    # Log/antilog tables for GF(2^8) with the AES polynomial x^8 + x^4 + x^3 + x + 1 and generator 3
+    exp = [0] * 510
+    log = [0] * 256
+    x = 1
+    for i in range(255):
+        exp[i] = x
+        log[x] = i
+        doubled = (x << 1) & 0xff
+        if x & 0x80:
+            doubled ^= 0x1b
+        x = doubled ^ x
+    for i in range(255, 510):
+        exp[i] = exp[i - 255]
+    # Full multiplication table so a whole buffer is multiplied with one fancy-indexing lookup
+    exp_array = np.array(exp, dtype=np.uint8)
+    log_array = np.array(log, dtype=np.int32)
+    mul = exp_array[log_array[:, None] + log_array[None, :]]
+    mul[0, :] = 0
+    mul[:, 0] = 0
+    return exp, log, mul
+
+
+GF_EXP, GF_LOG, GF_MUL = _build_tables()
+
+
+def gf_mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+
+def gf_div(a: int, b: int) -> int:
+    if b == 0:
+        raise ZeroDivisionError("division by zero in GF(256)")
+    if a == 0:
+        return 0
+    return GF_EXP[(GF_LOG[a] - GF_LOG[b]) % 255]
+
+
+class GF256SecretSharing:
+    # Byte-wise Shamir over GF(2^8): every byte of a chunk is its own secret, so whole
+    # buffers are split and reconstructed with vectorized table lookups
+    scheme_name = "gf256"
+
+    def __init__(self, chunk_size: int = 64 * 1024):
+        self.chunk_size = chunk_size
+
+    def split_secret(self, personal_blockchain, n: int, k: int, start: int = 0,
+                     codec="none", seal=False, stop: Optional[int] = None) -> List[List[Tuple[int, bytes]]]:
+        shares_list = list(self.split_stream(personal_blockchain, n, k, start=start, codec=codec, seal=seal,
+                                              stop=stop))
+        logging.debug(f"Number of share lists: {len(shares_list)}")
+        return shares_list
+
+    def split_stream(self, personal_blockchain, n: int, k: int, sinks=None,
+                     checksum=True, start: int = 0, codec="none",
+                     seal=False, stop: Optional[int] = None) -> Iterator[List[Tuple[int, bytes]]]:
+        validate_share_parameters(n, k)
+        if n > 255:
+            raise ValueError("n must be at most 255 in GF(256)")
+        if sinks is not None:
+            if len(sinks) != n:
+                raise ValueError("Need exactly one sink per share holder")
+            for x, sink in enumerate(sinks, start=1):
+                write_stream_header(sink, self.scheme_name, k, n, x, self.chunk_size, checksum, codec)
+        # A non-zero start splits only the blocks from that index on, for delta backups; stop pins the
+        # end, so blocks the event loop appends meanwhile are left for the next backup
+        if start:
+            blocks = personal_blockchain.chain[start:stop]
+        else:
+            blocks = itertools.islice(personal_blockchain.chain, stop)
+        # A sealed backup ends with the owner's signature over the chain digest and tip
+        signer = personal_blockchain.sign_data if seal else None
+        for chunk in iter_backup_chunks(personal_blockchain.owner, blocks, self.chunk_size, codec, signer):
+            shares = self._split_chunk(chunk, n, k)
+            if sinks is not None:
+                for (_, y), sink in zip(shares, sinks):
+                    sink.write(encode_value(y, checksum))
+            yield shares
+
+    def _split_chunk(self, chunk: bytes, n: int, k: int) -> List[Tuple[int, bytes]]:
+        secret = np.frombuffer(chunk, dtype=np.uint8)
+        # Coefficients come from the OS CSPRNG, one row per polynomial degree
+        coefficients = np.frombuffer(os.urandom((k - 1) * len(secret)), dtype=np.uint8).reshape(k - 1, len(secret))
+        shares = []
+        for x in range(1, n + 1):
+            row = GF_MUL[x]
+            # Horner's rule, highest degree first
+            y = coefficients[-1].copy()
+            for coefficient in coefficients[-2::-1]:
+                y = row[y] ^ coefficient
+            y = row[y] ^ secret
+            shares.append((x, y.tobytes()))
+        return shares
+
+    def reconstruct_secret(self, shares_list: List[List[Tuple[int, bytes]]], k: int, codec="none") -> dict:
+        if not shares_list or not all(shares_list):
+            raise ValueError("Invalid shares_list")
+        if not isinstance(k, int) or k < 2:
+            raise ValueError("k must be an integer greater than or equal to 2")
+
+        chunks = (self._reconstruct_chunk(shares, k) for shares in shares_list)
+        reconstructed_data = b''.join(decompress_pieces(chunks, codec))
+        logging.debug(f"Reconstructed data length: {len(reconstructed_data)} bytes")
+        try:
+            json_data = json.loads(reconstructed_data.decode('utf-8'))
+            logging.debug(f"Parsed JSON data keys: {list(json_data.keys())}")
+            return json_data
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            logging.error(f"Error parsing reconstructed data: {e}")
+            raise
+
+    def reconstruct_stream(self, shares_iter: Iterable[List[Tuple[int, bytes]]], k: int,
+                           codec="none") -> Iterator[Tuple[str, object]]:
+        if not isinstance(k, int) or k < 2:
+            raise ValueError("k must be an integer greater than or equal to 2")
+        yield from iter_backup_events((self._reconstruct_chunk(shares, k) for shares in shares_iter), codec)
+
+    def _reconstruct_chunk(self, shares: List[Tuple[int, bytes]], k: int) -> bytes:
+        if len(shares) < k:
+            raise ValueError("Not enough shares to reconstruct the secret")
+        shares = shares[:k]
+        xs = [x for x, _ in shares]
+        if len(set(xs)) != len(xs) or any(not 0 < x < 256 for x in xs):
+            raise ValueError("Share x-coordinates must be distinct values in 1..255")
+        secret = None
+        for i, (x_i, y_i) in enumerate(shares):
+            # Lagrange basis at 0; subtraction is XOR in characteristic 2
+            basis = 1
+            for j, x_j in enumerate(xs):
+                if i != j:
+                    basis = gf_mul(basis, gf_div(x_j, x_i ^ x_j))
+            term = GF_MUL[basis][np.frombuffer(y_i, dtype=np.uint8)]
+            secret = term if secret is None else secret ^ term
+        return secret.tobytes()
+
+    def split_chunk_range(self, chunks: List[bytes], n: int, k: int, checksum=True) -> Tuple[List[bytes], int, int]:
+        # Splits a consecutive run of chunks, typically in a worker process, and returns each holder's
+        # encoded values with the chunk count and the size of the last value for join_share_slices
+        bodies = [[] for _ in range(n)]
+        raw = b''
+        for chunk in chunks:
+            for body, (_, y) in zip(bodies, self._split_chunk(chunk, n, k)):
+                raw = y
+                body.append(encode_value(raw, checksum))
+        return [b''.join(body) for body in bodies], len(chunks), len(raw)
+
+    def join_share_slices(self, ranges, k: int = 0, checksum=True, codec="none") -> List[bytes]:
+        return join_share_columns(self.scheme_name, ranges, k, self.chunk_size, checksum, codec)
+
+    def reconstruct_chunk_range(self, shares_list: List[List[Tuple[int, bytes]]], k: int) -> bytes:
+        return b''.join(self._reconstruct_chunk(shares, k) for shares in shares_list)
+
+    def read_share_rows(self, sources: Dict[int, BinaryIO], verify=True, headers=None) -> Iterator[List[Tuple[int, bytes]]]:
+        return read_stream_rows(sources, bytes, verify, headers)
+
+    def serialize_share_slices(self, shares_list, k: int = 0, checksum=True, codec="none") -> List[bytes]:
+        # One self-contained container per holder, in x order
+        return serialize_share_columns(self.scheme_name, shares_list, k, self.chunk_size, bytes, checksum, codec)
+
+    def serialize_shares(self, shares_list: List[List[Tuple[int, bytes]]], k: int = 0, checksum=True,
+                         codec="none") -> bytes:
+        return serialize_share_rows(self.scheme_name, shares_list, k, self.chunk_size, bytes, checksum, codec)
+
+    def deserialize_shares(self, serialized_shares, verify=True) -> List[List[Tuple[int, memoryview]]]:
+        # y-values stay memoryviews into the serialized buffer; NumPy reads them without copying
+        return deserialize_share_rows(serialized_shares, lambda value: value, verify)
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from cryptography.hazmat.primitives import serialization
+from src.key_schemes import get_key_scheme
+
+
+def _generate_private_key_pem(scheme_name):
+    # Runs in a worker process; keys cross the process boundary as PKCS8 PEM
+    private_key = get_key_scheme(scheme_name).generate_private_key()
+    return private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.PKCS8,
+        encryption_algorithm=serialization.NoEncryption()
+    )
+
+
+class KeyPool:
+    def __init__(self, key_scheme="rsa", size=16, executor=None, max_workers=None):
+        self.key_scheme = get_key_scheme(key_scheme)
+        self.size = size
+        self.executor = executor
+        self.owns_executor = executor is None
+        self.max_workers = max_workers
+        self.ready = deque()  # PEM-encoded private keys waiting to be handed out
+        self.pending = set()  # Futures for keys still being generated
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def _get_executor(self):
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers)
+        return self.executor
+
+    def refill(self):
+        if self.closed:
+            return
+        submitted = []
+        with self.lock:
+            missing = self.size - len(self.ready) - len(self.pending)
+            for _ in range(max(0, missing)):
+                future = self._get_executor().submit(_generate_private_key_pem, self.key_scheme.name)
+                self.pending.add(future)
+                submitted.append(future)
+        # Callbacks may run immediately for finished futures, so register them outside the lock
+        for future in submitted:
+            future.add_done_callback(self._on_generated)
+
+    def _on_generated(self, future):
+        # Publish the key before dropping the future so waiters always see one or the other
+        if not future.cancelled():
+            error = future.exception()
+            if error is not None:
+                logging.error(f"Background key generation failed: {error}")
+            else:
+                self.ready.append(future.result())
+        with self.lock:
+            self.pending.discard(future)
+
+    def _take_ready(self):
+        try:
+            pem = self.ready.popleft()
+        except IndexError:
+            return None
+        return serialization.load_pem_private_key(pem, password=None)
+
+    def get(self):
+        # Never waits on the pool: falls back to generating inline when it is empty
+        private_key = self._take_ready()
+        self.refill()
+        if private_key is None:
+            logging.debug(f"Key pool empty, generating {self.key_scheme.name} key inline")
+            private_key = self.key_scheme.generate_private_key()
+        return private_key
+
+    async def acquire(self):
+        while True:
+            private_key = self._take_ready()
+            self.refill()
+            if private_key is not None:
+                return private_key
+            with self.lock:
+                pending = list(self.pending)
+            if not pending:
+                loop = asyncio.get_running_loop()
+                pem = await loop.run_in_executor(self._get_executor(), _generate_private_key_pem,
+                                                 self.key_scheme.name)
+                return serialization.load_pem_private_key(pem, password=None)
+            await asyncio.wait([asyncio.wrap_future(future) for future in pending],
+                               return_when=asyncio.FIRST_COMPLETED)
+
+    def available(self):
+        return len(self.ready)
+
+    def close(self):
+        self.closed = True
+        with self.lock:
+            pending = list(self.pending)
+        for future in pending:
+            future.cancel()
+        if self.owns_executor and self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
@@ -0,0 +1,95 @@
+import base64
+from typing import Dict
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa, padding, ed25519
+
+
+class RSAKeyScheme:
+    name = "rsa"
+    verification_method_type = "RsaVerificationKey2018"
+
+    def __init__(self, key_size=2048):
+        self.key_size = key_size
+
+    def generate_private_key(self):
+        return rsa.generate_private_key(public_exponent=65537, key_size=self.key_size)
+
+    @staticmethod
+    def _padding():
+        return padding.PSS(
+            mgf=padding.MGF1(hashes.SHA256()),
+            salt_length=padding.PSS.MAX_LENGTH
+        )
+
+    def sign(self, private_key, data: bytes) -> bytes:
+        return private_key.sign(data, self._padding(), hashes.SHA256())
+
+    def verify(self, public_key, signature: bytes, data: bytes) -> bool:
+        try:
+            public_key.verify(signature, data, self._padding(), hashes.SHA256())
+            return True
+        except InvalidSignature:
+            return False
+
+    def public_key_to_jwk(self, public_key) -> Dict:
+        public_numbers = public_key.public_numbers()
+        return {
+            "kty": "RSA",
+            "n": base64.urlsafe_b64encode(public_numbers.n.to_bytes((public_numbers.n.bit_length() + 7) // 8, byteorder='big')).decode('utf-8'),
+            "e": base64.urlsafe_b64encode(public_numbers.e.to_bytes((public_numbers.e.bit_length() + 7) // 8, byteorder='big')).decode('utf-8')
+        }
+
+    def owns_key(self, key) -> bool:
+        return isinstance(key, (rsa.RSAPrivateKey, rsa.RSAPublicKey))
+
+
+class Ed25519KeyScheme:
+    name = "ed25519"
+    verification_method_type = "Ed25519VerificationKey2018"
+
+    def generate_private_key(self):
+        return ed25519.Ed25519PrivateKey.generate()
+
+    def sign(self, private_key, data: bytes) -> bytes:
+        return private_key.sign(data)
+
+    def verify(self, public_key, signature: bytes, data: bytes) -> bool:
+        try:
+            public_key.verify(signature, data)
+            return True
+        except InvalidSignature:
+            return False
+
+    def public_key_to_jwk(self, public_key) -> Dict:
+        raw = public_key.public_bytes(
+            encoding=serialization.Encoding.Raw,
+            format=serialization.PublicFormat.Raw
+        )
+        # RFC 8037 OKP key; base64url without padding
+        return {
+            "kty": "OKP",
+            "crv": "Ed25519",
+            "x": base64.urlsafe_b64encode(raw).decode('utf-8').rstrip('=')
+        }
+
+    def owns_key(self, key) -> bool:
+        return isinstance(key, (ed25519.Ed25519PrivateKey, ed25519.Ed25519PublicKey))
+
+
+KEY_SCHEMES = {scheme.name: scheme for scheme in (RSAKeyScheme(), Ed25519KeyScheme())}
+
+
+def get_key_scheme(scheme):
+    if isinstance(scheme, str):
+        if scheme not in KEY_SCHEMES:
+            raise ValueError(f"Unknown key scheme: {scheme}")
+        return KEY_SCHEMES[scheme]
+    return scheme
+
+
+def key_scheme_for_key(key):
+    for scheme in KEY_SCHEMES.values():
+        if scheme.owns_key(key):
+            return scheme
+    raise ValueError(f"Unsupported key type: {type(key).__name__}")
@@ -0,0 +1,54 @@
+import hashlib
+from typing import List, Tuple
+
+# Domain separation between leaves and inner nodes prevents second-preimage tricks
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+
+def leaf_hash(data: bytes) -> bytes:
+    return hashlib.sha256(LEAF_PREFIX + data).digest()
+
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+
+def build_merkle_tree(leaves: List[bytes]) -> Tuple[str, List[List[List[str]]]]:
+    # Returns the hex root and, per leaf, its inclusion proof as [side, sibling_hex] pairs
+    if not leaves:
+        raise ValueError("Cannot build a Merkle tree without leaves")
+    level = list(leaves)
+    positions = list(range(len(leaves)))
+    proofs = [[] for _ in leaves]
+    while len(level) > 1:
+        for leaf, position in enumerate(positions):
+            sibling = position ^ 1
+            if sibling < len(level):
+                side = 'L' if sibling < position else 'R'
+                proofs[leaf].append([side, level[sibling].hex()])
+            positions[leaf] = position // 2
+        # An odd node at the end of a level is promoted unchanged
+        level = [node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                 for i in range(0, len(level), 2)]
+    return level[0].hex(), proofs
+
+
+def merkle_root_from_proof(leaf: bytes, proof: List[List[str]]) -> str:
+    current = leaf
+    for side, sibling_hex in proof:
+        sibling = bytes.fromhex(sibling_hex)
+        if side == 'L':
+            current = node_hash(sibling, current)
+        elif side == 'R':
+            current = node_hash(current, sibling)
+        else:
+            raise ValueError(f"Invalid proof step side: {side}")
+    return current.hex()
+
+
+def verify_merkle_proof(leaf: bytes, proof: List[List[str]], root: str) -> bool:
+    try:
+        return merkle_root_from_proof(leaf, proof) == root
+    except (ValueError, TypeError):
+        return False
@@ -0,0 +1,90 @@
+import logging
+from urllib.parse import quote
+import aiohttp
+from aiohttp import web
+
+
+class NodeHost:
+    # One aiohttp listener for many virtual P2PNetwork nodes. Each node answers under /n/<name>/ with its
+    # usual routes (POST, /backup, /blocks, /ws), so thousands of users share one port, one runner and one
+    # pooled client session. Nodes attached to the same host deliver messages to each other in-process
+    PREFIX = '/n'
+
+    def __init__(self, host='localhost', connection_limit=100, connections_per_peer=8, keepalive_timeout=30.0,
+                 dns_cache_ttl=300):
+        self.host = host
+        self.networks = {}  # name: attached P2PNetwork; a node may be reachable under several names
+        self.app = web.Application()
+        self.app.router.add_post(self.PREFIX + '/{name}', self._route('receive_data'))
+        self.app.router.add_get(self.PREFIX + '/{name}/backup', self._route('handle_backup_request'))
+        self.app.router.add_get(self.PREFIX + '/{name}/blocks', self._route('handle_blocks_request'))
+        self.app.router.add_get(self.PREFIX + '/{name}/ws', self.handle_channel)
+        self.runner = None
+        self.port = None
+        self.session = None
+        self.connection_limit = connection_limit
+        self.connections_per_peer = connections_per_peer
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+
+    def path_for(self, name):
+        return f'{self.PREFIX}/{quote(name, safe=":")}'
+
+    def attach(self, network, *names):
+        # names default to the node's username; a DID can be added as a second route to the same node
+        names = names or (network.username,)
+        for name in names:
+            if self.networks.get(name, network) is not network:
+                raise ValueError(f"Another node is already hosted as {name}")
+        for name in names:
+            self.networks[name] = network
+        network.node_host = self
+        logging.info(f"Hosting node {names[0]} at {self.path_for(names[0])}")
+
+    def detach(self, network):
+        for name in [name for name, hosted in self.networks.items() if hosted is network]:
+            del self.networks[name]
+        network.node_host = None
+
+    def local_network(self, name):
+        return self.networks.get(name)
+
+    def _route(self, handler_name):
+        async def handler(request):
+            network = self.networks.get(request.match_info['name'])
+            if network is None:
+                return web.Response(status=404, text="Node not found")
+            return await getattr(network, handler_name)(request)
+        return handler
+
+    async def handle_channel(self, request):
+        network = self.networks.get(request.match_info['name'])
+        if network is None or network.transport != "websocket":
+            return web.Response(status=404, text="Node does not accept channels")
+        return await network.handle_channel(request)
+
+    async def get_session(self):
+        # Shared by every hosted node for its traffic to nodes on other hosts
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connection_limit, limit_per_host=self.connections_per_peer,
+                                             keepalive_timeout=self.keepalive_timeout,
+                                             ttl_dns_cache=self.dns_cache_ttl)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    async def start(self, port):
+        self.runner = web.AppRunner(self.app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, port)
+        await site.start()
+        self.port = self.runner.addresses[0][1]  # The port picked by the OS when given 0
+        logging.info(f"Node host started on {self.host}:{port} serving {len(self.networks)} node routes")
+
+    async def stop(self):
+        # Hosted nodes are stopped by their owner; this closes what they share
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+        if self.runner:
+            await self.runner.cleanup()
+            self.runner = None
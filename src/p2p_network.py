@@ -1,21 +1,114 @@
 import asyncio
+import hashlib
+import random
+import uuid
+from collections import OrderedDict
 import aiohttp
 from aiohttp import web
 import json
 import logging
+from src.block import Block
+from src.backup_store import BackupStore
+from src.peer_channel import channel_protocols, decode_frames, encode_frames
+
+TRANSPORTS = ("http", "websocket")
+
+
+def parse_byte_range(header, size):
+    # A single "bytes=first-last", "bytes=first-" or "bytes=-suffix" range as (start, end), end exclusive.
+    # None when the range is well-formed but lies outside the size; ValueError when it is malformed
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or ',' in spec:
+        raise ValueError(f"Unsupported range: {header}")
+    first, separator, last = (part.strip() for part in spec.partition('-'))
+    if not separator or not (first or last) or (first and not first.isdigit()) or (last and not last.isdigit()):
+        raise ValueError(f"Malformed range: {header}")
+    if not first:
+        suffix = int(last)
+        return (max(0, size - suffix), size) if suffix and size else None
+    start = int(first)
+    if last and int(last) < start:
+        raise ValueError(f"Malformed range: {header}")
+    if start >= size:
+        return None
+    return start, (min(int(last) + 1, size) if last else size)
+
+
+def etag_matches(header, etag):
+    # If-None-Match comparison; weak validators match too, since blobs never change in place
+    return any(tag.strip() in ('*', etag, 'W/' + etag) for tag in header.split(','))
+
+
+def if_range_matches(header, etag):
+    # If-Range holds one validator and needs a strong match, so a weak tag, a list or a date never matches
+    return header.strip() == etag
+
+
+def valid_gossip(gossip):
+    # Gossip metadata comes from peers, so its shape is checked before anything is forwarded
+    return (isinstance(gossip, dict) and isinstance(gossip.get('id'), str) and
+            isinstance(gossip.get('ttl'), int) and not isinstance(gossip['ttl'], bool) and
+            isinstance(gossip.get('hop'), (str, type(None))))
 
 
 class P2PNetwork:
-    def __init__(self, host='localhost'):
+    def __init__(self, host='localhost', connection_limit=100, connections_per_peer=8,
+                 keepalive_timeout=30.0, dns_cache_ttl=300, outbox_size=256, max_in_flight=4, max_batch=64,
+                 transport="http", username=None, seen_cache_size=4096, sync_chunk_size=64 * 1024,
+                 backup_store=None, gossip_fanout=3, max_gossip_ttl=16, channel_retry_delay=5.0):
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown transport: {transport}")
         self.host = host
         self.nodes = {}  # username: (port, node_id)
+        self.paths = {}  # username: route prefix of a peer hosted on a shared NodeHost listener
+        self.node_host = None  # Set when this node is a virtual node of a NodeHost instead of listening itself
         self.app = web.Application()
         self.app.router.add_post('/', self.receive_data)
         self.app.router.add_get('/backup', self.handle_backup_request)
+        self.app.router.add_get('/blocks', self.handle_blocks_request)
+        # "websocket" keeps one binary channel per peer open and falls back to HTTP for peers without one
+        self.transport = transport
+        if transport == "websocket":
+            self.app.router.add_get('/ws', self.handle_channel)
+        self.channels = {}  # username: open outgoing channel
+        self.channel_locks = {}  # username: lock held while the channel is being opened
+        self.http_peers = set()  # Peers that refused a channel
+        # Peers whose channel failed to open for another reason get HTTP until the delay has passed
+        self.channel_retry_at = {}  # username: loop time of the next channel attempt
+        self.channel_retry_delay = channel_retry_delay
+        self.incoming_channels = set()
+        self.username = username  # This node's own entry in nodes, never a gossip target
+        self.on_message = None  # Optional callback(sender, message) for every delivered message
+        self.seen_messages = OrderedDict()  # Bounded LRU of gossip ids already handled
+        self.seen_cache_size = seen_cache_size
+        self.gossip_tasks = set()
+        # Forwarded gossip goes to this node's own fanout, and hops left are capped, whatever a peer asks for
+        self.gossip_fanout = gossip_fanout
+        self.max_gossip_ttl = max_gossip_ttl
+        self.chains = {}  # owner: PersonalBlockchain whose blocks are served at /blocks
+        self.sync_chunk_size = sync_chunk_size  # NDJSON bytes buffered per streamed write
+        self.backup_chunk_size = 256 * 1024  # Bytes read from a blob file per streamed write
+        self.fetched_backups = {}  # (peer, node_id, backup_id): (etag, backup) from fetch_backup
         self.runner = None
-        self.backups = {}  # node_id: backup_data
+        # (node_id, backup_id): backup_data, on disk when given a BackupStore with a root directory
+        self.backups = backup_store if backup_store is not None else BackupStore()
+        # One keep-alive client session per node, so messages reuse pooled connections
+        self.session = None
+        self.connection_limit = connection_limit
+        self.connections_per_peer = connections_per_peer
+        self.keepalive_timeout = keepalive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        # Per-peer outbound queues, each drained by at most max_in_flight concurrent requests
+        self.outboxes = {}  # username: asyncio.Queue of (sender, data, delivered future)
+        self.outbox_workers = {}  # username: worker tasks
+        self.outbox_size = outbox_size
+        self.max_in_flight = max_in_flight
+        self.max_batch = max_batch  # Queued messages coalesced into one POST
 
     async def start(self, port):
+        if self.node_host is not None:
+            raise ValueError("A hosted node is served by its NodeHost listener")
+        await self.get_session()
         self.runner = web.AppRunner(self.app)
         await self.runner.setup()
         site = web.TCPSite(self.runner, self.host, port)
@@ -23,62 +116,464 @@ class P2PNetwork:
         logging.info(f"P2P network node started on {self.host}:{port}")
 
     async def stop(self):
+        for workers in self.outbox_workers.values():
+            for worker in workers:
+                worker.cancel()
+        await asyncio.gather(*(worker for workers in self.outbox_workers.values() for worker in workers),
+                             return_exceptions=True)
+        for queue in self.outboxes.values():
+            while not queue.empty():
+                queue.get_nowait()[2].cancel()
+        self.outboxes = {}
+        self.outbox_workers = {}
+        for task in list(self.gossip_tasks):
+            task.cancel()
+        for channel in list(self.channels.values()) + list(self.incoming_channels):
+            await channel.close()
+        self.channels = {}
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
         if self.runner:
             await self.runner.cleanup()
+        self.backups.close()
 
-    def add_node(self, username, port, node_id):
+    async def get_session(self):
+        # Opened by start, or on first use for a node that only sends
+        if self.node_host is not None:
+            return await self.node_host.get_session()
+        if self.session is None or self.session.closed:
+            connector = aiohttp.TCPConnector(limit=self.connection_limit, limit_per_host=self.connections_per_peer,
+                                             keepalive_timeout=self.keepalive_timeout,
+                                             ttl_dns_cache=self.dns_cache_ttl)
+            self.session = aiohttp.ClientSession(connector=connector)
+        return self.session
+
+    def add_node(self, username, port, node_id, path=''):
         self.nodes[username] = (port, node_id)
+        if path:
+            self.paths[username] = path
+
+    def peer_url(self, username, endpoint=''):
+        port, _ = self.nodes[username]
+        return f'http://{self.host}:{port}{self.paths.get(username, "")}{endpoint}'
+
+    def _local_peer(self, username):
+        # The peer's P2PNetwork when both are virtual nodes of the same NodeHost
+        if self.node_host is None or username == self.username:
+            return None
+        return self.node_host.local_network(username)
 
     async def receive_data(self, request):
         data = await request.json()
-        sender = data.get('sender')
-        message = data.get('message')
-        logging.info(f"Received data from {sender}: {message}")
+        # A coalesced POST carries several {'sender', 'message'} envelopes under 'batch'
+        for envelope in data.get('batch', [data]):
+            self.handle_envelope(envelope)
         return web.Response(text="Data received")
 
+    def handle_envelope(self, envelope):
+        sender = envelope.get('sender')
+        message = envelope.get('message')
+        gossip = envelope.get('gossip')
+        if gossip is not None and not valid_gossip(gossip):
+            logging.warning(f"Dropped malformed gossip from {sender}")
+            return
+        if gossip is not None and not self._mark_seen(gossip['id']):
+            logging.debug(f"Dropped gossip {gossip['id']} from {sender}, already seen")
+            return
+        logging.info(f"Received data from {sender}: {message}")
+        if self.on_message is not None:
+            self.on_message(sender, message)
+        ttl = min(gossip['ttl'], self.max_gossip_ttl) if gossip is not None else 0
+        if ttl > 1:
+            forwarded = dict(envelope, gossip={'id': gossip['id'], 'ttl': ttl - 1, 'hop': self.username})
+            task = asyncio.ensure_future(self._spread(forwarded, {sender, gossip.get('hop')}, self.gossip_fanout))
+            self.gossip_tasks.add(task)
+            task.add_done_callback(self.gossip_tasks.discard)
+
+    def _mark_seen(self, message_id):
+        # False if the id was already seen
+        if message_id in self.seen_messages:
+            self.seen_messages.move_to_end(message_id)
+            return False
+        self.seen_messages[message_id] = None
+        if len(self.seen_messages) > self.seen_cache_size:
+            self.seen_messages.popitem(last=False)
+        return True
+
+    async def gossip(self, sender_username, data, fanout=None, ttl=6):
+        # Epidemic propagation: the message goes to fanout random peers and each forwards it to its own
+        # gossip_fanout peers until ttl hops are used up, so every node sends O(fanout) copies whatever
+        # its degree
+        message_id = uuid.uuid4().hex
+        self._mark_seen(message_id)
+        envelope = {
+            'sender': sender_username,
+            'message': data,
+            'gossip': {'id': message_id, 'ttl': min(ttl, self.max_gossip_ttl), 'hop': self.username}
+        }
+        await self._spread(envelope, {sender_username}, fanout or self.gossip_fanout)
+        return message_id
+
+    async def _spread(self, envelope, exclude, fanout):
+        candidates = [username for username in self.nodes if username not in exclude and username != self.username]
+        targets = random.sample(candidates, min(fanout, len(candidates)))
+        await asyncio.gather(*(self.send_envelopes(target, [envelope]) for target in targets))
+
+    async def handle_channel(self, request):
+        # The envelope codec is the WebSocket subprotocol both ends support
+        channel = web.WebSocketResponse(protocols=channel_protocols())
+        await channel.prepare(request)
+        if channel.ws_protocol is None:
+            await channel.close()
+            return channel
+        self.incoming_channels.add(channel)
+        try:
+            async for frame in channel:
+                if frame.type != aiohttp.WSMsgType.BINARY:
+                    continue
+                try:
+                    envelopes = decode_frames(channel.ws_protocol, frame.data)
+                except ValueError as e:
+                    logging.error(f"Dropped malformed channel frame: {str(e)}")
+                    continue
+                for envelope in envelopes:
+                    self.handle_envelope(envelope)
+        finally:
+            self.incoming_channels.discard(channel)
+        return channel
+
+    async def _get_channel(self, receiver_username):
+        lock = self.channel_locks.setdefault(receiver_username, asyncio.Lock())
+        async with lock:
+            channel = self.channels.get(receiver_username)
+            if channel is not None and not channel.closed:
+                return channel
+            session = await self.get_session()
+            try:
+                channel = await session.ws_connect(self.peer_url(receiver_username, '/ws'),
+                                                   protocols=channel_protocols())
+            except aiohttp.WSServerHandshakeError as e:
+                logging.info(f"{receiver_username} does not accept channels (status {e.status}), using HTTP")
+                self.http_peers.add(receiver_username)
+                return None
+            except Exception as e:
+                logging.warning(f"Could not open a channel to {receiver_username}, using HTTP for "
+                                f"{self.channel_retry_delay}s: {str(e)}")
+                self.channel_retry_at[receiver_username] = asyncio.get_running_loop().time() + self.channel_retry_delay
+                return None
+            self.channel_retry_at.pop(receiver_username, None)
+            if channel.protocol is None:
+                logging.info(f"{receiver_username} shares no channel codec with us, using HTTP")
+                await channel.close()
+                self.http_peers.add(receiver_username)
+                return None
+            self.channels[receiver_username] = channel
+            return channel
+
+    async def _send_over_channel(self, receiver_username, envelopes):
+        # True once the envelopes are on the peer's channel; False means send them over HTTP
+        if self.transport != "websocket" or receiver_username in self.http_peers:
+            return False
+        if self.channel_retry_at.get(receiver_username, 0) > asyncio.get_running_loop().time():
+            return False
+        channel = await self._get_channel(receiver_username)
+        if channel is None:
+            return False
+        try:
+            await channel.send_bytes(encode_frames(channel.protocol, envelopes))
+            return True
+        except Exception as e:
+            logging.warning(f"Channel to {receiver_username} failed, falling back to HTTP: {str(e)}")
+            self.channels.pop(receiver_username, None)
+            return False
+
     async def send_data(self, receiver_username, sender_username, data):
+        await self.send_envelopes(receiver_username, [{'sender': sender_username, 'message': data}])
+
+    async def send_batch(self, receiver_username, messages):
+        # messages is a list of (sender, data), delivered in one POST or one channel message
+        await self.send_envelopes(receiver_username, [{'sender': sender, 'message': data} for sender, data in messages])
+
+    async def send_envelopes(self, receiver_username, envelopes):
         if receiver_username not in self.nodes:
             raise ValueError(f"Unknown receiver: {receiver_username}")
 
-        receiver_port, _ = self.nodes[receiver_username]
-        message = {
-            'sender': sender_username,
-            'message': data
-        }
+        local_peer = self._local_peer(receiver_username)
+        if local_peer is not None:
+            # Same listener: hand the envelopes over in-process, no socket or JSON round trip
+            for envelope in envelopes:
+                local_peer.handle_envelope(envelope)
+            logging.debug(f"Delivered {len(envelopes)} messages to {receiver_username} locally")
+            return
+        if await self._send_over_channel(receiver_username, envelopes):
+            logging.info(f"Sent {len(envelopes)} messages to {receiver_username} over its channel")
+            return
+        # Several envelopes go out as one coalesced POST
+        payload = envelopes[0] if len(envelopes) == 1 else {'batch': envelopes}
 
         try:
-            async with aiohttp.ClientSession() as session:
-                async with session.post(f'http://{self.host}:{receiver_port}', json=message) as response:
-                    if response.status == 200:
-                        logging.info(f"Data sent to {receiver_username} successfully")
-                    else:
-                        logging.error(f"Failed to send data to {receiver_username}. Status: {response.status}")
+            session = await self.get_session()
+            async with session.post(self.peer_url(receiver_username), json=payload) as response:
+                if response.status != 200:
+                    logging.error(f"Failed to send data to {receiver_username}. Status: {response.status}")
+                elif len(envelopes) == 1:
+                    logging.info(f"Data sent to {receiver_username} successfully")
+                else:
+                    logging.info(f"Sent {len(envelopes)} messages to {receiver_username} in one batch")
         except Exception as e:
             logging.error(f"Network error when sending data to {receiver_username}: {str(e)}")
 
+    async def enqueue(self, receiver_username, sender_username, data):
+        # Waits while the peer's outbox is full, so a burst slows its sender down instead of
+        # piling up requests; returns a future that resolves once the message has been sent
+        if receiver_username not in self.nodes:
+            raise ValueError(f"Unknown receiver: {receiver_username}")
+        queue = self.outboxes.get(receiver_username)
+        if queue is None:
+            queue = self.outboxes[receiver_username] = asyncio.Queue(self.outbox_size)
+            self.outbox_workers[receiver_username] = [
+                asyncio.ensure_future(self._drain_outbox(receiver_username, queue)) for _ in range(self.max_in_flight)
+            ]
+        delivered = asyncio.get_running_loop().create_future()
+        await queue.put((sender_username, data, delivered))
+        return delivered
+
+    async def _drain_outbox(self, receiver_username, queue):
+        while True:
+            batch = [await queue.get()]
+            while len(batch) < self.max_batch and not queue.empty():
+                batch.append(queue.get_nowait())
+            try:
+                if len(batch) == 1:
+                    sender_username, data, _ = batch[0]
+                    await self.send_data(receiver_username, sender_username, data)
+                else:
+                    await self.send_batch(receiver_username, [(sender, data) for sender, data, _ in batch])
+            except Exception as e:
+                logging.error(f"Failed to deliver queued messages to {receiver_username}: {str(e)}")
+            finally:
+                for _, _, delivered in batch:
+                    if not delivered.done():
+                        delivered.set_result(None)
+                    queue.task_done()
+
     async def broadcast(self, sender_username, data):
-        tasks = []
+        # Goes through the per-peer outboxes; concurrent broadcasts to a busy peer share one POST.
+        # Peers on the same NodeHost get the message directly, without an outbox or its workers
+        deliveries = []
         for username in self.nodes:
-            if username != sender_username:
-                tasks.append(self.send_data(username, sender_username, data))
-        await asyncio.gather(*tasks)
+            if username == sender_username:
+                continue
+            if self._local_peer(username) is not None:
+                await self.send_data(username, sender_username, data)
+            else:
+                deliveries.append(await self.enqueue(username, sender_username, data))
+        await asyncio.gather(*deliveries)
 
-    async def send_backup(self, node_id, backup_data):
-        self.backups[node_id] = backup_data
+    async def send_backup(self, node_id, backup_data, backup_id=None, owner=None):
+        # backup_id tells apart the pieces of an incremental backup held by the same node; owner is
+        # charged for the stored bytes and defaults to this node's user. Store I/O runs off the loop
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None, self.backups.put, (node_id, backup_id), backup_data, owner or self.username)
+        except ValueError as e:
+            logging.error(f"Backup for node {node_id} rejected: {str(e)}")
+            return False
         logging.info(f"Backup sent to node: {node_id}")
         return True
 
-    async def request_backup(self, node_id):
-        if node_id in self.backups:
+    async def request_backup(self, node_id, backup_id=None):
+        backup = await asyncio.get_running_loop().run_in_executor(None, self.backups.get, (node_id, backup_id))
+        if backup is not None:
             logging.info(f"Backup found for node: {node_id}")
-            return self.backups[node_id]
+            return backup
         logging.warning(f"No backup found for node: {node_id}")
         return None
 
+    async def discard_backup(self, node_id, backup_id=None):
+        return await asyncio.get_running_loop().run_in_executor(None, self.backups.delete, (node_id, backup_id))
+
+    def serve_chain(self, blockchain):
+        self.chains[blockchain.owner] = blockchain
+
+    async def handle_blocks_request(self, request):
+        # Streams the blocks from index "from" on as NDJSON, one block per line; the chain length is
+        # taken when the request arrives, so blocks added meanwhile wait for the next sync
+        blockchain = self.chains.get(request.query.get('owner', self.username))
+        if blockchain is None:
+            return web.Response(status=404, text="Chain not found")
+        try:
+            start = int(request.query.get('from', 0))
+        except ValueError:
+            return web.Response(status=400, text="Invalid start index")
+        if start < 0:
+            return web.Response(status=400, text="Invalid start index")
+        chain = blockchain.chain
+        end = len(chain)
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson', 'X-Chain-Length': str(end)})
+        response.enable_chunked_encoding()
+        await response.prepare(request)
+        pending = []
+        size = 0
+        for index in range(start, end):
+            line = (json.dumps(chain[index].to_dict()) + '\n').encode('utf-8')
+            pending.append(line)
+            size += len(line)
+            if size >= self.sync_chunk_size:
+                await response.write(b''.join(pending))
+                pending = []
+                size = 0
+        if pending:
+            await response.write(b''.join(pending))
+        await response.write_eof()
+        logging.info(f"Served blocks {start} to {end - 1} of {blockchain.owner}")
+        return response
+
+    async def sync_chain(self, peer_username, blockchain):
+        # Catches blockchain up from a peer in one streamed request, resuming after the local tip. Each
+        # block must extend the chain, match its hash and carry the owner's signature before it is
+        # appended; the first one that does not ends the sync. Returns the number of blocks added
+        if peer_username not in self.nodes:
+            raise ValueError(f"Unknown peer: {peer_username}")
+        chain = blockchain.chain
+        params = {'owner': blockchain.owner, 'from': str(len(chain))}
+        added = 0
+        try:
+            session = await self.get_session()
+            async with session.get(self.peer_url(peer_username, '/blocks'), params=params) as response:
+                if response.status != 200:
+                    logging.error(f"Failed to sync {blockchain.owner} from {peer_username}. Status: {response.status}")
+                    return 0
+                pending = bytearray()
+                async for data in response.content.iter_any():
+                    pending += data
+                    if b'\n' not in data:
+                        continue
+                    lines = pending.split(b'\n')
+                    pending = bytearray(lines.pop())
+                    for line in lines:
+                        block = Block.from_dict(json.loads(line))
+                        if (block.index != len(chain) or block.previous_hash != chain[-1].hash
+                                or block.calculate_hash() != block.hash or not blockchain.verify_block(block)):
+                            logging.error(f"Block {block.index} from {peer_username} does not extend "
+                                          f"the chain of {blockchain.owner}, stopping sync")
+                            return added
+                        chain.append(block)
+                        added += 1
+                if pending.strip():
+                    raise ValueError("Block stream ended inside a block")
+        except Exception as e:
+            logging.error(f"Error syncing {blockchain.owner} from {peer_username}: {str(e)}")
+            return added
+        logging.info(f"Synced {added} blocks of {blockchain.owner} from {peer_username}")
+        return added
+
     async def handle_backup_request(self, request):
+        # Serves the stored encoding as is: the ETag is its content hash, If-None-Match gets a 304 and
+        # a single byte Range (guarded by If-Range) gets a 206, so probes and resumed downloads only
+        # move the bytes the client lacks. Blob files are streamed in chunks rather than read whole
         node_id = request.query.get('node_id')
-        if node_id in self.backups:
-            logging.info(f"Serving backup for node: {node_id}")
-            return web.json_response(self.backups[node_id])
-        logging.warning(f"Backup not found for node: {node_id}")
-        return web.Response(status=404, text="Backup not found")
\ No newline at end of file
+        backup_id = request.query.get('backup_id')
+        blob = self.backups.blob((node_id, backup_id))
+        if blob is None:
+            logging.warning(f"Backup not found for node: {node_id}")
+            return web.Response(status=404, text="Backup not found")
+        digest, kind, size, source = blob
+        etag = f'"{digest}"'
+        # Share slices are binary; manifests are JSON
+        headers = {'ETag': etag, 'Accept-Ranges': 'bytes',
+                   'Content-Type': 'application/octet-stream' if kind == "bytes" else 'application/json'}
+        if etag_matches(request.headers.get('If-None-Match', ''), etag):
+            logging.info(f"Backup for node {node_id} not modified")
+            return web.Response(status=304, headers={'ETag': etag})
+        start, end, status = 0, size, 200
+        range_header = request.headers.get('Range')
+        if range_header and if_range_matches(request.headers.get('If-Range', etag), etag):
+            try:
+                byte_range = parse_byte_range(range_header, size)
+            except ValueError:
+                byte_range = (0, size)  # Malformed ranges are ignored
+            else:
+                if byte_range is None:
+                    return web.Response(status=416, headers={'Content-Range': f'bytes */{size}'})
+                status = 206
+                headers['Content-Range'] = f'bytes {byte_range[0]}-{byte_range[1] - 1}/{size}'
+            start, end = byte_range
+        logging.info(f"Serving backup for node: {node_id}, bytes {start}-{end - 1} of {size}")
+        if isinstance(source, bytes):
+            return web.Response(status=status, body=source[start:end], headers=headers)
+        loop = asyncio.get_running_loop()
+        try:
+            blob_file = await loop.run_in_executor(None, open, source, 'rb')
+        except FileNotFoundError:
+            return web.Response(status=404, text="Backup not found")
+        try:
+            response = web.StreamResponse(status=status, headers=headers)
+            response.content_length = end - start
+            await response.prepare(request)
+            await loop.run_in_executor(None, blob_file.seek, start)
+            remaining = end - start
+            while remaining:
+                data = await loop.run_in_executor(None, blob_file.read, min(self.backup_chunk_size, remaining))
+                if not data:
+                    raise ValueError(f"Backup blob for node {node_id} is shorter than recorded")
+                await response.write(data)
+                remaining -= len(data)
+            await response.write_eof()
+        finally:
+            blob_file.close()
+        return response
+
+    async def fetch_backup(self, peer_username, node_id, backup_id=None, attempts=3):
+        # Downloads a backup a peer holds. A copy fetched before is revalidated with If-None-Match, so an
+        # unchanged backup costs a 304; a transfer cut short resumes with a Range request, and If-Range
+        # restarts it from scratch if the backup changed in between. The body must hash to its ETag
+        if peer_username not in self.nodes:
+            raise ValueError(f"Unknown peer: {peer_username}")
+        key = (peer_username, node_id, backup_id)
+        cached = self.fetched_backups.get(key)
+        params = {'node_id': node_id}
+        if backup_id is not None:
+            params['backup_id'] = backup_id
+        received = bytearray()
+        etag = None
+        for _ in range(attempts):
+            headers = {}
+            if received:
+                headers = {'Range': f'bytes={len(received)}-', 'If-Range': etag}
+            elif cached is not None:
+                headers = {'If-None-Match': cached[0]}
+            try:
+                session = await self.get_session()
+                async with session.get(self.peer_url(peer_username, '/backup'), params=params,
+                                       headers=headers) as response:
+                    if response.status == 304:
+                        logging.info(f"Backup for node {node_id} from {peer_username} not modified")
+                        return cached[1]
+                    if response.status == 404:
+                        logging.warning(f"No backup found for node {node_id} at {peer_username}")
+                        return None
+                    if response.status == 200:
+                        received = bytearray()
+                        etag = response.headers.get('ETag')
+                    elif response.status != 206 or response.headers.get('ETag') != etag:
+                        logging.error(f"Failed to fetch backup for node {node_id} from {peer_username}. "
+                                      f"Status: {response.status}")
+                        return None
+                    is_json = response.content_type == 'application/json'
+                    async for data in response.content.iter_chunked(self.backup_chunk_size):
+                        received += data
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logging.warning(f"Backup transfer for node {node_id} from {peer_username} interrupted "
+                                f"after {len(received)} bytes: {str(e)}")
+                continue
+            if etag is None or hashlib.sha256(received).hexdigest() != etag.strip('"'):
+                logging.error(f"Backup for node {node_id} from {peer_username} does not match its ETag")
+                received = bytearray()
+                continue
+            backup = json.loads(received.decode('utf-8')) if is_json else bytes(received)
+            self.fetched_backups[key] = (etag, backup)
+            return backup
+        logging.error(f"Giving up on the backup for node {node_id} from {peer_username}")
+        return None
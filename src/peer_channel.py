@@ -0,0 +1,60 @@
+import json
+import struct
+from typing import Iterable, List
+
+try:
+    import msgpack
+except ImportError:  # Optional; peers then settle on compact JSON frames
+    msgpack = None
+
+# Binary WebSocket messages carry one or more frames: 4-byte big-endian length, encoded envelope.
+# The envelope codec is negotiated per peer as the WebSocket subprotocol.
+FRAME_LENGTH = struct.Struct('>I')
+MSGPACK_PROTOCOL = "glitter.msgpack"
+JSON_PROTOCOL = "glitter.json"
+
+
+def channel_protocols():
+    # In order of preference
+    return (MSGPACK_PROTOCOL, JSON_PROTOCOL) if msgpack is not None else (JSON_PROTOCOL,)
+
+
+def encode_envelope(protocol, envelope) -> bytes:
+    if protocol == MSGPACK_PROTOCOL:
+        return msgpack.packb(envelope, use_bin_type=True)
+    if protocol == JSON_PROTOCOL:
+        return json.dumps(envelope, separators=(',', ':')).encode('utf-8')
+    raise ValueError(f"Unsupported channel protocol: {protocol}")
+
+
+def decode_envelope(protocol, payload):
+    if protocol == MSGPACK_PROTOCOL:
+        return msgpack.unpackb(payload, raw=False)
+    if protocol == JSON_PROTOCOL:
+        return json.loads(bytes(payload).decode('utf-8'))
+    raise ValueError(f"Unsupported channel protocol: {protocol}")
+
+
+def encode_frames(protocol, envelopes: Iterable) -> bytes:
+    parts = []
+    for envelope in envelopes:
+        payload = encode_envelope(protocol, envelope)
+        parts.append(FRAME_LENGTH.pack(len(payload)))
+        parts.append(payload)
+    return b''.join(parts)
+
+
+def decode_frames(protocol, data) -> List:
+    view = memoryview(data)
+    envelopes = []
+    offset = 0
+    while offset < len(view):
+        if len(view) - offset < FRAME_LENGTH.size:
+            raise ValueError("Truncated frame length")
+        (length,) = FRAME_LENGTH.unpack_from(view, offset)
+        offset += FRAME_LENGTH.size
+        if len(view) - offset < length:
+            raise ValueError("Truncated frame payload")
+        envelopes.append(decode_envelope(protocol, view[offset:offset + length]))
+        offset += length
+    return envelopes
@@ -1,125 +1,214 @@
-import random
-from typing import List, Tuple
+import itertools
+import secrets
+from functools import lru_cache
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
 import json
 import math
 import logging
-import base64
+from src.chain_stream import iter_blockchain_pieces
+from src.compression import compress_pieces, iter_backup_chunks, iter_backup_events, decompress_pieces
+from src.share_format import (serialize_share_rows, serialize_share_columns, deserialize_share_rows,
+                              join_share_columns, write_stream_header, read_stream_rows, encode_value)
+
+
+def validate_share_parameters(n, k):
+    if not isinstance(n, int) or not isinstance(k, int):
+        raise TypeError("n and k must be integers")
+    if n < 2:
+        raise ValueError("n must be at least 2")
+    if k < 2:
+        raise ValueError("k must be at least 2")
+    if k > n:
+        raise ValueError("k must be less than or equal to n")
+
+
+def serialize_blockchain(personal_blockchain, codec="none") -> bytes:
+    # The whole chain document in one piece, encoded as the share engines split it
+    try:
+        serialized_data = b''.join(compress_pieces(iter_blockchain_pieces(personal_blockchain.owner,
+                                                                          personal_blockchain.chain), codec))
+        logging.debug(f"Serialized data length: {len(serialized_data)} bytes")
+        return serialized_data
+    except (TypeError, ValueError) as e:
+        logging.error(f"Failed to serialize blockchain: {e}")
+        raise
+
+
+def batch_mod_inverse(values: List[int], prime: int) -> List[int]:
+    # Montgomery's trick: one modular exponentiation for the whole list
+    prefix = []
+    running = 1
+    for value in values:
+        prefix.append(running)
+        running = running * value % prime
+    inverse = pow(running, prime - 2, prime)
+    inverses = [0] * len(values)
+    for i in range(len(values) - 1, -1, -1):
+        inverses[i] = inverse * prefix[i] % prime
+        inverse = inverse * values[i] % prime
+    return inverses
+
+
+@lru_cache(maxsize=256)
+def lagrange_basis_at_zero(xs: Tuple[int, ...], prime: int) -> Tuple[int, ...]:
+    if len(set(xs)) != len(xs):
+        raise ValueError("Share x-coordinates must be distinct")
+    numerators, denominators = [], []
+    for i, x_i in enumerate(xs):
+        numerator, denominator = 1, 1
+        for j, x_j in enumerate(xs):
+            if i != j:
+                numerator = (numerator * -x_j) % prime
+                denominator = (denominator * (x_i - x_j)) % prime
+        numerators.append(numerator)
+        denominators.append(denominator)
+    return tuple(numerator * inverse % prime
+                 for numerator, inverse in zip(numerators, batch_mod_inverse(denominators, prime)))
 
 
 class ShamirSecretSharing:
-    def __init__(self, prime: int):
-        self.prime = prime
-        self.chunk_size = (prime.bit_length() - 1) // 8  # Maximum bytes that fit in the prime
-
-    def split_secret(self, personal_blockchain, n: int, k: int) -> List[List[Tuple[int, int]]]:
-        if not isinstance(n, int) or not isinstance(k, int):
-            raise TypeError("n and k must be integers")
-        if n < 2:
-            raise ValueError("n must be at least 2")
-        if k < 2:
-            raise ValueError("k must be at least 2")
-        if k > n:
-            raise ValueError("k must be less than or equal to n")
-
-        # Serialize the PersonalBlockchain object
-        try:
-            serialized_data = json.dumps({
-                "owner": personal_blockchain.owner,
-                "chain": [{
-                    "index": block.index,
-                    "timestamp": block.timestamp,
-                    "data": block.data,
-                    "previous_hash": block.previous_hash,
-                    "hash": block.hash
-                } for block in personal_blockchain.chain]
-            }).encode('utf-8')
-            logging.debug(f"Serialized data length: {len(serialized_data)} bytes")
-        except (TypeError, ValueError) as e:
-            logging.error(f"Failed to serialize blockchain: {e}")
-            raise
-
-        # Split the serialized data into chunks
-        chunks = [serialized_data[i:i + self.chunk_size] for i in range(0, len(serialized_data), self.chunk_size)]
-        logging.debug(f"Number of chunks: {len(chunks)}")
-
-        # Apply Shamir's Secret Sharing to each chunk
-        shares_list = []
-        for chunk in chunks:
-            secret_int = int.from_bytes(chunk, 'big')
-            coefficients = [secret_int] + [random.randint(0, self.prime - 1) for _ in range(k - 1)]
-            shares = []
-            for i in range(1, n + 1):
-                x = i
-                y = sum(
-                    (coeff * pow(x, power, self.prime)) for power, coeff in enumerate(coefficients)) % self.prime
-                shares.append((x, y))
-            shares_list.append(shares)
+    scheme_name = "prime"
 
+    def __init__(self, prime: int, sentinel: bool = True):
+        self.prime = prime
+        # Chunks are prefixed with a 0x01 byte so leading zero bytes survive the round trip through an
+        # integer, which compressed chunks need; version 1 backups were written without it
+        self.sentinel = sentinel
+        self.chunk_size = (prime.bit_length() - (2 if sentinel else 1)) // 8  # Maximum bytes that fit in the prime
+        self.share_size = (prime.bit_length() + 7) // 8  # Bytes needed for any y-value
+
+    def split_secret(self, personal_blockchain, n: int, k: int, start: int = 0,
+                     codec="none", seal=False, stop: Optional[int] = None) -> List[List[Tuple[int, int]]]:
+        shares_list = list(self.split_stream(personal_blockchain, n, k, start=start, codec=codec, seal=seal,
+                                              stop=stop))
         logging.debug(f"Number of share lists: {len(shares_list)}")
         return shares_list
 
-    def reconstruct_secret(self, shares_list: List[List[Tuple[int, int]]], k: int) -> dict:
+    def split_stream(self, personal_blockchain, n: int, k: int, sinks=None,
+                     checksum=True, start: int = 0, codec="none",
+                     seal=False, stop: Optional[int] = None) -> Iterator[List[Tuple[int, int]]]:
+        # Serializes and splits one chunk at a time; with sinks, holder x's share is written
+        # to sinks[x - 1] as a streaming share container while it is produced
+        validate_share_parameters(n, k)
+        if sinks is not None:
+            if len(sinks) != n:
+                raise ValueError("Need exactly one sink per share holder")
+            for x, sink in enumerate(sinks, start=1):
+                write_stream_header(sink, self.scheme_name, k, n, x, self.share_size, checksum, codec)
+        # A non-zero start splits only the blocks from that index on, for delta backups; stop pins the
+        # end, so blocks the event loop appends meanwhile are left for the next backup
+        if start:
+            blocks = personal_blockchain.chain[start:stop]
+        else:
+            blocks = itertools.islice(personal_blockchain.chain, stop)
+        # A sealed backup ends with the owner's signature over the chain digest and tip
+        signer = personal_blockchain.sign_data if seal else None
+        for chunk in iter_backup_chunks(personal_blockchain.owner, blocks, self.chunk_size, codec, signer):
+            shares = self._split_chunk(chunk, n, k)
+            if sinks is not None:
+                for (_, y), sink in zip(shares, sinks):
+                    sink.write(encode_value(self._encode_y(y), checksum))
+            yield shares
+
+    def _split_chunk(self, chunk: bytes, n: int, k: int) -> List[Tuple[int, int]]:
+        secret_int = int.from_bytes(b'\x01' + chunk if self.sentinel else chunk, 'big')
+        coefficients = [secret_int] + [secrets.randbelow(self.prime) for _ in range(k - 1)]
+        shares = []
+        for x in range(1, n + 1):
+            # Horner's rule, highest degree first
+            y = 0
+            for coefficient in reversed(coefficients):
+                y = (y * x + coefficient) % self.prime
+            shares.append((x, y))
+        return shares
+
+    def reconstruct_secret(self, shares_list: List[List[Tuple[int, int]]], k: int, codec="none") -> dict:
         if not shares_list or not all(shares_list):
             raise ValueError("Invalid shares_list")
         if not isinstance(k, int) or k < 2:
             raise ValueError("k must be an integer greater than or equal to 2")
 
-        reconstructed_chunks = []
-
-        for shares in shares_list:
-            if len(shares) < k:
-                raise ValueError("Not enough shares to reconstruct the secret")
-
-            secret = 0
-            for i, (x_i, y_i) in enumerate(shares[:k]):
-                numerator, denominator = 1, 1
-                for j, (x_j, _) in enumerate(shares[:k]):
-                    if i != j:
-                        numerator = (numerator * -x_j) % self.prime
-                        denominator = (denominator * (x_i - x_j)) % self.prime
-
-                secret += y_i * numerator * self._mod_inverse(denominator)
-                secret %= self.prime
-
-            # Convert to bytes, handling potential overflow
-            byte_length = math.ceil(secret.bit_length() / 8)
-            chunk = secret.to_bytes(byte_length, 'big')
-            reconstructed_chunks.append(chunk)
-
-        # Combine chunks and remove any padding
-        reconstructed_data = b''.join(reconstructed_chunks).rstrip(b'\x00')
+        chunks = (self._reconstruct_chunk(shares, k) for shares in shares_list)
+        reconstructed_data = b''.join(decompress_pieces(chunks, codec))
         logging.debug(f"Reconstructed data length: {len(reconstructed_data)} bytes")
 
-        # Ensure the data length is divisible by 3 for proper base64 encoding
-        padding_length = (3 - len(reconstructed_data) % 3) % 3
-        padded_data = reconstructed_data + b'\x00' * padding_length
-        logging.debug(f"Padded data length: {len(padded_data)} bytes")
-
         try:
-            base64_encoded = base64.b64encode(padded_data).decode('utf-8')
-            json_data = json.loads(base64.b64decode(base64_encoded).decode('utf-8').rstrip('\x00'))
+            json_data = json.loads(reconstructed_data.decode('utf-8'))
             logging.debug(f"Parsed JSON data keys: {list(json_data.keys())}")
             return json_data
-        except json.JSONDecodeError as e:
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
             logging.error(f"Error parsing reconstructed data: {e}")
-            logging.error(f"Problematic data (first 200 chars): {padded_data[:200]}...")
-            raise
-        except Exception as e:
-            logging.error(f"Unexpected error during reconstruction: {e}")
+            logging.error(f"Problematic data (first 200 bytes): {reconstructed_data[:200]}...")
             raise
 
+    def reconstruct_stream(self, shares_iter: Iterable[List[Tuple[int, int]]], k: int,
+                           codec="none") -> Iterator[Tuple[str, object]]:
+        # Yields ("owner", owner) and then ("block", block_dict) as soon as each block is complete
+        if not isinstance(k, int) or k < 2:
+            raise ValueError("k must be an integer greater than or equal to 2")
+        yield from iter_backup_events((self._reconstruct_chunk(shares, k) for shares in shares_iter), codec)
+
+    def _reconstruct_chunk(self, shares: List[Tuple[int, int]], k: int) -> bytes:
+        if len(shares) < k:
+            raise ValueError("Not enough shares to reconstruct the secret")
+
+        # Chunks usually share x-coordinates, so the basis comes from the cache
+        selected = sorted(shares[:k])
+        basis = lagrange_basis_at_zero(tuple(x for x, _ in selected), self.prime)
+        secret = sum(b * y for b, (_, y) in zip(basis, selected)) % self.prime
+
+        chunk = secret.to_bytes(math.ceil(secret.bit_length() / 8), 'big')
+        if not self.sentinel:
+            # Serialized JSON never starts a chunk with a zero byte, so the minimal length is exact
+            return chunk
+        if chunk[:1] != b'\x01':
+            raise ValueError("Reconstructed chunk is missing its sentinel byte")
+        return chunk[1:]
+
+    def split_chunk_range(self, chunks: List[bytes], n: int, k: int, checksum=True) -> Tuple[List[bytes], int, int]:
+        # Splits a consecutive run of chunks, typically in a worker process, and returns each holder's
+        # encoded values with the chunk count and the size of the last value for join_share_slices
+        bodies = [[] for _ in range(n)]
+        raw = b''
+        for chunk in chunks:
+            for body, (_, y) in zip(bodies, self._split_chunk(chunk, n, k)):
+                raw = self._encode_y(y)
+                body.append(encode_value(raw, checksum))
+        return [b''.join(body) for body in bodies], len(chunks), len(raw)
+
+    def join_share_slices(self, ranges, k: int = 0, checksum=True, codec="none") -> List[bytes]:
+        return join_share_columns(self.scheme_name, ranges, k, self.share_size, checksum, codec)
+
+    def reconstruct_chunk_range(self, shares_list: List[List[Tuple[int, int]]], k: int) -> bytes:
+        return b''.join(self._reconstruct_chunk(shares, k) for shares in shares_list)
+
+    def read_share_rows(self, sources: Dict[int, BinaryIO], verify=True, headers=None) -> Iterator[List[Tuple[int, int]]]:
+        # Reads back the streaming containers written by split_stream, one chunk row at a time
+        return read_stream_rows(sources, self._decode_y, verify, headers)
+
     def _mod_inverse(self, x: int) -> int:
         return pow(x, self.prime - 2, self.prime)
 
-    def serialize_shares(self, shares_list: List[List[Tuple[int, int]]]) -> str:
-        # Convert tuples to lists for JSON serialization
-        serializable_shares = [[[int(x), int(y)] for x, y in shares] for shares in shares_list]
-        return base64.b64encode(json.dumps(serializable_shares).encode('utf-8')).decode('utf-8')
+    def _encode_y(self, y: int) -> bytes:
+        return y.to_bytes(self.share_size, 'big')
+
+    @staticmethod
+    def _decode_y(raw) -> int:
+        return int.from_bytes(raw, 'big')
+
+    def serialize_share_slices(self, shares_list, k: int = 0, checksum=True, codec="none") -> List[bytes]:
+        # One self-contained container per holder, in x order
+        return serialize_share_columns(self.scheme_name, shares_list, k, self.share_size, self._encode_y, checksum,
+                                       codec)
+
+    def serialize_shares(self, shares_list: List[List[Tuple[int, int]]], k: int = 0, checksum=True,
+                         codec="none") -> bytes:
+        # One binary container per holder with fixed-width 32-byte y-values
+        return serialize_share_rows(self.scheme_name, shares_list, k, self.share_size, self._encode_y, checksum,
+                                    codec)
 
-    def deserialize_shares(self, serialized_shares: str) -> List[List[Tuple[int, int]]]:
-        json_shares = json.loads(base64.b64decode(serialized_shares).decode('utf-8'))
-        # Convert lists back to tuples
-        return [[(int(x), int(y)) for x, y in shares] for shares in json_shares]
+    def deserialize_shares(self, serialized_shares, verify=True) -> List[List[Tuple[int, int]]]:
+        return deserialize_share_rows(serialized_shares, self._decode_y, verify)
 
 
 # Use a smaller prime for each chunk, but still large enough for security
@@ -0,0 +1,263 @@
+import asyncio
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+import socket
+import struct
+import zlib
+from collections import defaultdict
+from src.social_network import SocialNetwork
+
+# Coordinator and shards exchange length-prefixed pickles over a socket pair:
+#   request: (request_id, method, args)    reply: (request_id, ok, result or exception)
+FRAME_LENGTH = struct.Struct('>I')
+# SocialNetwork methods a shard runs for the users it owns
+NETWORK_CALLS = ("add_user", "add_users", "connect_users", "post_data", "propagate_data",
+                 "create_and_distribute_backup", "restore_from_backup", "sync_chain")
+SHARD_CALLS = ("user_address", "link_remote", "chain_length")
+
+
+def shard_of(username, shards):
+    # Stable across processes and runs, unlike hash()
+    return zlib.crc32(username.encode('utf-8')) % shards
+
+
+async def _read_frame(reader):
+    try:
+        header = await reader.readexactly(FRAME_LENGTH.size)
+        return pickle.loads(await reader.readexactly(FRAME_LENGTH.unpack(header)[0]))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+async def _write_frame(writer, message):
+    payload = pickle.dumps(message, protocol=pickle.HIGHEST_PROTOCOL)
+    writer.write(FRAME_LENGTH.pack(len(payload)) + payload)
+    await writer.drain()
+
+
+class Shard:
+    # Runs in a worker process: one SocialNetwork, hosting its users behind a single NodeHost listener
+    def __init__(self, network: SocialNetwork):
+        self.network = network
+
+    def user_address(self, username):
+        # (port, node_id, path, did) other shards use to reach the user's node, or None
+        if username not in self.network.users:
+            return None
+        p2p_network = self.network.p2p_networks[username]
+        port, node_id = p2p_network.nodes[username]
+        return port, node_id, p2p_network.paths.get(username, ''), self.network.users[username].did
+
+    def link_remote(self, username, peer_username, address):
+        # This shard's half of connect_users for a peer owned by another shard
+        if username not in self.network.users:
+            return False
+        if peer_username in self.network.connections[username]:
+            return True
+        port, node_id, path, did = address
+        self.network.connections[username].append(peer_username)
+        self.network.p2p_networks[username].add_node(peer_username, port, did, path)
+        self.network.users[username].add_trusted_node(node_id, "contact", f"{self.network.host}:{port}{path}")
+        logging.info(f"Connected {username} to {peer_username} on another shard")
+        return True
+
+    def chain_length(self, username):
+        blockchain = self.network.users.get(username)
+        return len(blockchain.chain) if blockchain is not None else None
+
+    async def handle(self, writer, request_id, method, args):
+        try:
+            if method in NETWORK_CALLS:
+                target = getattr(self.network, method)
+            elif method in SHARD_CALLS:
+                target = getattr(self, method)
+            else:
+                raise ValueError(f"Unknown shard call: {method}")
+            result = target(*args)
+            if asyncio.iscoroutine(result):
+                result = await result
+            reply = (request_id, True, result)
+        except Exception as e:
+            logging.error(f"Shard call {method} failed: {str(e)}")
+            reply = (request_id, False, e)
+        try:
+            await _write_frame(writer, reply)
+        except Exception as e:
+            await _write_frame(writer, (request_id, False, RuntimeError(f"Result of {method} cannot be sent: {e}")))
+
+
+def _run_shard(index, sock, options):
+    asyncio.run(_serve_shard(index, sock, options))
+
+
+async def _serve_shard(index, sock, options):
+    reader, writer = await asyncio.open_connection(sock=sock)
+    network = SocialNetwork(hosting="shared", **options)
+    try:
+        await network.start()
+    except Exception as e:
+        await _write_frame(writer, (None, False, e))
+        writer.close()
+        return
+    await _write_frame(writer, (None, True, network.start_port))
+    shard = Shard(network)
+    tasks = set()
+    stop_id = None
+    try:
+        while True:
+            message = await _read_frame(reader)
+            if message is None:
+                logging.warning(f"Shard {index} lost its coordinator, shutting down")
+                break
+            request_id, method, args = message
+            if method == "stop":
+                stop_id = request_id
+                break
+            # Calls start in arrival order, so a user's synchronous posts are applied in order
+            task = asyncio.ensure_future(shard.handle(writer, request_id, method, args))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+    finally:
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await network.stop()
+        if stop_id is not None:
+            await _write_frame(writer, (stop_id, True, None))
+        writer.close()
+
+
+class ShardedSocialNetwork:
+    # Partitions users across worker processes, each with its own event loop and a SocialNetwork whose
+    # users share one listener on start_port + shard index (start_port 0 lets the OS pick). The
+    # coordinator routes every call to the owning shard; users on different shards talk over HTTP
+    def __init__(self, workers=None, host='localhost', start_port=8000, **options):
+        self.workers = workers or os.cpu_count() or 1
+        self.host = host
+        self.start_port = start_port
+        self.options = options  # Passed on to every shard's SocialNetwork, so they must be picklable
+        self.processes = []
+        self.writers = []
+        self.reply_readers = []
+        self.ports = []  # Listening port of each shard
+        self.pending = {}  # request_id: future for the reply
+        self.request_ids = itertools.count()
+
+    def shard_of(self, username):
+        return shard_of(username, self.workers)
+
+    async def start(self):
+        # Spawned rather than forked: each shard starts a clean interpreter with its own loop
+        context = multiprocessing.get_context("spawn")
+        sockets = []
+        for index in range(self.workers):
+            parent_socket, child_socket = socket.socketpair()
+            options = dict(self.options, host=self.host, start_port=self.start_port + index if self.start_port else 0)
+            process = context.Process(target=_run_shard, args=(index, child_socket, options), name=f"shard-{index}")
+            process.start()
+            child_socket.close()
+            self.processes.append(process)
+            sockets.append(parent_socket)
+        streams = [await asyncio.open_connection(sock=parent_socket) for parent_socket in sockets]
+        readies = await asyncio.gather(*(_read_frame(reader) for reader, _ in streams))
+        for index, (reader, writer) in enumerate(streams):
+            self.writers.append(writer)
+            self.reply_readers.append(asyncio.ensure_future(self._read_replies(index, reader)))
+        for index, ready in enumerate(readies):
+            if ready is None or not ready[1]:
+                await self.stop()
+                raise RuntimeError(f"Shard {index} failed to start: {ready[2] if ready else 'exited'}")
+            self.ports.append(ready[2])
+        logging.info(f"Started {self.workers} shards on ports {self.ports}")
+
+    async def _read_replies(self, index, reader):
+        while True:
+            message = await _read_frame(reader)
+            if message is None:
+                break
+            request_id, ok, result = message
+            future = self.pending.pop(request_id, None)
+            if future is None or future.done():
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+        logging.info(f"Shard {index} closed its connection")
+
+    async def call(self, index, method, *args):
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+        try:
+            await _write_frame(self.writers[index], (request_id, method, args))
+            # A shard that dies never replies; its reply reader ending is the only sign of it
+            done, _ = await asyncio.wait({future, self.reply_readers[index]}, return_when=asyncio.FIRST_COMPLETED)
+            if future not in done:
+                raise ConnectionError(f"Shard {index} exited before answering {method}")
+            return future.result()
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def stop(self):
+        for index, writer in enumerate(self.writers):
+            if not self.reply_readers[index].done():
+                try:
+                    await self.call(index, "stop")
+                except (ConnectionError, OSError) as e:
+                    logging.warning(f"Shard {index} did not stop cleanly: {str(e)}")
+            writer.close()
+        for reply_reader in self.reply_readers:
+            reply_reader.cancel()
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, 10)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
+        self.writers = []
+        self.reply_readers = []
+        self.ports = []
+
+    async def add_user(self, username):
+        await self.call(self.shard_of(username), "add_user", username)
+
+    async def add_users(self, usernames):
+        # One call per shard; each generates its users' keys in parallel with the others
+        groups = defaultdict(list)
+        for username in usernames:
+            groups[self.shard_of(username)].append(username)
+        await asyncio.gather(*(self.call(index, "add_users", group) for index, group in groups.items()))
+
+    async def connect_users(self, user1, user2):
+        shard1, shard2 = self.shard_of(user1), self.shard_of(user2)
+        address1, address2 = await asyncio.gather(self.call(shard1, "user_address", user1),
+                                                  self.call(shard2, "user_address", user2))
+        if address1 is None or address2 is None:
+            logging.warning(f"Cannot connect {user1} and {user2}: unknown user")
+            return False
+        if shard1 == shard2:
+            await self.call(shard1, "connect_users", user1, user2)
+            return True
+        await asyncio.gather(self.call(shard1, "link_remote", user1, user2, address2),
+                             self.call(shard2, "link_remote", user2, user1, address1))
+        return True
+
+    async def post_data(self, username, data):
+        await self.call(self.shard_of(username), "post_data", username, data)
+
+    async def propagate_data(self, username, data):
+        await self.call(self.shard_of(username), "propagate_data", username, data)
+
+    async def create_and_distribute_backup(self, username):
+        return await self.call(self.shard_of(username), "create_and_distribute_backup", username)
+
+    async def restore_from_backup(self, username):
+        return await self.call(self.shard_of(username), "restore_from_backup", username)
+
+    async def sync_chain(self, username, peer_username):
+        return await self.call(self.shard_of(username), "sync_chain", username, peer_username)
+
+    async def chain_length(self, username):
+        return await self.call(self.shard_of(username), "chain_length", username)
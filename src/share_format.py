@@ -0,0 +1,243 @@
+import struct
+import zlib
+from typing import BinaryIO, Callable, Dict, Iterator, List, Tuple
+from src.compression import CODEC_IDS, CODEC_NAMES
+
+# One container holds every chunk of one holder's share:
+#   header: magic, version, scheme id, flags, k, n, x, codec id, value size, chunk count, size of the last value
+#   body:   chunk_count values, each value_size bytes (the last one last_size), each optionally followed by a CRC32
+MAGIC = b'GLSH'
+VERSION = 2  # Version 2 adds the codec id in what was a padding byte and the prime chunk sentinel
+SUPPORTED_VERSIONS = (1, 2)
+HEADER = struct.Struct('>4sBBBBBBBxIII')
+CHECKSUM = struct.Struct('>I')
+FLAG_CHECKSUM = 0x01
+STREAMING_COUNT = 0xFFFFFFFF  # Chunk count is unknown up front; values run to the end of the stream
+
+SCHEME_IDS = {"prime": 1, "gf256": 2}
+SCHEME_NAMES = {scheme_id: name for name, scheme_id in SCHEME_IDS.items()}
+
+
+class ShareChecksumError(ValueError):
+    def __init__(self, x, chunk_index):
+        super().__init__(f"Checksum mismatch in share {x} at chunk {chunk_index}")
+        self.x = x
+        self.chunk_index = chunk_index
+
+
+class ShareContainer:
+    def __init__(self, scheme, k, n, x, flags, value_size, chunk_count, last_size, body: memoryview,
+                 version=VERSION, codec="none"):
+        self.scheme = scheme
+        self.k = k
+        self.n = n
+        self.x = x
+        self.flags = flags
+        self.value_size = value_size
+        self.chunk_count = chunk_count
+        self.last_size = last_size
+        self.body = body
+        self.version = version
+        self.codec = codec
+
+    @property
+    def has_checksum(self):
+        return bool(self.flags & FLAG_CHECKSUM)
+
+    @classmethod
+    def parse(cls, buffer, offset=0) -> Tuple['ShareContainer', int]:
+        # Slices a memoryview of the input, so share values are never copied
+        view = memoryview(buffer)
+        if len(view) - offset < HEADER.size:
+            raise ValueError("Share container is shorter than its header")
+        fields = _unpack_header(view, offset)
+        version, scheme_id, flags, k, n, x, codec_id, value_size, chunk_count, last_size = fields
+        start = offset + HEADER.size
+        extra = CHECKSUM.size if flags & FLAG_CHECKSUM else 0
+        if chunk_count == STREAMING_COUNT:
+            end = len(view)
+            body_size = end - start
+            chunk_count = (body_size + value_size + extra - 1) // (value_size + extra) if body_size else 0
+            last_size = body_size - (chunk_count - 1) * (value_size + extra) - extra if chunk_count else 0
+        else:
+            end = start + (chunk_count * (value_size + extra) - (value_size - last_size) if chunk_count else 0)
+        if end > len(view) or (chunk_count and not 0 < last_size <= value_size):
+            raise ValueError(f"Share container for x={x} is truncated")
+        container = cls(SCHEME_NAMES[scheme_id], k, n, x, flags, value_size, chunk_count, last_size, view[start:end],
+                        version, CODEC_NAMES[codec_id])
+        return container, end
+
+    def values(self, verify=True) -> Iterator[memoryview]:
+        extra = CHECKSUM.size if self.has_checksum else 0
+        position = 0
+        for index in range(self.chunk_count):
+            size = self.last_size if index == self.chunk_count - 1 else self.value_size
+            value = self.body[position:position + size]
+            if extra and verify:
+                (expected,) = CHECKSUM.unpack_from(self.body, position + size)
+                if zlib.crc32(value) != expected:
+                    raise ShareChecksumError(self.x, index)
+            position += size + extra
+            yield value
+
+
+def _unpack_header(buffer, offset=0):
+    magic, version, scheme_id, flags, k, n, x, codec_id, value_size, chunk_count, last_size = \
+        HEADER.unpack_from(buffer, offset)
+    if magic != MAGIC:
+        raise ValueError("Not a share container")
+    if version not in SUPPORTED_VERSIONS:
+        raise ValueError(f"Unsupported share container version: {version}")
+    if scheme_id not in SCHEME_NAMES:
+        raise ValueError(f"Unknown share scheme id: {scheme_id}")
+    if codec_id not in CODEC_NAMES:
+        raise ValueError(f"Unknown compression codec id: {codec_id}")
+    return version, scheme_id, flags, k, n, x, codec_id, value_size, chunk_count, last_size
+
+
+def iter_share_containers(buffer) -> Iterator[ShareContainer]:
+    view = memoryview(buffer)
+    offset = 0
+    while offset < len(view):
+        container, offset = ShareContainer.parse(view, offset)
+        yield container
+
+
+def verify_share_slice(buffer) -> ShareContainer:
+    # A per-holder slice is exactly one container whose checksums all match
+    container, end = ShareContainer.parse(buffer)
+    if end != len(memoryview(buffer)):
+        raise ValueError("Share slice holds more than one container")
+    for _ in container.values(verify=True):
+        pass
+    return container
+
+
+def drop_corrupted_containers(buffer) -> Tuple[object, List[int]]:
+    # Checks every holder's checksums before anything is decoded. Returns the buffer holding only
+    # the intact containers (the input itself when all pass) and the x-coordinate of each corrupted one
+    view = memoryview(buffer)
+    intact, corrupted = [], []
+    offset = 0
+    while offset < len(view):
+        container, end = ShareContainer.parse(view, offset)
+        try:
+            for _ in container.values(verify=True):
+                pass
+            intact.append(view[offset:end])
+        except ShareChecksumError:
+            corrupted.append(container.x)
+        offset = end
+    return (b''.join(intact) if corrupted else buffer), corrupted
+
+
+def read_header(buffer) -> ShareContainer:
+    return ShareContainer.parse(buffer)[0]
+
+
+def detect_scheme(buffer) -> str:
+    return read_header(buffer).scheme
+
+
+def encode_header(scheme, k, n, x, value_size, chunk_count, last_size, checksum, codec="none") -> bytes:
+    if not 0 < x <= 255 or n > 255 or k > 255:
+        raise ValueError("Share containers support at most 255 holders")
+    return HEADER.pack(MAGIC, VERSION, SCHEME_IDS[scheme], FLAG_CHECKSUM if checksum else 0,
+                       k, n, x, CODEC_IDS[codec], value_size, chunk_count, last_size)
+
+
+def encode_value(raw: bytes, checksum) -> bytes:
+    return raw + CHECKSUM.pack(zlib.crc32(raw)) if checksum else raw
+
+
+def serialize_share_columns(scheme, shares_list: List[List[Tuple[int, object]]], k, value_size,
+                            encode: Callable[[object], bytes], checksum=True, codec="none") -> List[bytes]:
+    # Transposes chunk rows into one container per holder x-coordinate
+    if not shares_list:
+        raise ValueError("No shares to serialize")
+    n = len(shares_list[0])
+    containers = []
+    for column, (x, _) in enumerate(shares_list[0]):
+        raw_values = [encode(shares[column][1]) for shares in shares_list]
+        parts = [encode_header(scheme, k, n, x, value_size, len(raw_values), len(raw_values[-1]), checksum, codec)]
+        parts.extend(encode_value(raw, checksum) for raw in raw_values)
+        containers.append(b''.join(parts))
+    return containers
+
+
+def serialize_share_rows(scheme, shares_list: List[List[Tuple[int, object]]], k, value_size,
+                         encode: Callable[[object], bytes], checksum=True, codec="none") -> bytes:
+    return b''.join(serialize_share_columns(scheme, shares_list, k, value_size, encode, checksum, codec))
+
+
+def join_share_columns(scheme, ranges, k, value_size, checksum=True, codec="none") -> List[bytes]:
+    # ranges holds (bodies, chunk_count, last_size) per consecutive chunk range, where bodies[x - 1]
+    # is holder x's encoded values for that range; they are stitched into one container per holder
+    ranges = [entry for entry in ranges if entry[1]]
+    if not ranges:
+        raise ValueError("No shares to serialize")
+    n = len(ranges[0][0])
+    chunk_count = sum(count for _, count, _ in ranges)
+    last_size = ranges[-1][2]
+    return [encode_header(scheme, k, n, x, value_size, chunk_count, last_size, checksum, codec)
+            + b''.join(bodies[x - 1] for bodies, _, _ in ranges)
+            for x in range(1, n + 1)]
+
+
+def deserialize_share_rows(buffer, decode: Callable[[memoryview], object],
+                           verify=True) -> List[List[Tuple[int, object]]]:
+    containers = list(iter_share_containers(buffer))
+    if not containers:
+        raise ValueError("No share containers found")
+    if len({container.chunk_count for container in containers}) != 1:
+        raise ValueError("Share containers have different chunk counts")
+    columns = [[(container.x, decode(value)) for value in container.values(verify)] for container in containers]
+    return [list(row) for row in zip(*columns)]
+
+
+def write_stream_header(sink: BinaryIO, scheme, k, n, x, value_size, checksum=True, codec="none"):
+    sink.write(encode_header(scheme, k, n, x, value_size, STREAMING_COUNT, 0, checksum, codec))
+
+
+def read_stream_headers(sources: Dict[int, BinaryIO]) -> Dict[int, ShareContainer]:
+    headers = {}
+    for x, source in sources.items():
+        raw = source.read(HEADER.size)
+        if len(raw) != HEADER.size:
+            raise ValueError(f"Share stream for holder {x} has no valid header")
+        try:
+            version, scheme_id, flags, k, n, header_x, codec_id, value_size, _, _ = _unpack_header(raw)
+        except ValueError as e:
+            raise ValueError(f"Share stream for holder {x} has no valid header: {e}")
+        headers[x] = ShareContainer(SCHEME_NAMES[scheme_id], k, n, header_x, flags, value_size, STREAMING_COUNT, 0,
+                                    None, version, CODEC_NAMES[codec_id])
+    return headers
+
+
+def read_stream_rows(sources: Dict[int, BinaryIO], decode: Callable[[bytes], object],
+                     verify=True, headers=None) -> Iterator[List[Tuple[int, object]]]:
+    # Reads streaming containers from several holders in lockstep, one chunk row at a time;
+    # pass headers when read_stream_headers has already consumed them
+    if headers is None:
+        headers = read_stream_headers(sources)
+    index = 0
+    while True:
+        shares = []
+        lengths = set()
+        for x, source in sources.items():
+            header = headers[x]
+            extra = CHECKSUM.size if header.has_checksum else 0
+            raw = source.read(header.value_size + extra)
+            if not raw:
+                return
+            if len(raw) <= extra:
+                raise ValueError(f"Truncated share stream for holder {header.x}")
+            value = raw[:len(raw) - extra]
+            if extra and verify and zlib.crc32(value) != CHECKSUM.unpack(raw[len(raw) - extra:])[0]:
+                raise ShareChecksumError(header.x, index)
+            lengths.add(len(value))
+            shares.append((header.x, decode(value)))
+        if len(lengths) > 1:
+            raise ValueError("Share streams have different lengths")
+        index += 1
+        yield shares
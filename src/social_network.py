@@ -1,20 +1,63 @@
 import asyncio
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
 from typing import Dict, List
+from cryptography.hazmat.primitives import serialization
+from src.backup_manager import MANIFEST_BACKUP_ID
 from src.blockchain import PersonalBlockchain
+from src.block_store import SegmentBlockStore
+from src.backup_store import BackupStore
+from src.key_schemes import get_key_scheme
+from src.node_host import NodeHost
 from src.p2p_network import P2PNetwork
+from src.share_format import verify_share_slice
 import logging
 
+PROPAGATION_MODES = ("broadcast", "gossip")
+HOSTING_MODES = ("per_user", "shared")
+
+
 class SocialNetwork:
-    def __init__(self, host='localhost', start_port=8000):
+    def __init__(self, host='localhost', start_port=8000, storage_dir=None, key_scheme="rsa", key_pool=None,
+                 incremental_backups=False, backup_executor=None, backup_workers=None, peer_transport="http",
+                 propagation="broadcast", gossip_fanout=3, gossip_ttl=None, backup_quota=None, hosting="per_user"):
+        if propagation not in PROPAGATION_MODES:
+            raise ValueError(f"Unknown propagation mode: {propagation}")
+        if hosting not in HOSTING_MODES:
+            raise ValueError(f"Unknown hosting mode: {hosting}")
         self.users: Dict[str, PersonalBlockchain] = {}
         self.connections: Dict[str, List[str]] = {}
         self.p2p_networks: Dict[str, P2PNetwork] = {}
         self.host = host
         self.start_port = start_port
+        self.storage_dir = storage_dir  # Keep chains in on-disk segment stores when set
+        self.key_scheme = key_scheme
+        self.key_pool = key_pool  # Optional KeyPool of pre-generated key pairs
+        self.peer_transport = peer_transport  # "http", or "websocket" for persistent binary peer channels
+        self.propagation = propagation  # "broadcast" to every known node, or multi-hop "gossip"
+        self.gossip_fanout = gossip_fanout
+        self.gossip_ttl = gossip_ttl  # Hops a gossiped post may travel; None sizes it to the network
+        self.backup_quota = backup_quota  # Bytes of backups each node keeps per owner, None for no limit
+        # "per_user" gives every user's node its own listener on start_port + i; "shared" hosts them all
+        # as virtual nodes of one NodeHost on start_port, delivering messages between them in-process
+        self.node_host = NodeHost(host) if hosting == "shared" else None
+        self.incremental_backups = incremental_backups  # Distribute delta segments plus a signed manifest
+        self.backup_executor = backup_executor  # Pool shared by every user's backup splitting and restore
+        self.owns_backup_executor = backup_executor is None
+        self.backup_workers = backup_workers
         self.backup_threshold = 3  # This is 'k'
         self.total_shares = 4  # This is 'n'
+        self.backup_request_timeout = 5.0  # Seconds before a single backup request is abandoned
+        self.backup_hedge_delay = 0.5  # Seconds before a slow holder gets a second, racing request
+        self.backup_request_attempts = 3  # Requests per holder, counting hedges and retries
 
     async def start(self):
+        if self.node_host is not None:
+            # With start_port 0 the OS picks the port; users added from then on are addressed by it
+            await self.node_host.start(self.start_port)
+            self.start_port = self.node_host.port
+            return
         start_tasks = [p2p_network.start(self.start_port + i)
                        for i, p2p_network in enumerate(self.p2p_networks.values())]
         await asyncio.gather(*start_tasks)
@@ -22,17 +65,92 @@ class SocialNetwork:
     async def stop(self):
         stop_tasks = [p2p_network.stop() for p2p_network in self.p2p_networks.values()]
         await asyncio.gather(*stop_tasks)
+        if self.node_host is not None:
+            await self.node_host.stop()
+        for blockchain in self.users.values():
+            blockchain.chain.close()
+        if self.owns_backup_executor and self.backup_executor is not None:
+            self.backup_executor.shutdown(wait=False, cancel_futures=True)
+            self.backup_executor = None
+
+    def _get_backup_executor(self):
+        if self.backup_executor is None:
+            self.backup_executor = ProcessPoolExecutor(max_workers=self.backup_workers)
+        return self.backup_executor
+
+    def _key_path(self, username):
+        return os.path.join(self.storage_dir, f"{username}.key")
 
-    def add_user(self, username):
+    def _load_key(self, username):
+        # The key a stored chain was signed with, so it keeps verifying and growing after a restart
+        if self.storage_dir is None or not os.path.exists(self._key_path(username)):
+            return None
+        with open(self._key_path(username), 'rb') as f:
+            return serialization.load_pem_private_key(f.read(), password=None)
+
+    def _save_key(self, username, private_key):
+        # Unencrypted PKCS8, readable by the owner only; written atomically beside the chain
+        path = self._key_path(username)
+        temporary = f"{path}.tmp"
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(private_key.private_bytes(encoding=serialization.Encoding.PEM,
+                                              format=serialization.PrivateFormat.PKCS8,
+                                              encryption_algorithm=serialization.NoEncryption()))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    def add_user(self, username, private_key=None):
         if username not in self.users:
-            self.users[username] = PersonalBlockchain(username)
+            if private_key is None:
+                private_key = self._load_key(username)
+            if private_key is None and self.key_pool is not None:
+                private_key = self.key_pool.get()
+            if self.storage_dir is not None:
+                block_store = SegmentBlockStore(os.path.join(self.storage_dir, username))
+                fresh = len(block_store) == 0
+                try:
+                    # Raises if the stored chain was written under another key, e.g. a lost key file
+                    blockchain = PersonalBlockchain(username, block_store, self.key_scheme, private_key)
+                except ValueError:
+                    block_store.close()
+                    raise
+                if fresh or not os.path.exists(self._key_path(username)):
+                    self._save_key(username, blockchain.private_key)
+                backup_store = BackupStore(os.path.join(self.storage_dir, f"{username}.backups"),
+                                           owner_quota=self.backup_quota)
+            else:
+                blockchain = PersonalBlockchain(username, None, self.key_scheme, private_key)
+                backup_store = BackupStore(owner_quota=self.backup_quota)
+            self.users[username] = blockchain
             self.connections[username] = []
-            new_p2p_network = P2PNetwork(self.host)
+            new_p2p_network = P2PNetwork(self.host, transport=self.peer_transport, username=username,
+                                         backup_store=backup_store, gossip_fanout=self.gossip_fanout)
             self.p2p_networks[username] = new_p2p_network
-            port = self.start_port + len(self.users) - 1
-            new_p2p_network.add_node(username, port, f"{username}_id")
+            if self.node_host is not None:
+                self.node_host.attach(new_p2p_network, username, self.users[username].did)
+                new_p2p_network.add_node(username, self.start_port, f"{username}_id", self.node_host.path_for(username))
+            else:
+                new_p2p_network.add_node(username, self.start_port + len(self.users) - 1, f"{username}_id")
+            new_p2p_network.serve_chain(self.users[username])
             logging.info(f"Added user: {username}")
 
+    async def add_users(self, usernames):
+        # Key generation is awaited off the event loop, so bulk onboarding never blocks it
+        loop = asyncio.get_running_loop()
+        scheme = get_key_scheme(self.key_scheme)
+        for username in usernames:
+            if username in self.users:
+                continue
+            if self._load_key(username) is not None:
+                private_key = None  # add_user signs with the key the stored chain was written under
+            elif self.key_pool is not None:
+                private_key = await self.key_pool.acquire()
+            else:
+                private_key = await loop.run_in_executor(None, scheme.generate_private_key)
+            self.add_user(username, private_key)
+
     def connect_users(self, user1, user2):
         if user1 in self.users and user2 in self.users:
             user1_blockchain = self.users[user1]
@@ -45,10 +163,12 @@ class SocialNetwork:
                 # 使用 DID 作为节点标识
                 self.p2p_networks[user1].add_node(user2, 
                     self.p2p_networks[user2].nodes[user2][0], 
-                    user2_blockchain.did)
+                    user2_blockchain.did,
+                    self.p2p_networks[user2].paths.get(user2, ''))
                 self.p2p_networks[user2].add_node(user1, 
                     self.p2p_networks[user1].nodes[user1][0], 
-                    user1_blockchain.did)
+                    user1_blockchain.did,
+                    self.p2p_networks[user1].paths.get(user1, ''))
                 
                 # 使用 DID 建立信任连接
                 self.add_trusted_connection(user1, user2, "contact")
@@ -61,7 +181,8 @@ class SocialNetwork:
         if user1 in self.users and user2 in self.users:
             user1_blockchain = self.users[user1]
             user2_port, user2_id = self.p2p_networks[user2].nodes[user2]
-            user1_blockchain.add_trusted_node(user2_id, node_type, f"{self.host}:{user2_port}")
+            user2_path = self.p2p_networks[user2].paths.get(user2, '')
+            user1_blockchain.add_trusted_node(user2_id, node_type, f"{self.host}:{user2_port}{user2_path}")
             logging.info(f"Added trusted connection for {user1}: {user2_id} ({node_type})")
 
     def post_data(self, username, data):
@@ -72,9 +193,24 @@ class SocialNetwork:
 
     async def propagate_data(self, username, data):
         if username in self.users:
-            await self.p2p_networks[username].broadcast(username, data)
+            if self.propagation == "gossip":
+                await self.p2p_networks[username].gossip(username, data, self.gossip_fanout, self.get_gossip_ttl())
+            else:
+                await self.p2p_networks[username].broadcast(username, data)
             logging.info(f"Propagated data from {username}")
 
+    def get_gossip_ttl(self):
+        # Gossip reaches everyone in O(log N) rounds; a little slack covers unlucky peer choices
+        if self.gossip_ttl is not None:
+            return self.gossip_ttl
+        return math.ceil(math.log2(max(len(self.users), 2))) + 2
+
+    async def sync_chain(self, username, peer_username):
+        # Catches up username's chain from a connected peer holding a newer copy, such as another device
+        if username in self.users:
+            return await self.p2p_networks[username].sync_chain(peer_username, self.users[username])
+        return 0
+
     async def create_and_distribute_backup(self, username):
         if username in self.users:
             user_blockchain = self.users[username]
@@ -85,14 +221,18 @@ class SocialNetwork:
                     f"Not enough trusted nodes for {username}. Have {len(trusted_nodes)}, need {self.total_shares}")
                 return False
 
+            if self.incremental_backups:
+                return await self._distribute_incremental_backup(username, trusted_nodes[:self.total_shares])
+
             try:
-                serialized_shares = user_blockchain.backup_manager.create_backup(self.total_shares,
-                                                                                 self.backup_threshold)
-                logging.debug(f"Created serialized shares of length: {len(serialized_shares)}")
+                backup_slices = await user_blockchain.backup_manager.create_backup_slices_async(
+                    self.total_shares, self.backup_threshold, self._get_backup_executor())
+                logging.debug(f"Created {len(backup_slices)} backup slices of length: {len(backup_slices[0])}")
 
-                for i, node in enumerate(trusted_nodes[:self.total_shares]):
-                    await self.p2p_networks[username].send_backup(node.node_id, serialized_shares)
-                    logging.debug(f"Sent backup to trusted node {i + 1}/{self.total_shares}")
+                # Each trusted node only receives the shares for its own x-coordinate
+                for i, (node, backup_slice) in enumerate(zip(trusted_nodes[:self.total_shares], backup_slices)):
+                    await self.p2p_networks[username].send_backup(node.node_id, backup_slice)
+                    logging.debug(f"Sent backup slice to trusted node {i + 1}/{self.total_shares}")
 
                 logging.info(f"Created and distributed backup for {username}")
                 return True
@@ -109,30 +249,150 @@ class SocialNetwork:
                 logging.warning(f"Insufficient trusted nodes for {username}. Have {len(trusted_nodes)}, need {self.backup_threshold}")
                 return False
 
-            serialized_shares = None
-            for i, node in enumerate(trusted_nodes):
-                try:
-                    share = await self.p2p_networks[username].request_backup(node.node_id)
-                    if share:
-                        serialized_shares = share
-                        logging.debug(f"Retrieved backup from trusted node {i + 1}")
-                        break
-                except Exception as e:
-                    logging.error(f"Error retrieving backup from node {i + 1}: {str(e)}")
-
-            if serialized_shares:
-                logging.debug(f"Retrieved serialized shares of length: {len(serialized_shares)}")
-                success = user_blockchain.backup_manager.restore_from_backup(serialized_shares, self.backup_threshold)
+            if self.incremental_backups:
+                return await self._restore_incremental_backup(username, trusted_nodes)
+
+            backup_manager = user_blockchain.backup_manager
+            backup_slices = await self._collect_backup_slices(username, trusted_nodes)
+            if len(backup_slices) >= self.backup_threshold:
+                success = await backup_manager.restore_from_slices_async(
+                    [backup_slice for _, backup_slice in backup_slices.values()], self.backup_threshold,
+                    self._get_backup_executor())
+                if not success and len(backup_slices) < len(trusted_nodes):
+                    # The quickest k slices do not verify; with every holder's slice the bad ones can be singled out
+                    logging.warning(f"Backup for {username} failed verification, fetching every holder's slice")
+                    backup_slices = await self._collect_backup_slices(username, trusted_nodes,
+                                                                      quorum=len(trusted_nodes))
+                    success = await backup_manager.restore_from_slices_async(
+                        [backup_slice for _, backup_slice in backup_slices.values()], self.backup_threshold,
+                        self._get_backup_executor())
+                for x in backup_manager.bad_holders:
+                    if x in backup_slices:
+                        logging.error(f"Node {backup_slices[x][0].node_id} sent a corrupted backup slice for {username}")
                 if success:
                     logging.info(f"Successfully restored backup for {username}")
                 else:
                     logging.error(f"Failed to restore backup for {username}")
                 return success
             else:
-                logging.error(f"No backup shares found for {username}")
+                logging.error(f"Only found {len(backup_slices)} backup slices for {username}, need {self.backup_threshold}")
                 return False
         return False
 
+    async def _collect_backup_slices(self, username, trusted_nodes, backup_id=None, quorum=None):
+        # Queries every holder at once and returns as soon as quorum (by default k) valid slices with
+        # distinct x-coordinates are in, so latency follows the k-th fastest holder. Maps each slice's
+        # x-coordinate to (node, slice)
+        quorum = quorum or self.backup_threshold
+        tasks = {asyncio.ensure_future(self._fetch_backup(username, node, backup_id)): node for node in trusted_nodes}
+        backup_slices = {}
+        pending = set(tasks)
+        try:
+            while pending and len(backup_slices) < quorum:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    backup_slice = task.result()
+                    if not backup_slice:
+                        continue
+                    try:
+                        container = verify_share_slice(backup_slice)
+                    except ValueError as e:
+                        logging.error(f"Invalid backup slice from node {tasks[task].node_id}: {str(e)}")
+                        continue
+                    backup_slices.setdefault(container.x, (tasks[task], backup_slice))
+                    logging.debug(f"Retrieved backup slice {container.x} from node {tasks[task].node_id}")
+        finally:
+            for task in pending:
+                task.cancel()
+        return backup_slices
+
+    async def _fetch_backup(self, username, node, backup_id=None):
+        # Hedged request to one holder: a slow attempt gets a second one racing it after the hedge
+        # delay, and failed or timed out attempts are retried, up to backup_request_attempts in total
+        p2p_network = self.p2p_networks[username]
+        attempts = set()
+        started = 0
+        try:
+            while True:
+                if started < self.backup_request_attempts:
+                    attempts.add(asyncio.ensure_future(asyncio.wait_for(
+                        p2p_network.request_backup(node.node_id, backup_id), self.backup_request_timeout)))
+                    started += 1
+                if not attempts:
+                    return None
+                hedge_delay = self.backup_hedge_delay if started < self.backup_request_attempts else None
+                done, attempts = await asyncio.wait(attempts, timeout=hedge_delay,
+                                                    return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        # A missing backup is a definite answer, not worth retrying
+                        return attempt.result()
+                    logging.warning(f"Backup request to node {node.node_id} failed: {attempt.exception()!r}")
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    async def _distribute_incremental_backup(self, username, trusted_nodes):
+        backup_manager = self.users[username].backup_manager
+        p2p_network = self.p2p_networks[username]
+        try:
+            previous_manifest = backup_manager.manifest
+            # Deltas are small, so they are split on a thread rather than fanned out to the process pool
+            segment_id, backup_slices, manifest = await asyncio.get_running_loop().run_in_executor(
+                None, backup_manager.create_incremental_backup, self.total_shares, self.backup_threshold)
+            for node, backup_slice in zip(trusted_nodes, backup_slices):
+                await p2p_network.send_backup(node.node_id, backup_slice, segment_id)
+            for node in trusted_nodes:
+                await p2p_network.send_backup(node.node_id, manifest, MANIFEST_BACKUP_ID)
+
+            # Segments folded into a new base by compaction are no longer referenced
+            if previous_manifest is not None:
+                live_segments = {segment["id"] for segment in manifest["segments"]}
+                for segment in previous_manifest["segments"]:
+                    if segment["id"] not in live_segments:
+                        for node in trusted_nodes:
+                            await p2p_network.discard_backup(node.node_id, segment["id"])
+
+            if segment_id is None:
+                logging.info(f"Backup for {username} is already up to date")
+            else:
+                logging.info(f"Distributed backup segment {segment_id} for {username}")
+            return True
+        except Exception as e:
+            logging.error(f"Error in incremental backup distribution: {str(e)}")
+            return False
+
+    async def _restore_incremental_backup(self, username, trusted_nodes):
+        backup_manager = self.users[username].backup_manager
+
+        # Holders may have missed an update, so use the newest manifest with a valid signature
+        candidates = await asyncio.gather(*(self._fetch_backup(username, node, MANIFEST_BACKUP_ID)
+                                            for node in trusted_nodes))
+        manifest = None
+        for candidate in candidates:
+            if candidate and backup_manager.verify_manifest(candidate):
+                if manifest is None or candidate["segments"][-1]["end"] > manifest["segments"][-1]["end"]:
+                    manifest = candidate
+        if manifest is None:
+            logging.error(f"No valid backup manifest found for {username}")
+            return False
+
+        segment_slices = await asyncio.gather(*(self._collect_backup_slices(username, trusted_nodes, segment["id"])
+                                                for segment in manifest["segments"]))
+        segments = {}
+        for segment, backup_slices in zip(manifest["segments"], segment_slices):
+            if len(backup_slices) < self.backup_threshold:
+                logging.error(f"Only found {len(backup_slices)} slices of segment {segment['id']} for {username}")
+                return False
+            segments[segment["id"]] = b''.join(backup_slice for _, backup_slice in backup_slices.values())
+
+        success = await backup_manager.restore_from_incremental_async(manifest, segments, self.backup_threshold)
+        if success:
+            logging.info(f"Successfully restored incremental backup for {username}")
+        else:
+            logging.error(f"Failed to restore incremental backup for {username}")
+        return success
+
     def get_trusted_nodes_count(self, username):
         if username in self.users:
             return len(self.users[username].trusted_nodes)
@@ -1,8 +1,17 @@
 import pytest
 from src.backup_manager import BackupManager
+from src.block import Block
 from src.blockchain import PersonalBlockchain, TrustedNode
+import asyncio
 import base64
+import contextlib
+import io
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from src.block_store import SegmentBlockStore
+from src.share_format import iter_share_containers, read_header
+from src.shamir_secret_sharing import ShamirSecretSharing, PRIME
 
 @pytest.fixture
 def personal_blockchain():
@@ -114,5 +123,381 @@ async def test_backup_with_complex_data(backup_manager):
     # Verify that the complex data was correctly restored
     assert restored_chain[-1].data["data"] == complex_data
 
+def test_backup_with_gf256_scheme(personal_blockchain):
+    backup_manager = BackupManager(personal_blockchain, scheme="gf256")
+    personal_blockchain.add_block({"message": "Test Data"})
+    n, k = 5, 3
+
+    serialized_shares = backup_manager.create_backup(n, k)
+    original_chain = personal_blockchain.chain
+    personal_blockchain.chain = []
+
+    assert backup_manager.restore_from_backup(serialized_shares, k)
+    restored_chain = personal_blockchain.chain
+    assert len(restored_chain) == len(original_chain)
+    assert restored_chain[-1].data == original_chain[-1].data
+
+@pytest.mark.parametrize("scheme", ["prime", "gf256"])
+def test_streamed_backup_and_restore(scheme, tmp_path):
+    personal_blockchain = PersonalBlockchain("TestUser", SegmentBlockStore(str(tmp_path / "chain")))
+    backup_manager = BackupManager(personal_blockchain, scheme=scheme)
+    for i in range(5):
+        personal_blockchain.add_block({"message": f"Post {i}"})
+    original_hashes = [block.hash for block in personal_blockchain.chain]
+    n, k = 5, 3
+
+    sinks = [io.BytesIO() for _ in range(n)]
+    assert backup_manager.create_backup_stream(n, k, sinks) > 0
+
+    personal_blockchain.chain = []
+    sources = {x: io.BytesIO(sinks[x - 1].getvalue()) for x in (1, 3, 5)}
+    assert backup_manager.restore_from_stream(sources, k)
+    assert [block.hash for block in personal_blockchain.chain] == original_hashes
+
+    personal_blockchain.chain = []
+    sources = {x: io.BytesIO(sinks[x - 1].getvalue()) for x in (1, 3)}
+    assert not backup_manager.restore_from_stream(sources, k)
+    personal_blockchain.chain.close()
+
+@pytest.mark.parametrize("scheme", ["prime", "gf256"])
+def test_backup_slices_hold_one_holder_each(scheme, personal_blockchain):
+    backup_manager = BackupManager(personal_blockchain, scheme=scheme)
+    personal_blockchain.add_block({"message": "Test Data"})
+    n, k = 5, 3
+
+    slices = backup_manager.create_backup_slices(n, k)
+    assert len(slices) == n
+    for x, backup_slice in enumerate(slices, start=1):
+        containers = list(iter_share_containers(backup_slice))
+        assert [container.x for container in containers] == [x]
+    assert b''.join(slices) == backup_manager.sss.serialize_shares(
+        backup_manager.sss.deserialize_shares(b''.join(slices)), k)
+
+    original_chain = personal_blockchain.chain
+    personal_blockchain.chain = []
+    assert backup_manager.restore_from_slices([slices[4], slices[0], slices[2]], k)
+    assert [block.hash for block in personal_blockchain.chain] == [block.hash for block in original_chain]
+
+    personal_blockchain.chain = []
+    assert not backup_manager.restore_from_slices(slices[:k - 1], k)
+
+def test_restore_keeps_stored_hashes_and_checks_seal(personal_blockchain):
+    backup_manager = BackupManager(personal_blockchain)
+    for i in range(3):
+        personal_blockchain.add_block({"message": f"Post {i}"})
+    n, k = 4, 3
+    original_hashes = [block.hash for block in personal_blockchain.chain]
+    serialized_shares = backup_manager.create_backup(n, k)
+    personal_blockchain.chain = []
+    assert backup_manager.restore_from_backup(serialized_shares, k)
+    assert [block.hash for block in personal_blockchain.chain] == original_hashes
+    assert backup_manager.bad_holders == []
+
+    # Sealed with someone else's key
+    impostor = PersonalBlockchain("TestUser")
+    assert not backup_manager.restore_from_backup(BackupManager(impostor).create_backup(n, k), k)
+
+    # A broken hash link is caught without rehashing; edited data under the old hash only with rehash
+    personal_blockchain.chain[1].data = {"data": {"message": "Edited"}, "signature": "sig"}
+    edited = backup_manager.create_backup(n, k)
+    assert backup_manager.restore_from_backup(edited, k)
+    assert not backup_manager.restore_from_backup(edited, k, rehash=True)
+    personal_blockchain.chain[1].hash = "0" * 64
+    assert not backup_manager.restore_from_backup(backup_manager.create_backup(n, k), k)
+
+def test_unsealed_tampered_backup_is_rejected(personal_blockchain):
+    backup_manager = BackupManager(personal_blockchain)
+    for i in range(3):
+        personal_blockchain.add_block({"message": f"Post {i}"})
+    n, k = 4, 3
+    segment_id, slices, manifest = backup_manager.create_incremental_backup(n, k)
+    original_hashes = [block.hash for block in personal_blockchain.chain]
+
+    # Edited content under the old hashes, shared without a seal by anyone holding k shares
+    forged = PersonalBlockchain("TestUser", private_key=personal_blockchain.private_key)
+    forged.chain = [Block.from_dict(block.to_dict()) for block in personal_blockchain.chain]
+    forged.chain[1].data = {"data": {"message": "forged"}, "signature": "sig"}
+    sss = backup_manager.sss
+    unsealed = sss.serialize_shares(sss.split_secret(forged, n, k), k)
+    assert not backup_manager.restore_from_backup(unsealed, k)
+    assert not backup_manager.restore_from_incremental(manifest, {segment_id: unsealed}, k)
+    assert [block.hash for block in personal_blockchain.chain] == original_hashes
+
+    # Version 1 containers predate the seal; they still restore, but every block is rehashed
+    legacy = ShamirSecretSharing(PRIME, sentinel=False)
+    for chain, restores in ((forged, False), (personal_blockchain, True)):
+        serialized_shares = bytearray(legacy.serialize_shares(legacy.split_secret(chain, n, k), k))
+        for offset in range(0, len(serialized_shares), len(serialized_shares) // n):
+            serialized_shares[offset + 4] = 1
+        assert backup_manager.restore_from_backup(bytes(serialized_shares), k) == restores
+    assert [block.hash for block in personal_blockchain.chain] == original_hashes
+
+def test_failed_restore_leaves_segment_chain_intact(tmp_path):
+    directory = str(tmp_path / "chain")
+    personal_blockchain = PersonalBlockchain("TestUser", SegmentBlockStore(directory, segment_size=1024))
+    backup_manager = BackupManager(personal_blockchain)
+    for i in range(20):
+        personal_blockchain.add_block({"message": f"Post {i}"})
+    original_hashes = [block.hash for block in personal_blockchain.chain]
+    n, k = 4, 3
+
+    impostor = PersonalBlockchain("TestUser")
+    for i in range(5):
+        impostor.add_block({"message": f"Forged {i}"})
+    assert not backup_manager.restore_from_backup(BackupManager(impostor).create_backup(n, k), k)
+    assert [block.hash for block in personal_blockchain.chain] == original_hashes
+    personal_blockchain.chain.close()
+    assert [block.hash for block in SegmentBlockStore(directory)] == original_hashes
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("use_pool", [False, True])
+async def test_unverified_backups_never_reach_segment_chain(tmp_path, use_pool):
+    directory = str(tmp_path / "chain")
+    personal_blockchain = PersonalBlockchain("TestUser", SegmentBlockStore(directory, segment_size=1024))
+    backup_manager = BackupManager(personal_blockchain)
+    for i in range(20):
+        personal_blockchain.add_block({"message": f"Post {i}"})
+    original_hashes = [block.hash for block in personal_blockchain.chain]
+    n, k = 5, 3
+    slices = backup_manager.create_backup_slices(n, k)
+    impostor = PersonalBlockchain("TestUser")
+    for i in range(25):
+        impostor.add_block({"message": f"Forged {i}"})
+    forged = BackupManager(impostor).create_backup_slices(n, k)
+    first, fourth = (tamper_slice(backup_manager.sss, slices[x], k) for x in (0, 3))
+
+    with ProcessPoolExecutor(max_workers=2) if use_pool else contextlib.nullcontext() as executor:
+        # A forged seal fails only after every block has decoded; with more than k holders the quorum
+        # fallback tries every subset, and none verifies when two of the four holders tampered
+        assert not await backup_manager.restore_from_slices_async(forged, k, executor)
+        assert not await backup_manager.restore_from_slices_async([first, slices[1], slices[2], fourth], k, executor)
+        assert [block.hash for block in personal_blockchain.chain] == original_hashes
+        assert not os.path.exists(directory + SegmentBlockStore.STAGING_SUFFIX)
+
+        # A single tampered holder is outvoted and the fallback's chain is swapped in
+        personal_blockchain.add_block({"message": "Not backed up yet"})
+        assert await backup_manager.restore_from_slices_async([first, slices[2], slices[3], slices[4]], k, executor)
+        assert backup_manager.bad_holders == [1]
+    assert [block.hash for block in personal_blockchain.chain] == original_hashes
+    personal_blockchain.chain.close()
+    assert [block.hash for block in SegmentBlockStore(directory)] == original_hashes
+
+def tamper_slice(sss, backup_slice, k):
+    # Changes one share value and rewrites the checksums so only verification can catch it
+    rows = [[(x, y) for x, y in shares] for shares in sss.deserialize_shares(backup_slice)]
+    x, y = rows[0][0]
+    rows[0][0] = (x, (y + 1) % PRIME if isinstance(y, int) else bytes([y[0] ^ 1]) + bytes(y[1:]))
+    return sss.serialize_share_slices(rows, k)[0]
+
+@pytest.mark.parametrize("scheme", ["prime", "gf256"])
+def test_restore_reports_bad_holders(personal_blockchain, scheme):
+    backup_manager = BackupManager(personal_blockchain, scheme=scheme)
+    personal_blockchain.add_block({"message": "Post 0"})
+    n, k = 5, 3
+    slices = backup_manager.create_backup_slices(n, k)
+    original_hashes = [block.hash for block in personal_blockchain.chain]
+
+    corrupted = bytearray(slices[1])
+    corrupted[-1] ^= 0xFF
+    assert backup_manager.restore_from_slices([slices[0], bytes(corrupted), slices[2], slices[3]], k)
+    assert backup_manager.bad_holders == [2]
+
+    tampered = tamper_slice(backup_manager.sss, slices[0], k)
+    personal_blockchain.chain = []
+    assert backup_manager.restore_from_slices([tampered, slices[1], slices[2], slices[4]], k)
+    assert backup_manager.bad_holders == [1]
+    assert [block.hash for block in personal_blockchain.chain] == original_hashes
+
+    # With only k holders there is nobody to outvote the tampered share
+    assert not backup_manager.restore_from_slices([tampered, slices[1], slices[2]], k)
+
+def test_incremental_backup_shares_only_new_blocks(personal_blockchain):
+    backup_manager = BackupManager(personal_blockchain, max_deltas=2)
+    n, k = 4, 3
+    stored = {}
+
+    def backup():
+        segment_id, slices, manifest = backup_manager.create_incremental_backup(n, k)
+        if segment_id is not None:
+            stored[segment_id] = b''.join(slices[:k])
+        return segment_id, manifest
+
+    personal_blockchain.add_block({"message": "Post 0"})
+    assert backup()[0] == "base-0-2"
+    personal_blockchain.add_block({"message": "Post 1"})
+    personal_blockchain.add_block({"message": "Post 2"})
+    segment_id, manifest = backup()
+    assert segment_id == "delta-2-4"
+    assert backup()[0] is None  # Nothing new since the last backup
+
+    # The delta only carries the two new blocks
+    delta_shares = backup_manager.sss.deserialize_shares(stored["delta-2-4"])
+    delta = backup_manager.sss.reconstruct_secret(delta_shares, k)
+    assert [block["data"]["data"]["message"] for block in delta["chain"]] == ["Post 1", "Post 2"]
+
+    original_hashes = [block.hash for block in personal_blockchain.chain]
+    personal_blockchain.chain = []
+    assert backup_manager.restore_from_incremental(manifest, stored, k)
+    assert [block.hash for block in personal_blockchain.chain] == original_hashes
+
+    # Another delta stays under max_deltas, the next backup folds everything into a new base
+    personal_blockchain.add_block({"message": "Post 3"})
+    assert backup()[0] == "delta-4-5"
+    personal_blockchain.add_block({"message": "Post 4"})
+    segment_id, manifest = backup()
+    assert segment_id == "base-0-6"
+    assert [segment["id"] for segment in manifest["segments"]] == ["base-0-6"]
+
+def test_incremental_restore_rejects_tampering(personal_blockchain):
+    backup_manager = BackupManager(personal_blockchain)
+    n, k = 4, 3
+    personal_blockchain.add_block({"message": "Post 0"})
+    base_id, base_slices, _ = backup_manager.create_incremental_backup(n, k)
+    personal_blockchain.add_block({"message": "Post 1"})
+    delta_id, delta_slices, manifest = backup_manager.create_incremental_backup(n, k)
+    segments = {base_id: b''.join(base_slices), delta_id: b''.join(delta_slices)}
+
+    forged = dict(manifest, tip_hash="0" * 64)
+    assert not backup_manager.restore_from_incremental(forged, segments, k)
+    assert not backup_manager.restore_from_incremental(manifest, {base_id: segments[base_id]}, k)
+    swapped = {base_id: segments[delta_id], delta_id: segments[base_id]}
+    assert not backup_manager.restore_from_incremental(manifest, swapped, k)
+    assert backup_manager.restore_from_incremental(manifest, segments, k)
+
+def test_failed_incremental_restore_leaves_segment_chain_intact(tmp_path):
+    directory = str(tmp_path / "chain")
+    personal_blockchain = PersonalBlockchain("TestUser", SegmentBlockStore(directory))
+    backup_manager = BackupManager(personal_blockchain)
+    n, k = 4, 3
+    segments = {}
+    for i in range(3):
+        personal_blockchain.add_block({"message": f"Post {i}"})
+        segment_id, slices, manifest = backup_manager.create_incremental_backup(n, k)
+        segments[segment_id] = b''.join(slices)
+    personal_blockchain.add_block({"message": "Not backed up yet"})
+    original_hashes = [block.hash for block in personal_blockchain.chain]
+
+    # The base and first delta replay fine; the last delta slot holds the wrong segment
+    first_delta, last_delta = [segment["id"] for segment in manifest["segments"][1:]]
+    assert not backup_manager.restore_from_incremental(manifest, dict(segments, **{last_delta: segments[first_delta]}), k)
+    assert [block.hash for block in personal_blockchain.chain] == original_hashes
+    personal_blockchain.chain.close()
+    assert [block.hash for block in SegmentBlockStore(directory)] == original_hashes
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("scheme", ["prime", "gf256"])
+async def test_async_backup_on_process_pool(scheme, personal_blockchain):
+    backup_manager = BackupManager(personal_blockchain, scheme=scheme)
+    backup_manager.sss.chunk_size = min(backup_manager.sss.chunk_size, 256)
+    backup_manager.range_bytes = 1024  # Several ranges, so more of them are read than fit in flight
+    for i in range(20):
+        personal_blockchain.add_block({"message": f"Post {i}"})
+    original_hashes = [block.hash for block in personal_blockchain.chain]
+    n, k = 5, 3
+
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0)
+
+        ticker_task = asyncio.create_task(ticker())
+        slices = await backup_manager.create_backup_slices_async(n, k, executor, partitions=4)
+        ticker_task.cancel()
+        assert ticks > 1  # The loop kept running while the chunks were split
+
+        expected_chunks = len(backup_manager.sss.split_secret(personal_blockchain, n, k, seal=True))
+        assert [[(c.x, c.n, c.k, c.chunk_count) for c in iter_share_containers(s)] for s in slices] == \
+            [[(x, n, k, expected_chunks)] for x in range(1, n + 1)]
+
+        personal_blockchain.chain = []
+        assert await backup_manager.restore_from_slices_async([slices[1], slices[3], slices[4]], k, executor,
+                                                              partitions=3)
+        assert [block.hash for block in personal_blockchain.chain] == original_hashes
+
+    personal_blockchain.chain = []
+    assert backup_manager.restore_from_slices(slices[:k], k)
+    assert [block.hash for block in personal_blockchain.chain] == original_hashes
+    assert not await backup_manager.restore_from_slices_async(slices[:k - 1], k)
+
+@pytest.mark.asyncio
+async def test_async_backups_while_posting_to_segment_chain(tmp_path):
+    store = SegmentBlockStore(str(tmp_path / "chain"), segment_size=4096, cache_size=4)
+    personal_blockchain = PersonalBlockchain("TestUser", store)
+    backup_manager = BackupManager(personal_blockchain)
+    for i in range(100):
+        personal_blockchain.add_block({"message": f"Post {i}"})
+    n, k = 4, 3
+
+    async def post():
+        # Appends roll segments and drop mappings while the backups read the chain on threads
+        for i in range(100, 200):
+            personal_blockchain.add_block({"message": f"Post {i}"})
+            await asyncio.sleep(0)
+
+    posting = asyncio.create_task(post())
+    slices = await backup_manager.create_backup_slices_async(n, k)
+    segment_id, segment_slices, manifest = await asyncio.get_running_loop().run_in_executor(
+        None, backup_manager.create_incremental_backup, n, k)
+    await posting
+    final_hashes = [block.hash for block in personal_blockchain.chain]
+
+    # Each backup holds a consistent prefix of the chain as it was when the backup started
+    assert await backup_manager.restore_from_slices_async(slices[:k], k)
+    restored = [block.hash for block in personal_blockchain.chain]
+    assert len(restored) >= 100 and restored == final_hashes[:len(restored)]
+    assert await backup_manager.restore_from_incremental_async(manifest, {segment_id: b''.join(segment_slices)}, k)
+    restored = [block.hash for block in personal_blockchain.chain]
+    assert len(restored) == manifest["segments"][-1]["end"] and restored == final_hashes[:len(restored)]
+
+@pytest.mark.parametrize("scheme", ["prime", "gf256"])
+@pytest.mark.parametrize("codec", ["zlib", "lzma", "zlib-dict"])
+def test_compressed_backup(scheme, codec, personal_blockchain):
+    for i in range(10):
+        personal_blockchain.add_block({"message": f"Post {i}"})
+    original_hashes = [block.hash for block in personal_blockchain.chain]
+    n, k = 5, 3
+    plain = BackupManager(personal_blockchain, scheme=scheme).create_backup(n, k)
+    backup_manager = BackupManager(personal_blockchain, scheme=scheme, codec=codec)
+    serialized_shares = backup_manager.create_backup(n, k)
+    assert read_header(serialized_shares).codec == codec
+    assert len(serialized_shares) < len(plain)
+
+    # Restore reads the codec from the header, whatever the restoring manager is configured with
+    personal_blockchain.chain = []
+    assert BackupManager(personal_blockchain).restore_from_backup(serialized_shares, k)
+    assert [block.hash for block in personal_blockchain.chain] == original_hashes
+
+    sinks = [io.BytesIO() for _ in range(n)]
+    backup_manager.create_backup_stream(n, k, sinks)
+    personal_blockchain.chain = []
+    sources = {x: io.BytesIO(sinks[x - 1].getvalue()) for x in (1, 2, 5)}
+    assert BackupManager(personal_blockchain, scheme=scheme).restore_from_stream(sources, k)
+    assert [block.hash for block in personal_blockchain.chain] == original_hashes
+
+def test_restore_version_1_prime_backup(personal_blockchain):
+    personal_blockchain.add_block({"message": "Test Data"})
+    original_hashes = [block.hash for block in personal_blockchain.chain]
+    legacy = ShamirSecretSharing(PRIME, sentinel=False)
+    serialized_shares = bytearray(legacy.serialize_shares(legacy.split_secret(personal_blockchain, 4, 3), 3))
+    # Rewrite every header as version 1, whose codec byte was still padding
+    for offset in range(0, len(serialized_shares), len(serialized_shares) // 4):
+        serialized_shares[offset + 4] = 1
+
+    personal_blockchain.chain = []
+    assert BackupManager(personal_blockchain).restore_from_backup(bytes(serialized_shares), 3)
+    assert [block.hash for block in personal_blockchain.chain] == original_hashes
+
+def test_unknown_backup_codec(personal_blockchain):
+    with pytest.raises(ValueError, match="Unknown compression codec"):
+        BackupManager(personal_blockchain, codec="brotli")
+
+def test_unknown_backup_scheme(personal_blockchain):
+    with pytest.raises(ValueError, match="Unknown secret sharing scheme"):
+        BackupManager(personal_blockchain, scheme="xor")
+
 if __name__ == "__main__":
     pytest.main([__file__])
\ No newline at end of file
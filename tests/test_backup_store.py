@@ -0,0 +1,90 @@
+import os
+import pytest
+from src.backup_store import BackupQuotaExceeded, BackupStore
+
+def blob_files(root):
+    return sorted(name for _, _, names in os.walk(os.path.join(root, BackupStore.BLOB_DIR)) for name in names)
+
+def test_memory_store_behaves_like_a_dict():
+    store = BackupStore()
+    store.put(("node1", None), b"slice")
+    store.put(("node1", "manifest"), {"segments": [1, 2]})
+    assert store[("node1", None)] == b"slice"
+    assert store.get(("node1", "manifest")) == {"segments": [1, 2]}
+    assert dict(store) == {("node1", None): b"slice", ("node1", "manifest"): {"segments": [1, 2]}}
+    assert store.delete(("node1", None)) and not store.delete(("node1", None))
+    assert store.get(("node1", None)) is None
+    with pytest.raises(KeyError):
+        store[("node1", None)]
+
+def test_blobs_are_content_addressed_and_survive_reopening(tmp_path):
+    root = str(tmp_path / "backups")
+    store = BackupStore(root)
+    digest = store.put(("node1", None), b"same bytes", owner="alice")
+    assert store.put(("node2", None), b"same bytes", owner="bob") == digest
+    store.put(("node3", None), b"other bytes", owner="alice")
+    assert len(blob_files(root)) == 2
+    assert store.delete(("node1", None))
+    assert len(blob_files(root)) == 2  # Still referenced by node2
+    store.put(("node3", None), b"replaced", owner="alice")
+    store.close()
+
+    reopened = BackupStore(root)
+    assert dict(reopened) == {("node2", None): b"same bytes", ("node3", None): b"replaced"}
+    assert reopened.owner_usage("alice") == len(b"replaced")
+    assert len(blob_files(root)) == 2
+    assert not any(".tmp" in name for name in blob_files(root))
+
+def test_lru_cache_is_bounded_and_reads_are_verified(tmp_path):
+    root = str(tmp_path / "backups")
+    store = BackupStore(root, cache_bytes=250)
+    for i in range(10):
+        store.put((f"node{i}", None), bytes([i]) * 100)
+    assert store.cached_bytes <= 250 and len(store.cache) == 2
+    assert store.get(("node0", None)) == bytes([0]) * 100  # Evicted, read back from disk
+
+    path = store._blob_path(store.digest(("node1", None)))
+    with open(path, "wb") as f:
+        f.write(b"tampered")
+    assert store.get(("node1", None)) is None
+
+def test_owner_quota(tmp_path):
+    store = BackupStore(str(tmp_path / "backups"), owner_quota=100)
+    store.put(("node1", None), b"x" * 60, owner="alice")
+    with pytest.raises(BackupQuotaExceeded):
+        store.put(("node2", None), b"y" * 60, owner="alice")
+    assert ("node2", None) not in store
+    store.put(("node1", None), b"z" * 90, owner="alice")  # Replacing her own backup frees its bytes
+    store.put(("node2", None), b"y" * 60, owner="bob")
+    assert store.owner_usage("alice") == 90 and store.owner_usage("bob") == 60
+
+def test_journal_recovers_from_torn_writes_and_orphans(tmp_path):
+    root = str(tmp_path / "backups")
+    store = BackupStore(root)
+    for i in range(200):
+        store.put(("node1", None), f"version {i}".encode())
+    assert store.journal_records < 200  # Compacted along the way
+    store.close()
+    with open(os.path.join(root, BackupStore.JOURNAL), "ab") as f:
+        f.write(b'{"op": "put", "key": ["node2"')
+    orphan = os.path.join(root, BackupStore.BLOB_DIR, "ab", "ab" + "0" * 62)
+    os.makedirs(os.path.dirname(orphan), exist_ok=True)
+    with open(orphan, "wb") as f:
+        f.write(b"orphan")
+
+    reopened = BackupStore(root)
+    assert dict(reopened) == {("node1", None): b"version 199"}
+    assert not os.path.exists(orphan)
+
+def test_writes_are_synced_by_default(tmp_path, mocker):
+    fsync = mocker.spy(os, "fsync")
+    store = BackupStore(str(tmp_path / "synced"))
+    fsync.reset_mock()
+    store.put(("node1", None), b"slice")
+    # The blob file, the blob directory gaining a shard directory, the shard directory after the rename
+    # and the journal record
+    assert fsync.call_count == 4
+    fsync.reset_mock()
+    unsynced = BackupStore(str(tmp_path / "unsynced"), sync=False)
+    unsynced.put(("node1", None), b"slice")
+    assert fsync.call_count == 0
@@ -0,0 +1,141 @@
+import os
+import pytest
+from src.block import Block
+from src.block_store import MemoryBlockStore, SegmentBlockStore
+from src.blockchain import PersonalBlockchain
+
+
+@pytest.fixture
+def store_dir(tmp_path):
+    return str(tmp_path / "chain")
+
+
+def make_blocks(count):
+    blocks = []
+    previous_hash = "0"
+    for i in range(count):
+        block = Block(i, 1700000000.0 + i, {"data": {"message": f"post {i}"}, "signature": "sig"}, previous_hash)
+        blocks.append(block)
+        previous_hash = block.hash
+    return blocks
+
+
+def test_memory_store_behaves_like_list():
+    blocks = make_blocks(3)
+    store = MemoryBlockStore(blocks)
+    assert len(store) == 3
+    assert store[-1] is blocks[-1]
+    assert list(store) == blocks
+    assert store.get_by_hash(blocks[1].hash) is blocks[1]
+
+
+def test_segment_store_append_and_read(store_dir):
+    blocks = make_blocks(5)
+    store = SegmentBlockStore(store_dir)
+    for block in blocks:
+        store.append(block)
+
+    assert len(store) == 5
+    assert store[-1].hash == blocks[-1].hash
+    assert [block.index for block in store] == [0, 1, 2, 3, 4]
+    assert store.get_by_hash(blocks[2].hash).data == blocks[2].data
+    store.close()
+
+
+def test_segment_store_reopens_lazily(store_dir):
+    blocks = make_blocks(20)
+    store = SegmentBlockStore(store_dir, segment_size=512)
+    for block in blocks:
+        store.append(block)
+    store.close()
+
+    reopened = SegmentBlockStore(store_dir, segment_size=512, cache_size=2)
+    assert len(reopened) == 20
+    assert len(reopened.cache) == 0
+    assert len(reopened.mmaps) == 0
+    assert len(reopened._list_segments()) > 1
+
+    block = reopened[7]
+    assert block.hash == blocks[7].hash
+    assert block.previous_hash == blocks[6].hash
+    assert block.calculate_hash() == block.hash
+    for i in range(20):
+        reopened[i]
+    assert len(reopened.cache) == 2
+    reopened.close()
+
+
+def test_segment_store_drops_torn_record(store_dir):
+    store = SegmentBlockStore(store_dir)
+    for block in make_blocks(3):
+        store.append(block)
+    store.close()
+
+    with open(store._segment_path(0), 'ab') as f:
+        f.write(b'\x00\x00\x01\x00partial')
+
+    reopened = SegmentBlockStore(store_dir)
+    assert len(reopened) == 3
+    reopened.append(make_blocks(4)[-1])
+    reopened.close()
+    assert len(SegmentBlockStore(store_dir)) == 4
+
+
+def test_blockchain_with_segment_store(store_dir):
+    blockchain = PersonalBlockchain("TestUser", SegmentBlockStore(store_dir))
+    blockchain.add_block({"message": "Test Data"})
+    assert len(blockchain.chain) == 2
+    assert blockchain.chain[-1].data["data"] == {"message": "Test Data"}
+    assert blockchain.chain[-1].previous_hash == blockchain.chain[0].hash
+    blockchain.chain.close()
+
+    reopened = SegmentBlockStore(store_dir)
+    assert [block.hash for block in reopened] == [block.hash for block in blockchain.chain]
+
+
+def test_chain_assignment_rebuilds_store(store_dir):
+    blockchain = PersonalBlockchain("TestUser", SegmentBlockStore(store_dir))
+    blockchain.add_block({"message": "Test Data"})
+    blocks = list(blockchain.chain)
+
+    blockchain.chain = []
+    assert len(blockchain.chain) == 0
+    blockchain.chain = blocks
+    assert [block.hash for block in blockchain.chain] == [block.hash for block in blocks]
+    blockchain.chain.close()
+
+
+def test_failed_replace_keeps_the_live_chain(store_dir):
+    blocks = make_blocks(6)
+    store = SegmentBlockStore(store_dir, segment_size=512)
+    for block in blocks[:4]:
+        store.append(block)
+
+    def failing_blocks():
+        yield from blocks[:2]
+        raise ValueError("Block 2 does not link to the block before it")
+
+    with pytest.raises(ValueError):
+        store.replace(failing_blocks())
+    assert [block.hash for block in store] == [block.hash for block in blocks[:4]]
+    assert not os.path.exists(store_dir + SegmentBlockStore.STAGING_SUFFIX)
+    store.append(blocks[4])
+    store.close()
+    assert len(SegmentBlockStore(store_dir)) == 5
+
+
+def test_interrupted_swap_is_finished_on_reopen(store_dir):
+    blocks = make_blocks(5)
+    store = SegmentBlockStore(store_dir)
+    for block in blocks[:2]:
+        store.append(block)
+    staged = store.stage(blocks)
+    store.close()
+    # Crash between the two renames of adopt()
+    os.rename(store_dir, store_dir + SegmentBlockStore.RETIRED_SUFFIX)
+
+    reopened = SegmentBlockStore(store_dir)
+    assert [block.hash for block in reopened] == [block.hash for block in blocks]
+    assert not os.path.exists(staged.directory)
+    assert not os.path.exists(store_dir + SegmentBlockStore.RETIRED_SUFFIX)
+    reopened.close()
@@ -1,4 +1,5 @@
 import pytest
+from concurrent.futures import ProcessPoolExecutor
 from unittest.mock import AsyncMock, Mock
 from src.blockchain import PersonalBlockchain, Block, TrustedNode
 from src.shamir_secret_sharing import ShamirSecretSharing, PRIME
@@ -39,6 +40,38 @@ def test_verify_signature(personal_blockchain):
     assert personal_blockchain.verify_signature(data, base64.b64decode(signature))
 
 
+def test_ed25519_blockchain():
+    blockchain = PersonalBlockchain("TestUser", key_scheme="ed25519")
+    blockchain.add_block({"message": "Test Data"})
+    blockchain.add_blocks([{"message": "Bulk 1"}, {"message": "Bulk 2"}])
+
+    signature = blockchain.sign_data("Test Data")
+    assert len(base64.b64decode(signature)) == 64
+    assert blockchain.verify_signature("Test Data", base64.b64decode(signature))
+    assert not blockchain.verify_signature("Other Data", base64.b64decode(signature))
+    assert blockchain.verify_chain()
+
+
+def test_ed25519_did_document():
+    blockchain = PersonalBlockchain("TestUser", key_scheme="ed25519")
+    method = blockchain.did_document["verificationMethod"][0]
+    assert method["type"] == "Ed25519VerificationKey2018"
+    assert method["publicKeyJwk"]["kty"] == "OKP"
+    assert method["publicKeyJwk"]["crv"] == "Ed25519"
+    assert len(base64.urlsafe_b64decode(method["publicKeyJwk"]["x"] + "=")) == 32
+
+
+def test_dids_are_unique_per_key():
+    dids = {PersonalBlockchain(f"User{i}", key_scheme=scheme).did
+            for i, scheme in enumerate(["rsa", "rsa", "ed25519", "ed25519"])}
+    assert len(dids) == 4
+
+
+def test_unknown_key_scheme():
+    with pytest.raises(ValueError, match="Unknown key scheme"):
+        PersonalBlockchain("TestUser", key_scheme="dsa")
+
+
 def test_add_and_remove_trusted_node(personal_blockchain):
     personal_blockchain.add_trusted_node("TestNode", "contact", "192.168.1.1")
     assert any(node.node_id == "TestNode" for node in personal_blockchain.trusted_nodes)
@@ -76,10 +109,11 @@ async def test_create_and_distribute_backup(personal_blockchain):
 async def test_restore_from_backup(personal_blockchain):
     # Create a mock backup
     sss = ShamirSecretSharing(PRIME)
-    mock_blockchain = PersonalBlockchain("TestUser")
+    # Another device of the same owner: backups are only accepted when sealed with the owner's key
+    mock_blockchain = PersonalBlockchain("TestUser", private_key=personal_blockchain.private_key)
     mock_blockchain.add_block({"message": "Test Block"})
     n, k = 5, 3
-    shares = sss.split_secret(mock_blockchain, n, k)
+    shares = sss.split_secret(mock_blockchain, n, k, seal=True)
     serialized_shares = sss.serialize_shares(shares)
 
     # Test reconstruction
@@ -95,5 +129,109 @@ async def test_restore_from_backup(personal_blockchain):
         pytest.fail(f"Reconstruction failed: {e}")
 
 
+def test_block_hash_is_canonical():
+    block = Block(1, 1700000000.0, {"data": {"b": 1, "a": [True, None, 2.5]}, "signature": "sig"}, "0")
+    reordered = Block(1, 1700000000.0, {"signature": "sig", "data": {"a": [True, None, 2.5], "b": 1}}, "0")
+    assert block.hash == reordered.hash
+    assert block.encode() == reordered.encode()
+
+    restored = Block.from_dict(json.loads(json.dumps(block.to_dict())))
+    assert restored.calculate_hash() == block.hash
+    assert restored.encode() == block.encode()
+
+    # Length prefixes keep field boundaries unambiguous
+    assert Block(1, 1.0, "12", "3").hash != Block(1, 1.0, "1", "23").hash
+
+
+def test_verify_chain(personal_blockchain):
+    for i in range(5):
+        personal_blockchain.add_block({"message": f"Post {i}"})
+    assert personal_blockchain.verify_chain()
+    assert personal_blockchain.verified_index == 5
+
+
+def test_verify_chain_is_incremental(personal_blockchain, mocker):
+    personal_blockchain.add_block({"message": "First"})
+    assert personal_blockchain.verify_chain()
+
+    personal_blockchain.add_block({"message": "Second"})
+    personal_blockchain.add_block({"message": "Third"})
+    spy = mocker.spy(personal_blockchain, '_verify_signatures')
+    assert personal_blockchain.verify_chain()
+    verified = [index for index, _, _ in spy.call_args[0][0]]
+    assert verified == [2, 3]
+    assert personal_blockchain.verified_index == 3
+
+
+def test_verify_chain_detects_broken_link(personal_blockchain):
+    for i in range(3):
+        personal_blockchain.add_block({"message": f"Post {i}"})
+    personal_blockchain.chain[2].previous_hash = "f" * 64
+    assert not personal_blockchain.verify_chain()
+    assert personal_blockchain.verified_index == 1
+
+
+def test_verify_chain_detects_bad_signature(personal_blockchain):
+    for i in range(3):
+        personal_blockchain.add_block({"message": f"Post {i}"})
+    forged = personal_blockchain.chain[3]
+    forged.data["signature"] = personal_blockchain.chain[2].data["signature"]
+    forged.hash = forged.calculate_hash()
+    assert not personal_blockchain.verify_chain()
+    assert personal_blockchain.verified_index == 2
+
+
+def test_verify_chain_with_process_pool(personal_blockchain):
+    for i in range(6):
+        personal_blockchain.add_block({"message": f"Post {i}"})
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        assert personal_blockchain.verify_chain(executor=executor, batch_size=2)
+    assert personal_blockchain.verified_index == 6
+
+
+def test_add_blocks_signs_merkle_root_once(personal_blockchain, mocker):
+    spy = mocker.spy(personal_blockchain, 'sign_data')
+    batch = [{"message": f"Bulk {i}"} for i in range(5)]
+    personal_blockchain.add_blocks(batch)
+
+    assert spy.call_count == 1
+    assert len(personal_blockchain.chain) == 6
+    roots = {block.data["merkle_root"] for block in personal_blockchain.chain[1:]}
+    assert len(roots) == 1
+    assert [block.data["data"] for block in personal_blockchain.chain[1:]] == batch
+    assert personal_blockchain.chain[3].previous_hash == personal_blockchain.chain[2].hash
+
+
+def test_batched_block_verifies_on_its_own(personal_blockchain):
+    personal_blockchain.add_blocks([{"message": f"Bulk {i}"} for i in range(7)])
+    assert all(personal_blockchain.verify_block(block) for block in personal_blockchain.chain)
+
+    tampered = personal_blockchain.chain[4]
+    tampered.data["data"] = {"message": "Forged"}
+    assert not personal_blockchain.verify_block(tampered)
+
+
+def test_verify_chain_with_batches(personal_blockchain, mocker):
+    personal_blockchain.add_block({"message": "Single"})
+    personal_blockchain.add_blocks([{"message": f"Bulk {i}"} for i in range(4)])
+    spy = mocker.spy(personal_blockchain, '_verify_signatures')
+    assert personal_blockchain.verify_chain()
+    # Genesis, the single block and one shared root for the batch
+    assert len(spy.call_args[0][0]) == 3
+
+    tampered = personal_blockchain.chain[4]
+    tampered.data["merkle_proof"] = personal_blockchain.chain[3].data["merkle_proof"]
+    tampered.hash = tampered.calculate_hash()
+    personal_blockchain.verified_index = -1
+    assert not personal_blockchain.verify_chain()
+    assert personal_blockchain.verified_index == 3
+
+
+def test_chain_assignment_resets_verification(personal_blockchain):
+    assert personal_blockchain.verify_chain()
+    personal_blockchain.chain = list(personal_blockchain.chain)
+    assert personal_blockchain.verified_index == -1
+
+
 if __name__ == "__main__":
     pytest.main([__file__])
\ No newline at end of file
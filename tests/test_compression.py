@@ -0,0 +1,53 @@
+import pytest
+import json
+from src.blockchain import PersonalBlockchain
+from src.chain_stream import iter_blockchain_json
+from src.compression import (CODEC_IDS, compress_pieces, decompress_pieces, iter_backup_chunks, iter_backup_events,
+                             validate_codec)
+
+@pytest.fixture
+def personal_blockchain():
+    blockchain = PersonalBlockchain("TestUser", key_scheme="ed25519")
+    for i in range(20):
+        blockchain.add_block({"message": f"Post {i}"})
+    return blockchain
+
+def chain_document(personal_blockchain):
+    return b''.join(iter_blockchain_json(personal_blockchain.owner, personal_blockchain.chain, 4096))
+
+@pytest.mark.parametrize("codec", list(CODEC_IDS))
+def test_backup_chunks_round_trip(codec, personal_blockchain):
+    chunks = list(iter_backup_chunks(personal_blockchain.owner, personal_blockchain.chain, 100, codec))
+    assert all(len(chunk) == 100 for chunk in chunks[:-1])
+    events = list(iter_backup_events(chunks, codec))
+    assert events[0] == ("owner", "TestUser")
+    assert [block["hash"] for _, block in events[1:]] == [block.hash for block in personal_blockchain.chain]
+
+def test_codecs_shrink_chain_document(personal_blockchain):
+    document = chain_document(personal_blockchain)
+    sizes = {codec: len(b''.join(compress_pieces([document], codec))) for codec in CODEC_IDS}
+    assert sizes["none"] == len(document)
+    assert sizes["zlib"] < len(document) // 2
+    assert sizes["lzma"] < len(document) // 2
+    # The preset dictionary pays off most on short chains
+    genesis_only = chain_document(PersonalBlockchain("Other"))
+    assert len(b''.join(compress_pieces([genesis_only], "zlib-dict"))) < \
+        len(b''.join(compress_pieces([genesis_only], "zlib")))
+
+@pytest.mark.parametrize("codec", ["zlib", "lzma", "zlib-dict"])
+def test_truncated_compressed_stream(codec, personal_blockchain):
+    compressed = b''.join(compress_pieces([chain_document(personal_blockchain)], codec))
+    with pytest.raises(ValueError, match="ended early"):
+        b''.join(decompress_pieces([compressed[:len(compressed) // 2]], codec))
+    with pytest.raises(ValueError, match="Unexpected data"):
+        b''.join(decompress_pieces([compressed, b'\x00'], codec))
+    with pytest.raises(ValueError, match="Unexpected data"):
+        b''.join(decompress_pieces([compressed + b'\x00'], codec))
+
+def test_unknown_codec():
+    with pytest.raises(ValueError, match="Unknown compression codec"):
+        validate_codec("brotli")
+    assert json.loads(b''.join(decompress_pieces([b'{"a": 1}'], "none"))) == {"a": 1}
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,66 @@
+import pytest
+import random
+from src.gf256_secret_sharing import GF256SecretSharing, gf_mul, gf_div
+from src.blockchain import PersonalBlockchain
+
+@pytest.fixture
+def sss():
+    return GF256SecretSharing(chunk_size=256)
+
+@pytest.fixture
+def personal_blockchain():
+    blockchain = PersonalBlockchain("TestUser")
+    for i in range(3):
+        blockchain.add_block({"message": f"Post {i}"})
+    return blockchain
+
+def test_field_arithmetic():
+    for a in range(1, 256):
+        assert gf_mul(a, 1) == a
+        assert gf_div(gf_mul(a, 0x53), 0x53) == a
+    assert gf_mul(0x53, 0xca) == 0x01
+
+def test_split_and_reconstruct(sss, personal_blockchain):
+    n, k = 5, 3
+    shares_list = sss.split_secret(personal_blockchain, n, k)
+
+    assert len(shares_list) > 1
+    assert all(len(shares) == n for shares in shares_list)
+    assert all(len(y) <= 256 for shares in shares_list for _, y in shares)
+
+    reconstructed_data = sss.reconstruct_secret([shares[:k] for shares in shares_list], k)
+    assert reconstructed_data['owner'] == personal_blockchain.owner
+    assert len(reconstructed_data['chain']) == 4
+    assert reconstructed_data['chain'][-1]['data'] == personal_blockchain.chain[-1].data
+
+def test_different_share_combinations(sss, personal_blockchain):
+    n, k = 6, 4
+    shares_list = sss.split_secret(personal_blockchain, n, k)
+    for _ in range(10):
+        random_shares_list = [random.sample(shares, k) for shares in shares_list]
+        reconstructed_data = sss.reconstruct_secret(random_shares_list, k)
+        assert reconstructed_data['chain'][-1]['hash'] == personal_blockchain.chain[-1].hash
+
+def test_fewer_than_k_shares_reveal_nothing(sss, personal_blockchain):
+    n, k = 5, 3
+    shares_list = sss.split_secret(personal_blockchain, n, k)
+    with pytest.raises(ValueError):
+        sss.reconstruct_secret([shares[:k - 1] for shares in shares_list], k)
+    # Interpolating through k-1 points yields unrelated bytes, not the plaintext
+    with pytest.raises(ValueError):
+        sss.reconstruct_secret([shares[:k - 1] for shares in shares_list], k - 1)
+
+def test_invalid_parameters(sss, personal_blockchain):
+    with pytest.raises(ValueError, match="k must be less than or equal to n"):
+        sss.split_secret(personal_blockchain, 3, 5)
+    with pytest.raises(ValueError, match="n must be at most 255"):
+        sss.split_secret(personal_blockchain, 256, 3)
+
+def test_serialize_round_trip(sss, personal_blockchain):
+    n, k = 5, 3
+    shares_list = sss.split_secret(personal_blockchain, n, k)
+    restored = sss.deserialize_shares(sss.serialize_shares(shares_list))
+    assert restored == shares_list
+
+if __name__ == "__main__":
+    pytest.main([__file__])
@@ -0,0 +1,71 @@
+import pytest
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+from concurrent.futures import ThreadPoolExecutor
+from src.key_pool import KeyPool
+from src.key_schemes import get_key_scheme
+from src.social_network import SocialNetwork
+
+
+@pytest.fixture
+def key_pool():
+    pool = KeyPool("ed25519", size=4, executor=ThreadPoolExecutor(max_workers=2))
+    yield pool
+    pool.close()
+    pool.executor.shutdown()
+
+
+def wait_until_full(pool, timeout=5.0):
+    for future in list(pool.pending):
+        future.result(timeout=timeout)
+
+
+def test_refill_pregenerates_keys(key_pool):
+    key_pool.refill()
+    wait_until_full(key_pool)
+    assert key_pool.available() == 4
+
+
+def test_get_falls_back_to_inline_generation(key_pool):
+    private_key = key_pool.get()
+    assert get_key_scheme("ed25519").owns_key(private_key)
+    wait_until_full(key_pool)
+    assert key_pool.available() == 4
+
+
+@pytest.mark.asyncio
+async def test_acquire_waits_for_background_keys(key_pool):
+    keys = [await key_pool.acquire() for _ in range(10)]
+    assert len(keys) == 10
+    public_bytes = {key.public_key().public_bytes(Encoding.Raw, PublicFormat.Raw) for key in keys}
+    assert len(public_bytes) == 10
+
+
+@pytest.mark.asyncio
+async def test_acquire_from_process_pool():
+    pool = KeyPool("rsa", size=2, max_workers=2)
+    try:
+        private_key = await pool.acquire()
+        assert get_key_scheme("rsa").owns_key(private_key)
+        assert private_key.key_size == 2048
+    finally:
+        pool.close()
+
+
+@pytest.mark.asyncio
+async def test_add_users_uses_key_pool(key_pool, mocker):
+    social_network = SocialNetwork(key_scheme="ed25519", key_pool=key_pool)
+    spy = mocker.spy(key_pool, 'acquire')
+    await social_network.add_users(["User1", "User2", "User3"])
+
+    assert spy.call_count == 3
+    assert set(social_network.users) == {"User1", "User2", "User3"}
+    assert len({blockchain.did for blockchain in social_network.users.values()}) == 3
+    assert all(blockchain.key_scheme.name == "ed25519" for blockchain in social_network.users.values())
+
+
+@pytest.mark.asyncio
+async def test_add_users_without_pool():
+    social_network = SocialNetwork(key_scheme="ed25519")
+    await social_network.add_users(["User1", "User2"])
+    assert set(social_network.users) == {"User1", "User2"}
+    assert social_network.p2p_networks["User2"].nodes["User2"][0] == social_network.start_port + 1
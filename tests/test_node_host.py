@@ -0,0 +1,68 @@
+import pytest
+from src.node_host import NodeHost
+from src.p2p_network import P2PNetwork
+from src.blockchain import PersonalBlockchain
+
+def hosted_nodes(node_host, port, usernames):
+    networks = {}
+    for username in usernames:
+        networks[username] = P2PNetwork(username=username)
+        node_host.attach(networks[username])
+    for network in networks.values():
+        for username in usernames:
+            network.add_node(username, port, f"{username}_id", node_host.path_for(username))
+    return networks
+
+@pytest.mark.asyncio
+async def test_hosted_nodes_deliver_to_each_other_in_process():
+    node_host = NodeHost()
+    networks = hosted_nodes(node_host, 1, ["Alice", "Bob", "Carol"])
+    received = []
+    for username, network in networks.items():
+        network.on_message = lambda sender, message, username=username: received.append((username, sender, message))
+    await networks["Alice"].broadcast("Alice", "hello")
+    await networks["Bob"].gossip("Bob", "rumour", fanout=2, ttl=3)
+    assert sorted(received) == [("Alice", "Bob", "rumour"), ("Bob", "Alice", "hello"),
+                                ("Carol", "Alice", "hello"), ("Carol", "Bob", "rumour")]
+    # Nothing went over a socket: no session or outbox was ever opened
+    assert node_host.session is None and not networks["Alice"].outboxes
+    with pytest.raises(ValueError):
+        await networks["Alice"].start(1)
+    with pytest.raises(ValueError):
+        node_host.attach(P2PNetwork(username="Alice"))
+
+@pytest.mark.asyncio
+async def test_node_host_routes_requests_by_name(unused_tcp_port_factory):
+    port = unused_tcp_port_factory()
+    node_host = NodeHost()
+    networks = hosted_nodes(node_host, port, ["Alice", "Bob"])
+    alice_chain = PersonalBlockchain("Alice")
+    alice_chain.add_block({"message": "Post"})
+    networks["Alice"].serve_chain(alice_chain)
+    node_host.attach(networks["Alice"], alice_chain.did)
+    await networks["Bob"].send_backup("Alice_id", b"slice")
+    await node_host.start(port)
+    remote = P2PNetwork(username="Remote")
+    remote.add_node("Alice", port, "Alice_id", node_host.path_for("Alice"))
+    remote.add_node("Bob", port, "Bob_id", node_host.path_for("Bob"))
+    received = []
+    networks["Alice"].on_message = lambda sender, message: received.append((sender, message))
+    try:
+        await remote.send_data("Alice", "Remote", "over tcp")
+        assert received == [("Remote", "over tcp")]
+        copy = PersonalBlockchain("Alice", private_key=alice_chain.private_key)
+        copy.chain = alice_chain.chain[:1]
+        assert await remote.sync_chain("Alice", copy) == 1
+        assert await remote.fetch_backup("Bob", "Alice_id") == b"slice"
+        session = await remote.get_session()
+        async with session.get(f"http://localhost:{port}{node_host.path_for(alice_chain.did)}/blocks") as response:
+            assert response.status == 200 and response.headers["X-Chain-Length"] == "2"
+        async with session.get(f"http://localhost:{port}/n/Nobody/blocks") as response:
+            assert response.status == 404
+        async with session.get(f"http://localhost:{port}/n/Alice/ws") as response:
+            assert response.status == 404  # Alice's node uses the HTTP transport
+    finally:
+        await remote.stop()
+        for network in networks.values():
+            await network.stop()
+        await node_host.stop()
@@ -1,7 +1,13 @@
+import asyncio
+import logging
 import pytest
 from unittest.mock import AsyncMock, MagicMock, patch
-from src.p2p_network import P2PNetwork
+from src.p2p_network import P2PNetwork, parse_byte_range
+from src.blockchain import PersonalBlockchain
+from src.backup_store import BackupStore
+from src.peer_channel import channel_protocols
 import aiohttp
+from aiohttp import web
 
 @pytest.fixture
 def p2p_network():
@@ -29,29 +35,444 @@ async def test_broadcast(p2p_network, mocker):
 
 @pytest.mark.asyncio
 async def test_send_data(p2p_network):
-    # Mock the entire aiohttp module
-    with patch('src.p2p_network.aiohttp.ClientSession') as mock_session:
+    # Mock the aiohttp session and connector
+    with patch('src.p2p_network.aiohttp.ClientSession') as mock_session, \
+            patch('src.p2p_network.aiohttp.TCPConnector') as mock_connector:
         # Set up the mock response
         mock_response = AsyncMock()
         mock_response.status = 200
 
         # Set up the mock session
-        mock_session_instance = AsyncMock()
+        mock_session_instance = MagicMock()
+        mock_session_instance.closed = False
+        mock_session_instance.close = AsyncMock()
         mock_session_instance.post.return_value.__aenter__.return_value = mock_response
-        mock_session.return_value.__aenter__.return_value = mock_session_instance
+        mock_session.return_value = mock_session_instance
 
         # Add a test node
         p2p_network.add_node("TestUser", 8000, "test_user_id")
 
         # Call the method we're testing
         await p2p_network.send_data("TestUser", "Sender", "Test Message")
+        await p2p_network.send_data("TestUser", "Sender", "Another Message")
 
-        # Assertions
-        mock_session.assert_called_once()
-        mock_session_instance.post.assert_called_once_with(
+        # Assertions: one pooled session serves every message until stop
+        mock_session.assert_called_once_with(connector=mock_connector.return_value)
+        assert mock_connector.call_args.kwargs["limit_per_host"] == p2p_network.connections_per_peer
+        mock_session_instance.post.assert_any_call(
             'http://localhost:8000',
             json={'sender': 'Sender', 'message': 'Test Message'}
         )
+        assert mock_session_instance.post.call_count == 2
+        await p2p_network.stop()
+        mock_session_instance.close.assert_awaited_once()
+        assert p2p_network.session is None
+
+@pytest.mark.asyncio
+async def test_session_reuses_connections(unused_tcp_port_factory):
+    sender, receiver = P2PNetwork(), P2PNetwork()
+    client_addresses = []
+
+    @web.middleware
+    async def record_client(request, handler):
+        client_addresses.append(request.transport.get_extra_info('peername'))
+        return await handler(request)
+
+    receiver.app.middlewares.append(record_client)
+    sender_port, receiver_port = unused_tcp_port_factory(), unused_tcp_port_factory()
+    await sender.start(sender_port)
+    await receiver.start(receiver_port)
+    try:
+        sender.add_node("Receiver", receiver_port, "receiver_id")
+        session = sender.session
+        for i in range(5):
+            await sender.send_data("Receiver", "Sender", f"Message {i}")
+        assert sender.session is session
+        # Keep-alive: the receiver saw every message arrive over the same client connection
+        assert len(client_addresses) == 5 and len(set(client_addresses)) == 1
+    finally:
+        await sender.stop()
+        await receiver.stop()
+    assert session.closed
+
+@pytest.mark.asyncio
+async def test_broadcast_coalesces_queued_messages():
+    p2p_network = P2PNetwork(max_in_flight=1)
+    p2p_network.add_node("User1", 8001, "user1_id")
+    p2p_network.add_node("User2", 8002, "user2_id")
+    delivered = {"User1": [], "User2": []}
+
+    async def send_data(receiver, sender, data):
+        await asyncio.sleep(0.01)
+        delivered[receiver].append(data)
+
+    async def send_batch(receiver, messages):
+        await asyncio.sleep(0.01)
+        delivered[receiver].extend(data for _, data in messages)
+
+    p2p_network.send_data = AsyncMock(side_effect=send_data)
+    p2p_network.send_batch = AsyncMock(side_effect=send_batch)
+    await asyncio.gather(*(p2p_network.broadcast("Sender", f"Post {i}") for i in range(20)))
+
+    # Every post reached both peers in order, in far fewer requests than posts
+    assert delivered == {"User1": [f"Post {i}" for i in range(20)], "User2": [f"Post {i}" for i in range(20)]}
+    assert p2p_network.send_data.call_count + p2p_network.send_batch.call_count < 10
+    await p2p_network.stop()
+
+@pytest.mark.asyncio
+async def test_full_outbox_applies_backpressure():
+    p2p_network = P2PNetwork(outbox_size=2, max_in_flight=1)
+    p2p_network.add_node("User1", 8001, "user1_id")
+    release = asyncio.Event()
+
+    async def send_data(receiver, sender, data):
+        await release.wait()
+
+    p2p_network.send_data = AsyncMock(side_effect=send_data)
+    first = await p2p_network.enqueue("User1", "Sender", "Post 0")
+    await asyncio.sleep(0)  # The worker takes the first message and blocks on the peer
+    queued = [await p2p_network.enqueue("User1", "Sender", f"Post {i}") for i in (1, 2)]
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(p2p_network.enqueue("User1", "Sender", "Post 3"), 0.05)
+
+    release.set()
+    await asyncio.gather(first, *queued)
+    await p2p_network.stop()
+
+@pytest.mark.asyncio
+async def test_batched_broadcast_over_http(unused_tcp_port_factory, caplog):
+    sender, receiver = P2PNetwork(max_in_flight=1), P2PNetwork()
+    sender_port, receiver_port = unused_tcp_port_factory(), unused_tcp_port_factory()
+    await sender.start(sender_port)
+    await receiver.start(receiver_port)
+    try:
+        sender.add_node("Receiver", receiver_port, "receiver_id")
+        with caplog.at_level(logging.INFO):
+            await asyncio.gather(*(sender.broadcast("Sender", f"Post {i}") for i in range(10)))
+        received = [record.message for record in caplog.records if record.message.startswith("Received data")]
+        assert received == [f"Received data from Sender: Post {i}" for i in range(10)]
+        assert any("in one batch" in record.message for record in caplog.records)
+    finally:
+        await sender.stop()
+        await receiver.stop()
+
+@pytest.mark.asyncio
+async def test_websocket_channel_carries_messages(unused_tcp_port_factory, caplog):
+    sender, receiver = P2PNetwork(transport="websocket"), P2PNetwork(transport="websocket")
+    sender_port, receiver_port = unused_tcp_port_factory(), unused_tcp_port_factory()
+    await sender.start(sender_port)
+    await receiver.start(receiver_port)
+    try:
+        sender.add_node("Receiver", receiver_port, "receiver_id")
+        with caplog.at_level(logging.INFO):
+            await sender.send_data("Receiver", "Sender", {"text": "Hello"})
+            await asyncio.gather(*(sender.broadcast("Sender", f"Post {i}") for i in range(5)))
+            await asyncio.sleep(0.1)  # Channel sends return before the peer has read the frames
+        received = [record.message for record in caplog.records if record.message.startswith("Received data")]
+        assert received == ["Received data from Sender: {'text': 'Hello'}"] + \
+            [f"Received data from Sender: Post {i}" for i in range(5)]
+        assert sender.channels["Receiver"].protocol == channel_protocols()[0]
+        assert len(receiver.incoming_channels) == 1
+    finally:
+        await sender.stop()
+        await receiver.stop()
+
+@pytest.mark.asyncio
+async def test_websocket_falls_back_to_http(unused_tcp_port_factory, caplog):
+    sender, receiver = P2PNetwork(transport="websocket"), P2PNetwork()
+    sender_port, receiver_port = unused_tcp_port_factory(), unused_tcp_port_factory()
+    await sender.start(sender_port)
+    await receiver.start(receiver_port)
+    try:
+        sender.add_node("Receiver", receiver_port, "receiver_id")
+        with caplog.at_level(logging.INFO):
+            await sender.send_data("Receiver", "Sender", "Over HTTP")
+            await sender.send_data("Receiver", "Sender", "Still over HTTP")
+        assert sender.http_peers == {"Receiver"}
+        assert "Receiver" not in sender.channels
+        received = [record.message for record in caplog.records if record.message.startswith("Received data")]
+        assert received == ["Received data from Sender: Over HTTP", "Received data from Sender: Still over HTTP"]
+    finally:
+        await sender.stop()
+        await receiver.stop()
+
+@pytest.mark.asyncio
+async def test_failed_channel_backs_off_to_http(unused_tcp_port_factory, caplog):
+    sender, receiver = P2PNetwork(transport="websocket", channel_retry_delay=0.2), P2PNetwork(transport="websocket")
+    sender_port, receiver_port = unused_tcp_port_factory(), unused_tcp_port_factory()
+    await sender.start(sender_port)
+    await receiver.start(receiver_port)
+    try:
+        sender.add_node("Receiver", receiver_port, "receiver_id")
+        session = await sender.get_session()
+        ws_connect = session.ws_connect
+        refused = AsyncMock(side_effect=aiohttp.ClientConnectionError("reset"))
+        with patch.object(session, "ws_connect", refused) as failing:
+            with caplog.at_level(logging.INFO):
+                for i in range(3):
+                    await sender.send_data("Receiver", "Sender", f"Post {i}")
+            # One failed attempt, then HTTP without retrying until the delay has passed
+            assert failing.call_count == 1
+            assert "Receiver" not in sender.http_peers
+        received = [record.message for record in caplog.records if record.message.startswith("Received data")]
+        assert received == [f"Received data from Sender: Post {i}" for i in range(3)]
+
+        await asyncio.sleep(0.2)
+        with patch.object(session, "ws_connect", side_effect=ws_connect) as recovering:
+            await sender.send_data("Receiver", "Sender", "Over the channel")
+            assert recovering.call_count == 1
+        assert "Receiver" in sender.channels and "Receiver" not in sender.channel_retry_at
+    finally:
+        await sender.stop()
+        await receiver.stop()
+
+def gossip_envelope(message_id, ttl, sender="Origin", hop="Origin"):
+    return {'sender': sender, 'message': "Post", 'gossip': {'id': message_id, 'ttl': ttl, 'fanout': 2, 'hop': hop}}
+
+@pytest.mark.asyncio
+async def test_gossip_forwards_once_and_drops_duplicates():
+    p2p_network = P2PNetwork(username="Me", seen_cache_size=2, gossip_fanout=2)
+    for i, username in enumerate(["Me", "Origin", "Peer1", "Peer2", "Peer3"]):
+        p2p_network.add_node(username, 8000 + i, f"{username}_id")
+    p2p_network.send_envelopes = AsyncMock()
+    delivered = []
+    p2p_network.on_message = lambda sender, message: delivered.append(message)
+
+    p2p_network.handle_envelope(gossip_envelope("a", 3))
+    p2p_network.handle_envelope(gossip_envelope("a", 3, hop="Peer1"))
+    await asyncio.gather(*p2p_network.gossip_tasks)
+    assert delivered == ["Post"]
+    # Forwarded to fanout peers other than the origin, the previous hop and this node, one hop shorter
+    targets = [call.args[0] for call in p2p_network.send_envelopes.call_args_list]
+    assert len(targets) == 2 and not {"Me", "Origin"} & set(targets)
+    forwarded = p2p_network.send_envelopes.call_args.args[1][0]
+    assert forwarded['gossip']['ttl'] == 2 and forwarded['gossip']['hop'] == "Me"
+
+    # Last hop: delivered but not forwarded
+    p2p_network.send_envelopes.reset_mock()
+    p2p_network.handle_envelope(gossip_envelope("b", 1))
+    assert not p2p_network.gossip_tasks and p2p_network.send_envelopes.call_count == 0
+
+    # The seen cache is bounded; the oldest id is forgotten first
+    p2p_network.handle_envelope(gossip_envelope("c", 1))
+    assert list(p2p_network.seen_messages) == ["b", "c"]
+    await p2p_network.stop()
+
+@pytest.mark.asyncio
+async def test_gossip_ignores_peer_fanout_and_drops_malformed(unused_tcp_port_factory):
+    p2p_network = P2PNetwork(username="Me", gossip_fanout=2, max_gossip_ttl=4)
+    for i in range(10):
+        p2p_network.add_node(f"Peer{i}", 8000 + i, f"Peer{i}_id")
+    p2p_network.send_envelopes = AsyncMock()
+
+    # A peer asking for a huge fanout and ttl gets this node's fanout and the capped ttl
+    p2p_network.handle_envelope({'sender': "Peer0", 'message': "Post",
+                                 'gossip': {'id': "a", 'ttl': 10 ** 6, 'fanout': 10 ** 6, 'hop': "Peer0"}})
+    await asyncio.gather(*p2p_network.gossip_tasks)
+    assert p2p_network.send_envelopes.call_count == 2
+    assert p2p_network.send_envelopes.call_args.args[1][0]['gossip'] == {'id': "a", 'ttl': 3, 'hop': "Me"}
+
+    p2p_network.send_envelopes.reset_mock()
+    for gossip in ({'ttl': 3}, {'id': "b"}, {'id': "c", 'ttl': "3"}, {'id': ["d"], 'ttl': 3},
+                   {'id': "e", 'ttl': 3, 'hop': ["Peer1"]}, "f"):
+        p2p_network.handle_envelope({'sender': "Peer0", 'message': "Post", 'gossip': gossip})
+    assert not p2p_network.gossip_tasks and p2p_network.send_envelopes.call_count == 0
+
+    # Over HTTP a malformed envelope is dropped rather than failing the whole request
+    port = unused_tcp_port_factory()
+    await p2p_network.start(port)
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f'http://localhost:{port}/',
+                                    json={'sender': "Peer0", 'message': "Post", 'gossip': {'ttl': 3}}) as response:
+                assert response.status == 200
+    finally:
+        await p2p_network.stop()
+
+@pytest.mark.asyncio
+async def test_gossip_reaches_every_node_over_multiple_hops(unused_tcp_port_factory):
+    # A ring: each node only knows its two neighbours, so most nodes are several hops away
+    count = 8
+    ports = [unused_tcp_port_factory() for _ in range(count)]
+    networks = [P2PNetwork(username=f"User{i}") for i in range(count)]
+    received = {i: [] for i in range(count)}
+    sends = []
+    for i, network in enumerate(networks):
+        for j in (i, (i - 1) % count, (i + 1) % count):
+            network.add_node(f"User{j}", ports[j], f"user{j}_id")
+        network.on_message = lambda sender, message, i=i: received[i].append(message)
+        send_envelopes = network.send_envelopes
+
+        async def counted(receiver, envelopes, send_envelopes=send_envelopes):
+            sends.append(receiver)
+            await send_envelopes(receiver, envelopes)
+        network.send_envelopes = counted
+        await network.start(ports[i])
+    try:
+        await networks[0].gossip("User0", "Hello ring", fanout=2, ttl=count)
+        for _ in range(100):
+            if all(received[i] for i in range(1, count)):
+                break
+            await asyncio.sleep(0.02)
+        assert all(received[i] == ["Hello ring"] for i in range(1, count))
+        assert received[0] == []
+        assert len(sends) <= 2 * count  # O(fanout) sends per node
+    finally:
+        for network in networks:
+            await network.stop()
+
+@pytest.mark.asyncio
+async def test_sync_chain_resumes_from_local_tip(unused_tcp_port_factory):
+    source = PersonalBlockchain("TestUser")
+    for i in range(10):
+        source.add_block({"message": f"Post {i}"})
+    source.add_blocks([{"message": f"Batched post {i}"} for i in range(10)])
+    device = PersonalBlockchain("TestUser", private_key=source.private_key)
+    device.chain = source.chain[:5]
+
+    server, client = P2PNetwork(username="TestUser", sync_chunk_size=512), P2PNetwork()
+    server_port, client_port = unused_tcp_port_factory(), unused_tcp_port_factory()
+    server.serve_chain(source)
+    await server.start(server_port)
+    await client.start(client_port)
+    try:
+        client.add_node("Server", server_port, "server_id")
+        assert await client.sync_chain("Server", device) == 16
+        assert [block.hash for block in device.chain] == [block.hash for block in source.chain]
+        assert await client.sync_chain("Server", device) == 0
+        assert device.verify_chain()
+
+        # A tampered block stops the sync right before it
+        source.add_block({"message": "Post 10"})
+        source.add_block({"message": "Post 11"})
+        source.chain[-1].data["data"]["message"] = "Edited"
+        assert await client.sync_chain("Server", device) == 1
+        assert len(device.chain) == len(source.chain) - 1
+
+        # Someone else's chain under the same owner name fails the signature check
+        impostor = PersonalBlockchain("TestUser")
+        impostor.chain = source.chain[:len(device.chain)]
+        impostor.add_block({"message": "Forged"})
+        server.serve_chain(impostor)
+        assert await client.sync_chain("Server", device) == 0
+
+        stranger = PersonalBlockchain("Stranger")
+        assert await client.sync_chain("Server", stranger) == 0  # Not served: 404
+        async with client.session.get(f"http://localhost:{server_port}/blocks", params={"from": "x"}) as response:
+            assert response.status == 400
+    finally:
+        await client.stop()
+        await server.stop()
+
+@pytest.mark.asyncio
+async def test_backups_persist_across_restarts(tmp_path, unused_tcp_port_factory):
+    root = str(tmp_path / "backups")
+    p2p_network = P2PNetwork(username="TestUser", backup_store=BackupStore(root, owner_quota=1024))
+    assert await p2p_network.send_backup("node1", b"\x00share slice")
+    assert await p2p_network.send_backup("node1", {"segments": []}, "manifest")
+    assert not await p2p_network.send_backup("node2", b"x" * 2048)  # Over TestUser's quota
+    await p2p_network.stop()
+
+    port = unused_tcp_port_factory()
+    restarted = P2PNetwork(backup_store=BackupStore(root))
+    await restarted.start(port)
+    try:
+        assert await restarted.request_backup("node1") == b"\x00share slice"
+        assert await restarted.request_backup("node2") is None
+        async with restarted.session.get(f"http://localhost:{port}/backup", params={"node_id": "node1"}) as response:
+            assert response.status == 200 and await response.read() == b"\x00share slice"
+        async with restarted.session.get(f"http://localhost:{port}/backup",
+                                         params={"node_id": "node1", "backup_id": "manifest"}) as response:
+            assert await response.json() == {"segments": []}
+        assert await restarted.discard_backup("node1")
+        assert await restarted.request_backup("node1") is None
+    finally:
+        await restarted.stop()
+
+def test_parse_byte_range():
+    assert parse_byte_range("bytes=0-9", 100) == (0, 10)
+    assert parse_byte_range("bytes=90-", 100) == (90, 100)
+    assert parse_byte_range("bytes=95-200", 100) == (95, 100)
+    assert parse_byte_range("bytes=-10", 100) == (90, 100)
+    assert parse_byte_range("bytes=100-", 100) is None
+    for header in ("bytes=5-1", "items=0-1", "bytes=0-1,5-6", "bytes=-", "bytes=a-b"):
+        with pytest.raises(ValueError):
+            parse_byte_range(header, 100)
+
+@pytest.mark.asyncio
+async def test_backup_endpoint_is_conditional_and_ranged(tmp_path, unused_tcp_port_factory):
+    port = unused_tcp_port_factory()
+    p2p_network = P2PNetwork(backup_store=BackupStore(str(tmp_path / "backups"), cache_bytes=0))
+    p2p_network.backup_chunk_size = 1000
+    payload = bytes(range(256)) * 40
+    await p2p_network.send_backup("node1", payload)
+    await p2p_network.start(port)
+    url = f"http://localhost:{port}/backup"
+    params = {"node_id": "node1"}
+    try:
+        session = p2p_network.session
+        async with session.get(url, params=params) as response:
+            assert response.status == 200 and await response.read() == payload
+            etag = response.headers["ETag"]
+        assert etag == f'"{p2p_network.backups.digest(("node1", None))}"'
+        async with session.get(url, params=params, headers={"If-None-Match": etag}) as response:
+            assert response.status == 304 and await response.read() == b""
+        async with session.get(url, params=params, headers={"Range": "bytes=2500-"}) as response:
+            assert response.status == 206 and await response.read() == payload[2500:]
+            assert response.headers["Content-Range"] == f"bytes 2500-{len(payload) - 1}/{len(payload)}"
+        async with session.get(url, params=params, headers={"Range": "bytes=-10"}) as response:
+            assert response.status == 206 and await response.read() == payload[-10:]
+        async with session.get(url, params=params, headers={"Range": f"bytes={len(payload)}-"}) as response:
+            assert response.status == 416
+        # A stale If-Range means the client's partial copy is of another backup; it gets the whole one
+        async with session.get(url, params=params, headers={"Range": "bytes=10-", "If-Range": '"stale"'}) as response:
+            assert response.status == 200 and await response.read() == payload
+        # If-Range compares strongly: the current tag resumes, its weak form does not
+        async with session.get(url, params=params, headers={"Range": "bytes=10-", "If-Range": etag}) as response:
+            assert response.status == 206 and await response.read() == payload[10:]
+        async with session.get(url, params=params, headers={"Range": "bytes=10-", "If-Range": "W/" + etag}) as response:
+            assert response.status == 200 and await response.read() == payload
+    finally:
+        await p2p_network.stop()
+
+@pytest.mark.asyncio
+async def test_fetch_backup_resumes_and_revalidates(unused_tcp_port_factory):
+    holder_port = unused_tcp_port_factory()
+    holder = P2PNetwork(username="Holder")
+    payload = bytes(range(256)) * 400
+    await holder.send_backup("node1", payload)
+    requests = []
+
+    @aiohttp.web.middleware
+    async def cut_first_transfer(request, handler):
+        requests.append(dict(request.headers))
+        if len(requests) > 1:
+            return await handler(request)
+        response = aiohttp.web.StreamResponse(headers={"ETag": f'"{holder.backups.digest(("node1", None))}"',
+                                                       "Content-Type": "application/octet-stream"})
+        response.content_length = len(payload)
+        await response.prepare(request)
+        await response.write(payload[:40000])
+        request.transport.close()
+        return response
+
+    holder.app.middlewares.append(cut_first_transfer)
+    await holder.start(holder_port)
+    client = P2PNetwork(username="Client")
+    client.add_node("Holder", holder_port, "holder_id")
+    try:
+        assert await client.fetch_backup("Holder", "node1") == payload
+        assert requests[1]["Range"] == "bytes=40000-"
+        assert await client.fetch_backup("Holder", "node1") == payload
+        assert "If-None-Match" in requests[2]
+        assert await client.fetch_backup("Holder", "node2") is None
+    finally:
+        await client.stop()
+        await holder.stop()
+
+def test_unknown_transport():
+    with pytest.raises(ValueError):
+        P2PNetwork(transport="carrier-pigeon")
 
 @pytest.mark.asyncio
 async def test_send_and_request_backup(p2p_network):
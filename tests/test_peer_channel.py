@@ -0,0 +1,29 @@
+import pytest
+from src.peer_channel import (JSON_PROTOCOL, MSGPACK_PROTOCOL, channel_protocols, decode_frames,
+                              encode_frames)
+
+ENVELOPES = [{"sender": "User1", "message": "Hello"},
+             {"sender": "User2", "message": {"text": "héllo ✓", "likes": 3, "tags": ["a", "b"]}}]
+
+def test_json_frames_round_trip():
+    data = encode_frames(JSON_PROTOCOL, ENVELOPES)
+    assert decode_frames(JSON_PROTOCOL, data) == ENVELOPES
+    assert decode_frames(JSON_PROTOCOL, encode_frames(JSON_PROTOCOL, [])) == []
+
+def test_msgpack_frames_round_trip():
+    pytest.importorskip("msgpack")
+    assert channel_protocols()[0] == MSGPACK_PROTOCOL
+    data = encode_frames(MSGPACK_PROTOCOL, ENVELOPES)
+    assert decode_frames(MSGPACK_PROTOCOL, data) == ENVELOPES
+    assert len(data) < len(encode_frames(JSON_PROTOCOL, ENVELOPES))
+
+def test_truncated_frames_are_rejected():
+    data = encode_frames(JSON_PROTOCOL, ENVELOPES)
+    with pytest.raises(ValueError):
+        decode_frames(JSON_PROTOCOL, data[:-1])
+    with pytest.raises(ValueError):
+        decode_frames(JSON_PROTOCOL, data[:2])
+
+def test_unknown_protocol():
+    with pytest.raises(ValueError):
+        encode_frames("glitter.xml", ENVELOPES)
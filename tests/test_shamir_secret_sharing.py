@@ -1,7 +1,16 @@
 import pytest
 import random
-from src.shamir_secret_sharing import ShamirSecretSharing, PRIME
+import io
+import json
+from src.chain_stream import iter_blockchain_json, ChainStreamDecoder
+from src.gf256_secret_sharing import GF256SecretSharing
+from src.block_store import SegmentBlockStore
+from src.share_format import iter_share_containers, detect_scheme, ShareChecksumError, HEADER
+from src.shamir_secret_sharing import (ShamirSecretSharing, PRIME, batch_mod_inverse, lagrange_basis_at_zero,
+                                      serialize_blockchain)
+from src.compression import iter_backup_events
 from src.blockchain import PersonalBlockchain
+from src.block import Block
 
 @pytest.fixture
 def sss():
@@ -93,5 +102,150 @@ def test_different_k_n_values(sss, personal_blockchain):
         with pytest.raises(ValueError):
             sss.reconstruct_secret([shares[:k - 1] for shares in shares_list], k)
 
+def test_batch_mod_inverse():
+    values = [3, 7, 12345, PRIME - 1]
+    for value, inverse in zip(values, batch_mod_inverse(values, PRIME)):
+        assert value * inverse % PRIME == 1
+
+def test_lagrange_basis_is_cached(sss, personal_blockchain):
+    lagrange_basis_at_zero.cache_clear()
+    shares_list = sss.split_secret(personal_blockchain, 5, 3)
+    assert len(shares_list) > 1
+    sss.reconstruct_secret([shares[:3] for shares in shares_list], 3)
+    info = lagrange_basis_at_zero.cache_info()
+    assert info.misses == 1
+    assert info.hits == len(shares_list) - 1
+
+def test_duplicate_x_coordinates_rejected(sss, personal_blockchain):
+    shares_list = sss.split_secret(personal_blockchain, 5, 3)
+    with pytest.raises(ValueError, match="distinct"):
+        sss.reconstruct_secret([[shares[0], shares[0], shares[1]] for shares in shares_list], 3)
+
+def test_iter_blockchain_json_matches_json_dumps(personal_blockchain):
+    personal_blockchain.add_block({"message": "Test Data", "unicode": "héllo ✓"})
+    expected = json.dumps({
+        "owner": personal_blockchain.owner,
+        "chain": [block.to_dict() for block in personal_blockchain.chain]
+    }).encode('utf-8')
+    chunks = list(iter_blockchain_json(personal_blockchain.owner, personal_blockchain.chain, 31))
+    assert b''.join(chunks) == expected
+    assert all(len(chunk) == 31 for chunk in chunks[:-1])
+
+def test_serialize_blockchain_matches_split_document(sss, personal_blockchain):
+    personal_blockchain.add_block({"message": "Test Data"})
+    document = serialize_blockchain(personal_blockchain)
+    assert document == b''.join(iter_blockchain_json(personal_blockchain.owner, personal_blockchain.chain, 1024))
+    assert sss.reconstruct_secret(sss.split_secret(personal_blockchain, 3, 2), 2) == json.loads(document)
+    events = list(iter_backup_events([serialize_blockchain(personal_blockchain, "zlib")], "zlib"))
+    assert [block for _, block in events[1:]] == [block.to_dict() for block in personal_blockchain.chain]
+
+def test_chain_stream_decoder_handles_tiny_feeds(personal_blockchain):
+    personal_blockchain.add_block({"message": "Test Data", "unicode": "héllo ✓"})
+    decoder = ChainStreamDecoder()
+    events = []
+    for chunk in iter_blockchain_json(personal_blockchain.owner, personal_blockchain.chain, 1):
+        events.extend(decoder.feed(chunk))
+    events.extend(decoder.finish())
+    assert events[0] == ("owner", personal_blockchain.owner)
+    assert [block for _, block in events[1:]] == [block.to_dict() for block in personal_blockchain.chain]
+
+def test_chain_stream_decoder_rejects_truncated_stream(personal_blockchain):
+    document = b''.join(iter_blockchain_json(personal_blockchain.owner, personal_blockchain.chain, 1024))
+    decoder = ChainStreamDecoder()
+    list(decoder.feed(document[:-10]))
+    with pytest.raises(ValueError):
+        list(decoder.finish())
+
+def test_chain_stream_decoder_checks_seal_digest(personal_blockchain):
+    personal_blockchain.add_block({"message": "Test Data"})
+    document = b''.join(iter_blockchain_json(personal_blockchain.owner, personal_blockchain.chain, 1024,
+                                             personal_blockchain.sign_data))
+    decoder = ChainStreamDecoder()
+    events = []
+    for i in range(0, len(document), 7):
+        events.extend(decoder.feed(document[i:i + 7]))
+    events.extend(decoder.finish())
+    kind, seal = events[-1]
+    assert kind == "seal"
+    assert (seal["start"], seal["length"], seal["tip_hash"]) == (0, 2, personal_blockchain.chain[-1].hash)
+
+    tampered = document.replace(b'Test Data', b'Test Date')
+    with pytest.raises(ValueError):
+        list(ChainStreamDecoder().feed(tampered))
+
+@pytest.mark.parametrize("engine", [ShamirSecretSharing(PRIME), GF256SecretSharing(chunk_size=128)])
+def test_split_stream_to_sinks_and_restore(engine, personal_blockchain, tmp_path):
+    for i in range(5):
+        personal_blockchain.add_block({"message": f"Post {i}"})
+    n, k = 5, 3
+    sinks = [io.BytesIO() for _ in range(n)]
+    rows = sum(1 for _ in engine.split_stream(personal_blockchain, n, k, sinks))
+    assert rows > 1
+
+    sources = {x: io.BytesIO(sinks[x - 1].getvalue()) for x in (2, 4, 5)}
+    events = engine.reconstruct_stream(engine.read_share_rows(sources), k)
+    assert next(events) == ("owner", personal_blockchain.owner)
+    store = SegmentBlockStore(str(tmp_path / "restored"))
+    for kind, block in events:
+        assert kind == "block"
+        store.append(Block.from_dict(block))
+    assert [block.hash for block in store] == [block.hash for block in personal_blockchain.chain]
+    store.close()
+
+def test_binary_share_containers(sss, personal_blockchain):
+    n, k = 5, 3
+    shares_list = sss.split_secret(personal_blockchain, n, k)
+    serialized = sss.serialize_shares(shares_list, k)
+
+    containers = list(iter_share_containers(serialized))
+    assert [container.x for container in containers] == [1, 2, 3, 4, 5]
+    assert all(container.k == k and container.n == n for container in containers)
+    assert all(container.chunk_count == len(shares_list) for container in containers)
+    assert detect_scheme(serialized) == "prime"
+    # Header plus 32-byte y-values and 4-byte checksums, nothing else
+    assert len(serialized) == n * (HEADER.size + len(shares_list) * (32 + 4))
+    assert sss.deserialize_shares(serialized) == shares_list
+
+def test_share_container_values_are_zero_copy(sss, personal_blockchain):
+    serialized = bytearray(sss.serialize_shares(sss.split_secret(personal_blockchain, 5, 3), 3))
+    container = next(iter_share_containers(serialized))
+    first = next(container.values())
+    assert isinstance(first, memoryview)
+    assert first.obj is serialized
+
+def test_share_checksum_detects_corruption(sss, personal_blockchain):
+    serialized = bytearray(sss.serialize_shares(sss.split_secret(personal_blockchain, 5, 3), 3))
+    containers = list(iter_share_containers(serialized))
+    size = len(serialized) // len(containers)
+    serialized[2 * size + HEADER.size + 40] ^= 0xFF
+    with pytest.raises(ShareChecksumError) as error:
+        sss.deserialize_shares(serialized)
+    assert error.value.x == 3
+
+def test_share_containers_without_checksum(sss, personal_blockchain):
+    shares_list = sss.split_secret(personal_blockchain, 5, 3)
+    serialized = sss.serialize_shares(shares_list, 3, checksum=False)
+    assert len(serialized) == 5 * (HEADER.size + len(shares_list) * 32)
+    assert sss.deserialize_shares(serialized) == shares_list
+
+def test_sentinel_keeps_leading_zero_bytes(sss):
+    chunk = b'\x00\x00\x07' + bytes(range(28))
+    assert len(chunk) == sss.chunk_size
+    for data in (chunk, b'\x00', b'\x00\x01'):
+        assert sss._reconstruct_chunk(sss._split_chunk(data, 5, 3)[1:4], 3) == data
+
+def test_compressed_split_and_reconstruct(sss, personal_blockchain):
+    for i in range(10):
+        personal_blockchain.add_block({"message": f"Post {i}"})
+    n, k = 5, 3
+    plain = sss.split_secret(personal_blockchain, n, k)
+    compressed = sss.split_secret(personal_blockchain, n, k, codec="zlib-dict")
+    assert len(compressed) < len(plain)
+
+    serialized = sss.serialize_shares(compressed, k, codec="zlib-dict")
+    assert {container.codec for container in iter_share_containers(serialized)} == {"zlib-dict"}
+    reconstructed = sss.reconstruct_secret(compressed, k, codec="zlib-dict")
+    assert [block["hash"] for block in reconstructed["chain"]] == [block.hash for block in personal_blockchain.chain]
+
 if __name__ == "__main__":
     pytest.main([__file__])
\ No newline at end of file
@@ -0,0 +1,34 @@
+import asyncio
+import pytest
+from src.sharded_runtime import ShardedSocialNetwork, shard_of
+
+def test_shard_of_is_stable():
+    assert shard_of("User1", 4) == shard_of("User1", 4)
+    assert {shard_of(f"User{i}", 4) for i in range(64)} == {0, 1, 2, 3}
+
+@pytest.mark.asyncio
+async def test_sharded_runtime_routes_calls_to_owning_shards():
+    network = ShardedSocialNetwork(workers=2, start_port=0, key_scheme="ed25519")
+    await network.start()
+    try:
+        assert len(set(network.ports)) == 2
+        usernames = [f"User{i}" for i in range(6)]
+        assert {network.shard_of(username) for username in usernames} == {0, 1}
+        await network.add_users(usernames)
+        await asyncio.gather(*(network.post_data(username, {"message": f"Post {i}"})
+                               for username in usernames for i in range(3)))
+        assert [await network.chain_length(username) for username in usernames] == [4] * 6
+
+        # Contacts on both shards hold the backup; cross-shard messages go over the shards' listeners
+        owner = usernames[0]
+        for username in usernames[1:5]:
+            assert await network.connect_users(owner, username)
+        await network.propagate_data(owner, "Test Data")
+        assert await network.create_and_distribute_backup(owner)
+        assert await network.restore_from_backup(owner)
+        assert not await network.connect_users(owner, "Nobody")
+        with pytest.raises(ValueError):
+            await network.call(0, "drop_users")
+    finally:
+        await network.stop()
+    assert not network.processes
@@ -1,8 +1,13 @@
+import asyncio
+import os
 import pytest
 from src.social_network import SocialNetwork
 from src.p2p_network import P2PNetwork
+from src.blockchain import PersonalBlockchain
+from src.share_format import iter_share_containers
 import logging
-from unittest.mock import AsyncMock, patch
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import AsyncMock, MagicMock, patch
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -19,6 +24,34 @@ def test_add_user(social_network):
     assert "TestUser" in social_network.users
     assert "TestUser" in social_network.connections
 
+@pytest.mark.asyncio
+async def test_stored_chain_survives_restart(tmp_path):
+    storage_dir = str(tmp_path)
+    network = SocialNetwork(storage_dir=storage_dir)
+    network.add_user("A")
+    network.post_data("A", {"message": "Before restart"})
+    did = network.users["A"].did
+    await network.stop()
+    assert os.stat(os.path.join(storage_dir, "A.key")).st_mode & 0o777 == 0o600
+
+    # The key is stored with the chain, so the history verifies and new posts are signed with the same key
+    for restart in range(2):
+        restarted = SocialNetwork(storage_dir=storage_dir)
+        if restart:
+            await restarted.add_users(["A"])
+        else:
+            restarted.add_user("A")
+        blockchain = restarted.users["A"]
+        assert blockchain.did == did
+        restarted.post_data("A", {"message": f"After restart {restart}"})
+        assert blockchain.verify_chain() and len(blockchain.chain) == 3 + restart
+        await restarted.stop()
+
+    # A chain written under another key is refused instead of coming back unverifiable
+    os.remove(os.path.join(storage_dir, "A.key"))
+    with pytest.raises(ValueError, match="chain of A"):
+        SocialNetwork(storage_dir=storage_dir).add_user("A")
+
 def test_connect_users(social_network):
     social_network.add_user("User1")
     social_network.add_user("User2")
@@ -48,6 +81,70 @@ def test_add_trusted_connection(social_network):
     user1_blockchain = social_network.users["User1"]
     assert any(node.node_id == "User2_id" for node in user1_blockchain.trusted_nodes)
 
+@pytest.mark.asyncio
+async def test_propagate_data_by_gossip():
+    social_network = SocialNetwork(propagation="gossip", gossip_fanout=2)
+    with patch.object(P2PNetwork, 'gossip', new_callable=AsyncMock) as mock_gossip:
+        for i in range(8):
+            social_network.add_user(f"User{i}")
+        social_network.connect_users("User0", "User1")
+        await social_network.propagate_data("User0", "Test Data")
+        mock_gossip.assert_called_once_with("User0", "Test Data", 2, 5)
+    assert social_network.p2p_networks["User0"].username == "User0"
+    with pytest.raises(ValueError):
+        SocialNetwork(propagation="flood")
+
+@pytest.mark.asyncio
+async def test_shared_hosting(unused_tcp_port_factory):
+    social_network = SocialNetwork(start_port=unused_tcp_port_factory(), hosting="shared")
+    for i in range(3):
+        social_network.add_user(f"User{i}")
+    social_network.connect_users("User0", "User1")
+    social_network.connect_users("User0", "User2")
+    assert {network.nodes[username][0] for username, network in social_network.p2p_networks.items()} \
+        == {social_network.start_port}
+    received = []
+    for username in ("User1", "User2"):
+        social_network.p2p_networks[username].on_message = \
+            lambda sender, message, username=username: received.append((username, message))
+    mirror = social_network.users["User1"]
+    mirror.add_block({"message": "Post"})
+    device = PersonalBlockchain("User1", private_key=mirror.private_key)
+    device.chain = mirror.chain[:1]
+    social_network.p2p_networks["User0"].serve_chain(mirror)
+    social_network.users["User1"] = device
+    await social_network.start()
+    try:
+        await social_network.propagate_data("User0", "Test Data")
+        assert sorted(received) == [("User1", "Test Data"), ("User2", "Test Data")]
+        # Requests still go through the shared listener, routed by path
+        assert await social_network.sync_chain("User1", "User0") == 1
+    finally:
+        await social_network.stop()
+    with pytest.raises(ValueError):
+        SocialNetwork(hosting="cloud")
+
+@pytest.mark.asyncio
+async def test_sync_chain_from_peer(unused_tcp_port_factory):
+    social_network = SocialNetwork(start_port=unused_tcp_port_factory())
+    social_network.add_user("User1")
+    social_network.add_user("User2")
+    social_network.connect_users("User1", "User2")
+    # User2's node holds a newer copy of User1's chain
+    mirror = social_network.users["User1"]
+    for i in range(3):
+        mirror.add_block({"message": f"Post {i}"})
+    device = PersonalBlockchain("User1", private_key=mirror.private_key)
+    device.chain = mirror.chain[:1]
+    social_network.p2p_networks["User2"].serve_chain(mirror)
+    social_network.users["User1"] = device
+    await social_network.start()
+    try:
+        assert await social_network.sync_chain("User1", "User2") == 3
+        assert [block.hash for block in device.chain] == [block.hash for block in mirror.chain]
+    finally:
+        await social_network.stop()
+
 @pytest.mark.asyncio
 async def test_create_and_distribute_backup(social_network):
     social_network.add_user("TestUser")
@@ -59,6 +156,12 @@ async def test_create_and_distribute_backup(social_network):
     success = await social_network.create_and_distribute_backup("TestUser")
     assert success, "Failed to create and distribute backup"
 
+    # Every trusted node gets a different slice holding only its own shares
+    backups = social_network.p2p_networks["TestUser"].backups
+    assert len(backups) == social_network.total_shares
+    holders = [[container.x for container in iter_share_containers(backup)] for backup in backups.values()]
+    assert sorted(holders) == [[x] for x in range(1, social_network.total_shares + 1)]
+
 @pytest.mark.asyncio
 async def test_restore_from_backup(social_network):
     social_network.add_user("TestUser")
@@ -91,5 +194,149 @@ async def test_restore_from_backup(social_network):
     success = await social_network.restore_from_backup("TestUser")
     assert not success, "Unexpectedly succeeded with insufficient trusted nodes"
 
+@pytest.mark.asyncio
+async def test_incremental_backup_and_restore():
+    social_network = SocialNetwork(incremental_backups=True)
+    social_network.add_user("TestUser")
+    for i in range(social_network.total_shares):
+        social_network.add_user(f"TrustedNode{i}")
+        social_network.add_trusted_connection("TestUser", f"TrustedNode{i}", "contact")
+    p2p_network = social_network.p2p_networks["TestUser"]
+    send_backup = AsyncMock(wraps=p2p_network.send_backup)
+    p2p_network.send_backup = send_backup
+
+    social_network.post_data("TestUser", "First post")
+    assert await social_network.create_and_distribute_backup("TestUser")
+    social_network.post_data("TestUser", "Second post")
+    send_backup.reset_mock()
+    assert await social_network.create_and_distribute_backup("TestUser")
+
+    # The second round only ships the delta slices and the updated manifest
+    backup_ids = {call.args[2] for call in send_backup.call_args_list}
+    assert backup_ids == {"delta-2-3", "manifest"}
+
+    original_chain = social_network.users["TestUser"].chain
+    social_network.users["TestUser"].chain = []
+    assert await social_network.restore_from_backup("TestUser")
+    restored_chain = social_network.users["TestUser"].chain
+    assert [block.hash for block in restored_chain] == [block.hash for block in original_chain]
+
+@pytest.mark.asyncio
+async def test_backup_uses_shared_executor():
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        social_network = SocialNetwork(backup_executor=executor)
+        social_network.add_user("TestUser")
+        for i in range(social_network.total_shares):
+            social_network.add_user(f"TrustedNode{i}")
+            social_network.add_trusted_connection("TestUser", f"TrustedNode{i}", "contact")
+        social_network.post_data("TestUser", "Test data for backup")
+
+        submit = MagicMock(wraps=executor.submit)
+        executor.submit = submit
+        assert await social_network.create_and_distribute_backup("TestUser")
+        assert submit.called
+        original_chain = social_network.users["TestUser"].chain
+        social_network.users["TestUser"].chain = []
+        assert await social_network.restore_from_backup("TestUser")
+        assert len(social_network.users["TestUser"].chain) == len(original_chain)
+
+        # A caller-supplied pool outlives the network
+        await social_network.stop()
+        assert social_network.backup_executor is executor
+        assert executor.submit(lambda: 1).result() == 1
+
+async def distribute_backup(social_network):
+    social_network.add_user("TestUser")
+    for i in range(social_network.total_shares):
+        social_network.add_user(f"TrustedNode{i}")
+        social_network.add_trusted_connection("TestUser", f"TrustedNode{i}", "contact")
+    social_network.post_data("TestUser", "Test data for backup")
+    assert await social_network.create_and_distribute_backup("TestUser")
+    return social_network.p2p_networks["TestUser"]
+
+@pytest.mark.asyncio
+async def test_restore_completes_with_fastest_quorum(social_network):
+    p2p_network = await distribute_backup(social_network)
+    stored = dict(p2p_network.backups)
+    trusted_ids = [node.node_id for node in social_network.users["TestUser"].trusted_nodes]
+    cancelled = []
+
+    async def request_backup(node_id, backup_id=None):
+        if node_id == trusted_ids[0]:
+            try:
+                await asyncio.sleep(30)  # Stalled holder
+            except asyncio.CancelledError:
+                cancelled.append(node_id)
+                raise
+        if node_id in down:
+            raise ConnectionError("holder is down")
+        await asyncio.sleep(0.01)
+        return stored[(node_id, backup_id)]
+
+    down = set()
+    p2p_network.request_backup = request_backup
+    social_network.backup_hedge_delay = 5.0
+    social_network.users["TestUser"].chain = []
+    start = asyncio.get_running_loop().time()
+    assert await social_network.restore_from_backup("TestUser")
+    # Done once the three healthy holders answered; the stalled request was cancelled, not waited out
+    assert asyncio.get_running_loop().time() - start < 1.0
+    assert len(social_network.users["TestUser"].chain) == 2
+    assert cancelled == [trusted_ids[0]]
+
+    # With a second holder down the quorum is lost once the stalled request times out
+    down.add(trusted_ids[1])
+    social_network.backup_request_timeout = 0.1
+    social_network.users["TestUser"].chain = []
+    assert not await asyncio.wait_for(social_network.restore_from_backup("TestUser"), 5)
+
+@pytest.mark.asyncio
+async def test_hedged_request_and_invalid_slices(social_network):
+    p2p_network = await distribute_backup(social_network)
+    stored = dict(p2p_network.backups)
+    trusted_ids = [node.node_id for node in social_network.users["TestUser"].trusted_nodes]
+    calls = {node_id: 0 for node_id in trusted_ids}
+
+    async def request_backup(node_id, backup_id=None):
+        calls[node_id] += 1
+        if node_id == trusted_ids[0] and calls[node_id] == 1:
+            await asyncio.sleep(30)  # First attempt hangs, the hedged one answers
+        if node_id == trusted_ids[1]:
+            corrupted = bytearray(stored[(node_id, backup_id)])
+            corrupted[-1] ^= 0xFF
+            return bytes(corrupted)
+        return stored[(node_id, backup_id)]
+
+    p2p_network.request_backup = request_backup
+    social_network.backup_hedge_delay = 0.05
+    social_network.users["TestUser"].chain = []
+    assert await asyncio.wait_for(social_network.restore_from_backup("TestUser"), 5)
+    assert calls[trusted_ids[0]] == 2
+    assert len(social_network.users["TestUser"].chain) == 2
+
+@pytest.mark.asyncio
+async def test_restore_reports_holder_with_tampered_slice(social_network, caplog):
+    p2p_network = await distribute_backup(social_network)
+    stored = dict(p2p_network.backups)
+    trusted_ids = [node.node_id for node in social_network.users["TestUser"].trusted_nodes]
+    backup_manager = social_network.users["TestUser"].backup_manager
+    rows = backup_manager.sss.deserialize_shares(stored[(trusted_ids[0], None)])
+    rows[0][0] = (rows[0][0][0], rows[0][0][1] ^ 1)
+    tampered = backup_manager.sss.serialize_share_slices(rows, social_network.backup_threshold)[0]
+
+    async def request_backup(node_id, backup_id=None):
+        if node_id == trusted_ids[0]:
+            return tampered  # Passes its checksums, answers first and lands in the first quorum
+        await asyncio.sleep(0.01)
+        return stored[(node_id, backup_id)]
+
+    p2p_network.request_backup = request_backup
+    original_hashes = [block.hash for block in social_network.users["TestUser"].chain]
+    social_network.users["TestUser"].chain = []
+    assert await asyncio.wait_for(social_network.restore_from_backup("TestUser"), 5)
+    assert [block.hash for block in social_network.users["TestUser"].chain] == original_hashes
+    assert backup_manager.bad_holders == [1]
+    assert f"Node {trusted_ids[0]} sent a corrupted backup slice" in caplog.text
+
 if __name__ == "__main__":
     pytest.main([__file__])
\ No newline at end of file